@@ -3,6 +3,9 @@
 #computation time
 startglobal=$(date +%s.%N)
 #
+# stage timings and memory of all the scripts (JSON lines or Prometheus text file, cf. Toolbox/CSAR_Metrics.py)
+#export CORESYF_METRICS=$(pwd)/metrics.prom
+#
 
 echo "---------------------------------------------------------------"
 echo "	SAR image Processing and bathymetry estimation	"
@@ -21,14 +24,18 @@ python SAR_Tiling.py -a Config_Image.ini -i Aveiro.tif -b bathymetry.npz -p cont
 ## 2) Spectra estimate (parallel)
 ##*****************************************
 
+## (add --plots for the figures of the subsets and spectra of each grid point, in Output/SubsetSpectra)
 fun1 () {
-	local filename=$1
-	fname=$(echo $filename| cut -d'/' -f 4)
-	python SAR_Spectrum.py -i $fname -a Config_Spectrum.ini -c 290 -m 'Radial' -p 5 -d 100 -v
+	local chunk=$1
+	[ -s $chunk ] && python SAR_Spectrum.py -i $(cat $chunk) -a Config_Spectrum.ini -c 290 -m 'Radial' -p 5 -d 100 -v
 }
 ##for filename in subset0*.out; do fun1 "$filename" & done 
-for filename in sub*.out; do fun1 "$filename" & done 
+## one worker per processor, each with a contiguous chunk of the spatially ordered subsets
+## (neighbouring grid points share FFT boxes, whose spectra are computed once per worker)
+split -n l/$(nproc) -d SpectrumWorkOrder.txt SpectrumChunk
+for chunk in SpectrumChunk*; do fun1 "$chunk" & done 
 wait
+rm -f SpectrumChunk*
 
 
 ##*****************************************************************
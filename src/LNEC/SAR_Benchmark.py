@@ -0,0 +1,330 @@
+#!/usr/bin/python2.7
+# -*- coding: utf-8 -*-
+
+"""
+=====================================================================================================
+ Co-ReSyF Research Application: benchmark of the processing stages on synthetic inputs
+
+ Time the computing kernels of the Toolbox on synthetic swell subscenes (no input data needed):
+
+	ComputeSpectrum (Waves and Radial methods)	DirectionalIntegration		RadialProjection
+	ButterworthEllipticFilter	ImageFilter	PeakDetection and PeakDetectionBatch (each method)
+	InterpolateBathymetry (each method)		isodata classification (streaming engine)
+	ContrastStretch (each method, the scene CLAHE on a thread pool)
+
+ for several box (subscene) and grid sizes and, optionally (stage "chain"), the full processing chain
+ (SAR_SyntheticScene, SAR_Tiling, SAR_Spectrum, SAR_GridPoints_Subdivision, SAR_Inversion,
+ SAR_Postprocessing) in a temporary directory. Each case runs in a separate process and reports
+ its wall time (best and mean of the repetitions), peak resident memory and throughput (points,
+ boxes or pixels per second). The results are saved in a JSON file to compare revisions:
+
+	python SAR_Benchmark.py -o benchmark.json -b 64 128 256 -g 50 100
+	python SAR_Benchmark.py -o float32.json -s spectrum filter -P float32
+	python SAR_Benchmark.py -o chain.json -s chain --chain_size 2000 --chain_points 25
+
+ Date: Oct/2026
+=====================================================================================================
+"""
+
+import os, sys, glob, json, time, shutil, tempfile, platform, resource, subprocess
+import Queue
+import multiprocessing
+#
+import argparse
+#
+import numpy as np
+#
+import Toolbox.CSAR_Classes as CL
+import Toolbox.CSAR_Spectrum as SP
+import Toolbox.CSAR_Utilities as UT
+import Toolbox.CSAR_ROI as ROI
+import Toolbox.CSAR_ImageProcessing as IP
+#
+
+############################
+# input parameters
+############################
+parser = argparse.ArgumentParser(description='Co-ReSyF: SAR Bathymetry Research Application (benchmark)')
+parser.add_argument('-o', '--output', help='Output JSON file with the benchmark results', default='benchmark.json', required=False)
+parser.add_argument('-s', '--stages', nargs='+', help='Stages to benchmark (spectrum, direction, radial, filter, peak, interpolation, isodata, contrast, chain)',
+	default=['spectrum', 'direction', 'radial', 'filter', 'peak', 'interpolation', 'isodata', 'contrast'], required=False)
+parser.add_argument('-b', '--box_sizes', nargs='+', help='Dimensions of the synthetic subscenes (pixels)', default=[64, 128, 256], type=int, required=False)
+parser.add_argument('-g', '--grid_sizes', nargs='+', help='Dimensions of the bathymetry grids (nodes per side) for the interpolation', default=[50, 100, 200], type=int, required=False)
+parser.add_argument('-I', '--image_sizes', nargs='+', help='Dimensions of the images (pixels per side) for the isodata classification and contrast stretch', default=[512, 1024], type=int, required=False)
+parser.add_argument('-n', '--points', help='Number of grid points (spectrum stage and interpolated points)', default=4, type=int, required=False)
+parser.add_argument('--peak_batch', help='Number of spectra of the batched peak detection', default=64, type=int, required=False)
+parser.add_argument('-w', '--window', help='Number of FFT boxes per grid point (5 or 9)', default=5, type=int, required=False)
+parser.add_argument('-r', '--repeat', help='Repetitions of each case (the best and mean times are reported)', default=3, type=int, required=False)
+parser.add_argument('-R', '--resolution', help='Pixel resolution of the synthetic subscenes (m)', default=10., type=float, required=False)
+parser.add_argument('-L', '--wavelength', help='Wavelength of the synthetic swell (m)', default=200., type=float, required=False)
+parser.add_argument('-D', '--direction', help='Direction of the synthetic swell (nautical, degrees)', default=290., type=float, required=False)
+parser.add_argument('-P', '--precision', help='Precision of the spectrum computations', choices=['float64', 'float32'], default='float64', required=False)
+parser.add_argument('--chain_size', help='Dimension (pixels per side) of the synthetic scene of the full chain', default=1000, type=int, required=False)
+parser.add_argument('--chain_points', help='Number of grid points of the full chain', default=16, type=int, required=False)
+parser.add_argument('--seed', help='Seed of the random generator', default=0, type=int, required=False)
+parser.add_argument('-v','--verbose', help="comments and screen outputs", action="store_true")
+
+args = parser.parse_args()
+LNEC = os.path.dirname(os.path.abspath(__file__))
+
+#-------------------------------------------------------------------
+# synthetic inputs
+#-------------------------------------------------------------------
+def SwellImage(size, seed):
+	#------------------------------------------------------------------
+	# speckled swell subscene (size x size pixels) and its coordinates
+	#------------------------------------------------------------------
+	rng = np.random.RandomState(seed)
+	res = args.resolution; angle = np.radians(UT.CartesianNautical(args.direction))
+	easting, northing = np.meshgrid(np.arange(size) * res, -np.arange(size) * res)
+	k = 2 * np.pi / args.wavelength
+	swell = 1 + 0.3 * np.cos(k * (easting * np.cos(angle) + northing * np.sin(angle)) + rng.uniform(0, 2 * np.pi))
+	image = np.clip(500 * swell * rng.gamma(4, 0.25, swell.shape), 1, 65535)
+	return image, CL.Coordinates(northing, easting)
+
+def SwellSubsets(size, seed):
+	#------------------------------------------------------
+	# FFT boxes of a grid point (as created by SAR_Tiling)
+	#------------------------------------------------------
+	Subsets = []
+	for box in range(args.window):
+		image, coordinates = SwellImage(size, seed * args.window + box)
+		Subsets.append(CL.Subset(box, image, coordinates, np.array([args.resolution, args.resolution]), False))
+	return Subsets
+
+def SpectrumParameters(method):
+	#-------------------------------------------------------------
+	# computing parameters (as given by InputSpectrumParameters)
+	#-------------------------------------------------------------
+	WavesSpectrumParameters = CL.WaveSpectrumParameters(method, 5, 50.) if method == 'Waves' else CL.WaveSpectrumParameters(method)
+	SP_Parameters =	CL.SpectrumParameters(WavesSpectrumParameters, CL.WavelengthEstimationParameters())
+	return CL.ComputingParametersSpectrum(CL.SubsetProcessingParameters(), CL.DirectionEstimateParameters(270.),
+			CL.FilterParameters(True), SP_Parameters, args.precision)
+
+def PowerSpectrum(size):
+	#-----------------------------------------
+	# centered power spectrum of a subscene
+	#-----------------------------------------
+	image, coordinates = SwellImage(size, args.seed)
+	subset = CL.Subset(0, image, coordinates, np.array([args.resolution, args.resolution]), False)
+	return SP.ImageSpectrum(SpectrumParameters('Radial').SubsetProcessingParameters, subset).Spectrum
+
+def PeakData(size):
+	#--------------------------------------------------
+	# noisy wave spectrum (Rayleigh shape, size bins)
+	#--------------------------------------------------
+	rng = np.random.RandomState(args.seed)
+	k = np.linspace(0, 0.2, size); kp = 2 * np.pi / args.wavelength
+	spectrum = (k / kp**2) * np.exp(-k**2 / (2 * kp**2)) * (1 + 0.05 * rng.randn(size))
+	return CL.DataPeak(k, spectrum)
+
+def PeakSpectra(size, rows):
+	#---------------------------------------------------------------------
+	# noisy wave spectra (rows) with peak wavelengths around the swell one
+	#---------------------------------------------------------------------
+	rng = np.random.RandomState(args.seed)
+	k = np.linspace(0, 0.2, size); kp = 2 * np.pi / (args.wavelength * rng.uniform(0.8, 1.2, (rows, 1)))
+	return k, (k / kp**2) * np.exp(-k**2 / (2 * kp**2)) * (1 + 0.05 * rng.randn(rows, size))
+
+def BathymetryGrid(size):
+	#--------------------------------------------------------------------
+	# planar beach bathymetry grid (size x size nodes, 50m spacing) and
+	# randomly located points to interpolate
+	#--------------------------------------------------------------------
+	rng = np.random.RandomState(args.seed)
+	easting = np.arange(size) * 50.; northing = np.arange(size) * 50.
+	bathy = np.tile(-5 - 0.01 * (easting.max() - easting), (size, 1))
+	bathydata = CL.BathymetryData(CL.Coordinates(northing, easting), bathy)
+	points = CL.Coordinates(rng.uniform(0, northing.max(), args.points), rng.uniform(0, easting.max(), args.points))
+	return points, bathydata
+
+#-------------------------------------------------------------------
+# measurement (one process per case)
+#-------------------------------------------------------------------
+def CurrentRSS():
+	#------------------------------
+	# resident memory (kB, Linux)
+	#------------------------------
+	try:
+		with open('/proc/self/statm') as f:
+			return int(f.read().split()[1]) * resource.getpagesize() / 1024
+	except (IOError, IndexError):
+		return 0
+
+def RunCase(setup, function, queue):
+	#-------------------------------------------------------------------
+	# build the inputs, time the repetitions and report the peak memory
+	#-------------------------------------------------------------------
+	try:
+		data = setup()
+		rss = CurrentRSS(); times = []
+		for i in range(args.repeat):
+			start = time.time()
+			function(data)
+			times.append(time.time() - start)
+		queue.put((times, rss, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, None))
+	except Exception, message:
+		queue.put(([], 0, 0, str(message) or message.__class__.__name__))
+
+def Measure(stage, case, setup, function, count, unit):
+	#------------------------------------------------------------------
+	# run a case in a child process (for an independent peak memory)
+	#------------------------------------------------------------------
+	queue = multiprocessing.Queue()
+	process = multiprocessing.Process(target=RunCase, args=(setup, function, queue))
+	process.start(); report = None
+	while report is None:
+		# the child may die without reporting (e.g. killed when out of memory)
+		alive = process.is_alive()
+		try:
+			report = queue.get(timeout=1)
+		except Queue.Empty:
+			if not alive:
+				break
+	process.join()
+	if report is None:
+		code = process.exitcode
+		report = ([], 0, 0, 'process killed by signal %d' % -code if code < 0 else 'process exited with status %d' % code)
+	times, rss, maxrss, error = report
+	result = {'stage': stage, 'case': case, 'count': count, 'unit': unit}
+	if error is not None:
+		result['error'] = error
+	else:
+		best = min(times)
+		result.update({'best_s': best, 'mean_s': np.mean(times), 'repeat': len(times),
+			'peak_rss_mb': maxrss / 1024., 'rss_increase_mb': max(maxrss - rss, 0) / 1024.,
+			'rate_per_s': count / best if best > 0 else None})
+	if args.verbose:
+		print stage, case, ('error: ' + result['error']) if 'error' in result else \
+			'%.4fs  %.1f MB  %.1f %s/s' % (result['best_s'], result['peak_rss_mb'], result['rate_per_s'] or 0, unit)
+	results.append(result)
+
+def RunChain(directory):
+	#---------------------------------------------------------------------------
+	# full processing chain on a synthetic scene (one process per script call)
+	#---------------------------------------------------------------------------
+	def Script(stage, name, *options):
+		command = [sys.executable, os.path.join(LNEC, name)] + [str(option) for option in options]
+		start = time.time()
+		with open(os.devnull, 'w') as devnull:
+			process = subprocess.Popen(command, cwd=directory, stdout=devnull, stderr=subprocess.STDOUT)
+			_, status, usage = os.wait4(process.pid, 0)
+		elapsed = time.time() - start
+		if status != 0:
+			raise Exception(' '.join(command[1:]) + ' failed')
+		stages.setdefault(stage, [0., 0, 0]); stages[stage][0] += elapsed; stages[stage][1] = max(stages[stage][1], usage.ru_maxrss); stages[stage][2] += 1
+
+	stages = {}
+	start = time.time()
+	Script('scene', 'SAR_SyntheticScene.py', '-o', 'Synthetic.tif', '-b', 'bathymetry.npz', '-W', args.chain_size, '-H', args.chain_size,
+		'-n', args.chain_points, '-d', 1000, '-s', args.seed)
+	Script('tiling', 'SAR_Tiling.py', '-a', 'Config_Image.ini', '-i', 'Synthetic.tif', '-b', 'bathymetry.npz', '-p', 'contrast',
+		'-r', 32629, 32629, '-d', 1000, '-w', args.window, '-T', 16.6)
+	npoints = len(glob.glob(os.path.join(directory, 'subset*.out')))
+	with open(os.path.join(directory, 'SpectrumWorkOrder.txt')) as f:
+		Script('spectrum', 'SAR_Spectrum.py', '-a', 'Config_Spectrum.ini', '-c', 270, '-m', 'Radial', '-i', *f.read().split())
+	Script('subdivision', 'SAR_GridPoints_Subdivision.py', '-a', 'Config_Inversion.ini', '-l', 0, '-T', 16.6, '-m', 'direct', '-w', 'linear')
+	for filename in sorted(glob.glob(os.path.join(directory, 'ComputationPoints*.out')) + glob.glob(os.path.join(directory, 'QuasiDeepwaterPoints*.out'))):
+		Script('inversion', 'SAR_Inversion.py', '-i', os.path.basename(filename))
+	Script('postprocessing', 'SAR_Postprocessing.py')
+	total = time.time() - start
+
+	for stage, (elapsed, maxrss, calls) in sorted(stages.items()):
+		results.append({'stage': 'chain', 'case': stage, 'count': npoints, 'unit': 'points', 'calls': calls, 'best_s': elapsed,
+			'mean_s': elapsed, 'repeat': 1, 'peak_rss_mb': maxrss / 1024., 'rate_per_s': npoints / elapsed if elapsed > 0 else None})
+	results.append({'stage': 'chain', 'case': 'total', 'count': npoints, 'unit': 'points', 'best_s': total, 'mean_s': total, 'repeat': 1,
+		'peak_rss_mb': max(stage[1] for stage in stages.values()) / 1024., 'rate_per_s': npoints / total if total > 0 else None})
+	if args.verbose:
+		print 'chain', npoints, 'points', '%.2fs' % total
+
+#**********************************
+#
+#  Benchmark
+#
+#**********************************
+results = []
+
+if 'spectrum' in args.stages:
+	for method in ['Waves', 'Radial']:
+		for size in args.box_sizes:
+			parameters = SpectrumParameters(method)
+			Measure('ComputeSpectrum', '%s box=%d' % (method, size),
+				lambda: [SwellSubsets(size, point) for point in range(args.points)],
+				lambda data: [SP.ComputeSpectrum(CL.SubsetParameters(None, BoxNb=args.window), parameters, Subsets) for Subsets in data],
+				args.points, 'points')
+
+if 'direction' in args.stages:
+	for size in args.box_sizes:
+		Measure('DirectionalIntegration', 'box=%d' % size, lambda: PowerSpectrum(size), SP.DirectionalIntegration, 1, 'boxes')
+
+if 'radial' in args.stages:
+	for size in args.box_sizes:
+		Measure('RadialProjection', 'box=%d' % size, lambda: PowerSpectrum(size), SP.RadialProjection, 1, 'boxes')
+
+if 'filter' in args.stages:
+	for size in args.box_sizes:
+		subset = lambda: SwellSubsets(size, args.seed)[0]
+		Measure('ButterworthEllipticFilter', 'box=%d' % size, subset,
+			lambda data: SP.ButterworthEllipticFilter(SpectrumParameters('Radial').FilterParameters, data, args.direction), 1, 'boxes')
+		Measure('ImageFilter', 'box=%d' % size, subset,
+			lambda data: SP.ImageFilter(SpectrumParameters('Radial').FilterParameters, data, args.direction), 1, 'boxes')
+
+if 'peak' in args.stages:
+	for method in ['Max', 'CentroidPower', 'ClusterPower', 'RayleighDistribution']:
+		for size in args.box_sizes:
+			Measure('PeakDetection', '%s bins=%d' % (method, size), lambda: PeakData(size),
+				lambda data: UT.PeakDetection(CL.PeakParameters(5, 0.2), method, data), 1, 'spectra')
+			Measure('PeakDetectionBatch', '%s bins=%d' % (method, size), lambda: PeakSpectra(size, args.peak_batch),
+				lambda data: UT.PeakDetectionBatch(CL.PeakParameters(5, 0.2), method, *data), args.peak_batch, 'spectra')
+
+if 'interpolation' in args.stages:
+	for method in ['nearest', 'linear', 'cubic', 'multiquadric']:
+		for size in args.grid_sizes:
+			if method == 'multiquadric' and size > 40:
+				# dense (nodes x nodes) radial basis function system
+				continue
+			Measure('InterpolateBathymetry', '%s grid=%d' % (method, size), lambda: BathymetryGrid(size),
+				lambda data: ROI.InterpolateBathymetry(CL.Miscellaneous(method, 270., False), *data), args.points, 'points')
+
+if 'isodata' in args.stages:
+	from osgeo import gdal
+	sys.path.append(os.path.join(LNEC, '..'))
+	import coresyf_isodata_classification as ISO
+	parameters = {"K": 15, "I": 100, "P": 2, "THETA_M": 10, "THETA_S": 0.1, "THETA_C": 2, "THETA_O": 0.01, "no_data_value": 0}
+	def Classify(image):
+		target = gdal.GetDriverByName('MEM').Create('', image.RasterXSize, image.RasterYSize, 1, gdal.GDT_Int16)
+		bands = [image.GetRasterBand(1)]
+		ISO.classify_blocks(bands, target.GetRasterBand(1), ISO.isodata_streaming(bands, parameters), 0)
+	for size in args.image_sizes:
+		def Image():
+			image = gdal.GetDriverByName('MEM').Create('', size, size, 1, gdal.GDT_Float32)
+			image.GetRasterBand(1).WriteArray(SwellImage(size, args.seed)[0].astype(np.float32))
+			return image
+		Measure('isodata_classification', 'image=%d' % size, Image, Classify, size * size, 'pixels')
+
+if 'contrast' in args.stages:
+	for method in IP.CONTRAST_METHODS:
+		for size in args.image_sizes:
+			Measure('ContrastStretch', '%s image=%d' % (method, size), lambda: SwellImage(size, args.seed)[0].astype(np.uint16),
+				lambda image: IP.ContrastStretch(image, 32, method), size * size, 'pixels')
+
+if 'chain' in args.stages:
+	directory = tempfile.mkdtemp(prefix='sar_benchmark_')
+	try:
+		RunChain(directory)
+	except Exception, message:
+		results.append({'stage': 'chain', 'case': 'total', 'error': str(message)})
+		if args.verbose:
+			print 'chain error:', message
+	finally:
+		shutil.rmtree(directory)
+
+#------------------
+# save the results
+#------------------
+report = {'date': time.strftime('%Y-%m-%dT%H:%M:%S'), 'host': platform.node(), 'python': platform.python_version(),
+	'numpy': np.__version__, 'cpus': multiprocessing.cpu_count(), 'arguments': vars(args), 'results': results}
+with open(args.output, 'w') as f:
+	json.dump(report, f, indent=1, sort_keys=True)
+if args.verbose:
+	print 'results saved in', args.output
@@ -11,7 +11,7 @@
 =====================================================================================================
 """
 
-import os
+import os, sys
 #
 import shutil
 #
@@ -26,6 +26,7 @@ import numpy as np
 import Toolbox.CSAR_Classes as CL
 import Toolbox.CSAR_Utilities as UT
 import Toolbox.CSAR_DepthInversion as INV
+import Toolbox.CSAR_Manifest as MF
 
 print '|------------------------------------------------------------------------------|'
 print '| Perform point subdivision (Deep water, Shallow water, regular grid points)   |'
@@ -80,6 +81,13 @@ if args.input:
 else:
 	FileList = [x for x in os.listdir('./') if x.startswith("Spectrum")]
 
+# subdivision already done by an interrupted run
+if MF.Done('subdivision', 'all'):
+	for filename in FileList:
+		os.remove(filename)
+	sys.exit(0)
+MF.Start('subdivision', 'all')
+
 for fname in FileList:
 	point = UT.Unpickle_File(fname)
 	ComputationPoints.append(point)
@@ -96,11 +104,12 @@ InversionParameters_global = CL.InversionParameters(parameters.HydrodynamicParam
 InversionParameters_reference = CL.InversionParameters(parameters.HydrodynamicParameters, 'direct', parameters.WaveTheory)
 
 # store exception points and dispatch other points
+OutputFiles = []
 
 #exception points
 if len(ExceptionPoints.DeepWaterPoints)>0 or len(ExceptionPoints.ShallowWaterPoints)>0:
 	fname = 'ExceptionPoints.out'
-	UT.Pickle_File(fname, ExceptionPoints)
+	UT.Pickle_File(fname, ExceptionPoints); OutputFiles.append(fname)
 
 # global computation points
 # Quasi Deep water points
@@ -110,7 +119,7 @@ if len(ComputationPoints.QuasiDeepWaterPoints)>0:
 	for i,point in enumerate(np.asarray(ComputationPoints.QuasiDeepWaterPoints)):
 		fname = filename+str(i)+'.out'
 		data = CL.InversionData(InversionParameters, point) 
-		data.pickle(fname)
+		data.pickle(fname); OutputFiles.append(fname)
 # global points
 if len(ComputationPoints.GlobalPoints)>0:
 	filename = 'ComputationPoints'
@@ -118,10 +127,11 @@ if len(ComputationPoints.GlobalPoints)>0:
 	for i,point in enumerate(np.asarray(ComputationPoints.GlobalPoints)):
 		fname = filename+str(i)+'.out'
 		data = CL.InversionData(InversionParameters, point) 
-		data.pickle(fname)
+		data.pickle(fname); OutputFiles.append(fname)
 
 
-#remove unused temporary files
+# subdivision committed: remove unused temporary files
+MF.Commit('subdivision', 'all', OutputFiles)
 if args.input:
 	os.remove(args.input)
 else:
@@ -0,0 +1,239 @@
+#!/usr/bin/python2.7
+# -*- coding: utf-8 -*-
+
+"""
+=====================================================================================================
+ Co-ReSyF Research Application: import time of the processing scripts
+
+ The scripts of the chain are launched once per grid point, so their startup (the import of the
+ Toolbox modules and their dependencies) is paid by every grid point. For each script, the
+ Toolbox modules it imports are imported in a new interpreter with the import time of each module
+ (python -X importtime with python >= 3.7, an equivalent __import__ hook otherwise). The check fails
+ (exit status 1) when a script imports at startup a dependency only needed by optional paths
+ (plots, GeoTIFF products, interpolation methods: see CSAR_Imports) or, compared to a saved baseline,
+ when it loads more modules at startup or its import time (best of the repetitions, the wall time
+ is noisy on a loaded host) exceeds the baseline by more than the tolerance. The deferred imports
+ being paid by the first task of a script, SAR_Spectrum also computes the spectrum of a synthetic
+ grid point (see SAR_Benchmark) after its imports, and fails when a forbidden module is then
+ loaded. The modules counted
+ are the ones loaded in addition to the reference modules (numpy and cv2, whose own imports depend
+ on their version), so the module counts of the baseline (importtime_baseline.json, updated with
+ --save when the imports of the Toolbox change) hold on any host; the import times are saved only
+ with --save_times (baseline of a given host):
+
+	python SAR_ImportTime.py -b importtime_baseline.json
+	python SAR_ImportTime.py --save importtime_host.json --save_times
+	python SAR_ImportTime.py -b importtime_host.json -t 0.5 -o importtime.json
+
+ Date: Oct/2026
+=====================================================================================================
+"""
+
+import os, sys, re, json, time, platform, subprocess
+#
+import argparse
+#
+
+############################
+# input parameters
+############################
+parser = argparse.ArgumentParser(description='Co-ReSyF: SAR Bathymetry Research Application (import time)')
+parser.add_argument('-s', '--scripts', nargs='+', help='Scripts of the chain to check',
+	default=['SAR_Tiling', 'SAR_Spectrum', 'SAR_GridPoints_Subdivision', 'SAR_Inversion', 'SAR_Postprocessing'], required=False)
+parser.add_argument('-f', '--forbidden', nargs='+', help='Modules (and their submodules) that must not be imported at startup',
+	default=['matplotlib', 'sklearn', 'skimage', 'osgeo', 'scipy.interpolate', 'scipy.optimize'], required=False)
+parser.add_argument('--reference', nargs='+', help='Modules imported by all the scripts whose own imports are not counted',
+	default=['numpy', 'cv2'], required=False)
+parser.add_argument('-m', '--method', help='Spectrum method of the synthetic grid point of SAR_Spectrum (the Waves method needs skimage and scipy.interpolate)',
+	choices=['Radial', 'Waves'], default='Radial', required=False)
+parser.add_argument('-b', '--baseline', help='JSON file with the baseline import times (see --save)', default=None, required=False)
+parser.add_argument('-t', '--tolerance', help='Tolerated increase of the import time over the baseline (fraction)', default=0.5, type=float, required=False)
+parser.add_argument('--save', help='Save the measured module counts as baseline in this JSON file', default=None, required=False)
+parser.add_argument('--save_times', help='Save also the import times in the baseline (specific to the host)', action="store_true")
+parser.add_argument('-o', '--output', help='Output JSON file with the import times of each script and module', default=None, required=False)
+parser.add_argument('-r', '--repeat', help='Repetitions of each measure (the best time is kept)', default=5, type=int, required=False)
+parser.add_argument('-p', '--python', help='Python interpreter of the scripts', default=sys.executable, required=False)
+parser.add_argument('-n', '--top', help='Number of slowest modules listed per script', default=10, type=int, required=False)
+parser.add_argument('-v','--verbose', help="comments and screen outputs", action="store_true")
+
+args = parser.parse_args()
+LNEC = os.path.dirname(os.path.abspath(__file__))
+
+# __import__ hook printing the lines of python -X importtime (self and cumulative time in us)
+HOOK = r'''
+import sys, time
+try:
+	import __builtin__ as builtins
+except ImportError:
+	import builtins
+_import, _stack = builtins.__import__, [0]
+def _timed(name, *arguments, **keywords):
+	known = set(sys.modules); children = _stack[-1]; _stack[-1] = 0; _stack.append(0)
+	start = time.time()
+	try:
+		return _import(name, *arguments, **keywords)
+	finally:
+		cumulative = int((time.time() - start) * 1e6); inner = _stack.pop(); _stack[-1] = children
+		new = [module for module in sys.modules if module not in known and sys.modules[module] is not None]
+		if new:
+			module = name if name in new else min(new, key=len)
+			sys.stderr.write('import time: %9d | %10d | %s%s\n' % (cumulative - inner, cumulative, '  ' * (len(_stack) - 1), module))
+			_stack[-1] += cumulative
+		else:
+			_stack[-1] += inner
+builtins.__import__ = _timed
+'''
+
+# first task of the scripts: one synthetic grid point (swell subscenes, see SAR_Benchmark.SwellSubsets)
+TASKS = {'SAR_Spectrum': r'''
+import numpy as np
+import Toolbox.CSAR_Classes as CL
+import Toolbox.CSAR_Utilities as UT
+import Toolbox.CSAR_Spectrum as SP
+rng = np.random.RandomState(0); size, res, method = 128, 10., %(method)r
+easting, northing = np.meshgrid(np.arange(size) * res, -np.arange(size) * res)
+angle, k = np.radians(UT.CartesianNautical(290.)), 2 * np.pi / 200.
+Subsets = []
+for box in range(5):
+	swell = 1 + 0.3 * np.cos(k * (easting * np.cos(angle) + northing * np.sin(angle)) + rng.uniform(0, 2 * np.pi))
+	image = np.clip(500 * swell * rng.gamma(4, 0.25, swell.shape), 1, 65535)
+	Subsets.append(CL.Subset(np.array([size // 2, (box + 1) * size // 2]), image, CL.Coordinates(northing, easting), np.array([res, res]), False))
+Spectrum = CL.WaveSpectrumParameters(method, 5, 50.) if method == 'Waves' else CL.WaveSpectrumParameters(method)
+parameters = CL.ComputingParametersSpectrum(CL.SubsetProcessingParameters(), CL.DirectionEstimateParameters(270.),
+	CL.FilterParameters(True), CL.SpectrumParameters(Spectrum, CL.WavelengthEstimationParameters()), 'float64')
+SP.SetBoxCache(2**20)
+Spectrum, Subscenes = SP.ComputeSpectrum(CL.SubsetParameters(None, BoxNb=5), parameters, Subsets, False)
+SP.BatchWavelengthEstimate(parameters, [Spectrum])
+'''}
+
+IMPORTTIME = re.compile(r'import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)')
+
+#-------------------------------------------------------------------
+# imports of the scripts
+#-------------------------------------------------------------------
+def ScriptImports(script):
+	#----------------------------------------------------------
+	# Toolbox modules imported (at top level) by a script
+	#----------------------------------------------------------
+	with open(os.path.join(LNEC, script + '.py')) as f:
+		return [match.group(1) for match in (re.match(r'import\s+(Toolbox\.\w+)', line) for line in f) if match]
+
+def Interpreter():
+	#----------------------------------------------------------
+	# version of the interpreter of the scripts
+	#----------------------------------------------------------
+	output = subprocess.check_output([args.python, '-c', 'import sys; print("%d %d" % sys.version_info[:2])'])
+	return tuple(int(value) for value in output.split())
+
+def ImportTime(modules, native, task=''):
+	#--------------------------------------------------------------------------
+	# import the modules in a new interpreter: per module (self, cumulative)
+	# times in us and all the modules loaded at startup (or after the task)
+	#--------------------------------------------------------------------------
+	code = ('' if native else HOOK) + '\nimport sys, json\nsys.path.insert(0, %r)\n' % LNEC
+	code += ''.join('import %s\n' % module for module in modules) + task
+	code += 'sys.stdout.write(json.dumps(sorted(module for module in sys.modules if sys.modules[module] is not None)))\n'
+	command = [args.python] + (['-X', 'importtime'] if native else []) + ['-c', code]
+	process = subprocess.Popen(command, cwd=LNEC, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+	out, err = process.communicate()
+	if process.returncode != 0:
+		errors = [line for line in err.decode('utf-8', 'replace').splitlines() if not IMPORTTIME.match(line)]
+		sys.exit("import of %s%s failed:\n%s" % (' '.join(modules), ' (and task)' if task else '', '\n'.join(errors)))
+	times = []
+	for line in err.decode('utf-8', 'replace').splitlines():
+		match = IMPORTTIME.match(line)
+		if match:
+			times.append({'module': match.group(4), 'level': len(match.group(3)) // 2, 'self_us': int(match.group(1)), 'cumulative_us': int(match.group(2))})
+	return times, json.loads(out.decode('utf-8'))
+
+def Forbidden(loaded):
+	#------------------------------------------------------------
+	# forbidden modules loaded (themselves or their submodules)
+	#------------------------------------------------------------
+	return [name for name in args.forbidden if any(module == name or module.startswith(name + '.') for module in loaded)]
+
+#-------------------------------------------------------------------
+# measure
+#-------------------------------------------------------------------
+version = Interpreter()
+native = version >= (3, 7)
+if args.verbose:
+	print 'interpreter', args.python, '.'.join(str(value) for value in version), '(python -X importtime)' if native else '(__import__ hook)'
+
+if args.baseline is not None and not os.path.exists(args.baseline):
+	sys.exit('baseline %s not found (see --save)' % args.baseline)
+
+# modules loaded by the reference modules alone
+reference = set(ImportTime(args.reference, native)[1])
+
+results = {}
+for script in args.scripts:
+	modules = ScriptImports(script)
+	best = None
+	for repetition in range(args.repeat):
+		times, loaded = ImportTime(modules, native)
+		total = sum(item['cumulative_us'] for item in times if item['level'] == 0) / 1e3
+		if best is None or total < best['total_ms']:
+			best = {'total_ms': total, 'times': times}
+	best['toolbox'] = modules
+	best['modules'] = len(set(loaded) - reference)
+	best['forbidden'] = Forbidden(loaded)
+	best['slowest'] = sorted(best.pop('times'), key=lambda item: -item['self_us'])[:args.top]
+	if script in TASKS:
+		# modules loaded once the first grid point is processed
+		loaded = ImportTime(modules, native, TASKS[script] % {'method': args.method})[1]
+		best['task_modules'] = len(set(loaded) - reference)
+		best['task_forbidden'] = Forbidden(loaded)
+	results[script] = best
+	if args.verbose:
+		print '%-28s %8.1f ms  %4d modules (besides %s)' % (script, best['total_ms'], best['modules'], ', '.join(args.reference)),
+		print ('  forbidden: ' + ' '.join(best['forbidden'])) if best['forbidden'] else ''
+		for item in best['slowest']:
+			print '	%8.1f ms  %s' % (item['self_us'] / 1e3, item['module'])
+		if script in TASKS:
+			print '%-28s %4d modules after a %s grid point' % ('', best['task_modules'], args.method),
+			print ('  forbidden: ' + ' '.join(best['task_forbidden'])) if best['task_forbidden'] else ''
+
+#-------------------------------------------------------------------
+# checks
+#-------------------------------------------------------------------
+failures = []
+for script, result in sorted(results.items()):
+	if result['forbidden']:
+		failures.append('%s imports at startup %s' % (script, ', '.join(result['forbidden'])))
+	if result.get('task_forbidden'):
+		failures.append('%s imports %s while processing a %s grid point' % (script, ', '.join(result['task_forbidden']), args.method))
+
+if args.baseline is not None:
+	with open(args.baseline) as f:
+		baseline = json.load(f)
+	for script, result in sorted(results.items()):
+		if script in baseline.get('total_ms', {}):
+			limit = baseline['total_ms'][script] * (1 + args.tolerance)
+			result['baseline_ms'] = baseline['total_ms'][script]
+			if result['total_ms'] > limit:
+				failures.append('%s import time %.1f ms > %.1f ms (baseline %.1f ms + %d%%)' % (script, result['total_ms'], limit, result['baseline_ms'], round(args.tolerance * 100)))
+		if script in baseline.get('modules', {}):
+			result['baseline_modules'] = baseline['modules'][script]
+			if result['modules'] > result['baseline_modules']:
+				failures.append('%s loads %d modules at startup (baseline %d)' % (script, result['modules'], result['baseline_modules']))
+
+report = {'date': time.strftime('%Y-%m-%dT%H:%M:%S'), 'host': platform.node(), 'python': '.'.join(str(value) for value in version),
+	'importtime': 'native' if native else 'hook', 'arguments': vars(args), 'results': results, 'failures': failures}
+if args.output is not None:
+	with open(args.output, 'w') as f:
+		json.dump(report, f, indent=1, sort_keys=True)
+if args.save is not None:
+	baseline = {'date': report['date'], 'python': report['python'], 'reference': args.reference,
+		'modules': dict((script, result['modules']) for script, result in results.items())}
+	if args.save_times:
+		baseline.update({'host': report['host'], 'total_ms': dict((script, result['total_ms']) for script, result in results.items())})
+	with open(args.save, 'w') as f:
+		json.dump(baseline, f, indent=1, sort_keys=True)
+	if args.verbose:
+		print 'baseline saved in', args.save
+
+if failures:
+	sys.exit('import time check failed:\n' + '\n'.join(failures))
+if args.verbose:
+	print 'import time check passed'
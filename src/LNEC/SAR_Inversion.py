@@ -15,11 +15,16 @@ import os, sys
 #
 import argparse
 #
+import Toolbox.CSAR_Worker as WK
+WK.Delegate(__file__)		# run by the warm worker of CORESYF_WORKER (see SAR_Worker)
+#
 import numpy as np
 #
 import Toolbox.CSAR_Classes as CL
 import Toolbox.CSAR_Utilities as UT
 import Toolbox.CSAR_DepthInversion as INV
+import Toolbox.CSAR_Metrics as MT
+import Toolbox.CSAR_Manifest as MF
 
 
 
@@ -32,7 +37,16 @@ args = parser.parse_args()
 
 # read parameters and point information
 fname = args.input
-index = int(filter(str.isdigit, fname))
+index = int(filter(str.isdigit, fname)); MT.SetPoint(index)
+
+# depth already inverted by an interrupted run (marker file of the item, see CSAR_Manifest)
+item = os.path.basename(fname)
+if MF.Done('inversion', item):
+	if os.path.exists(fname):
+		os.remove(fname)
+	sys.exit(0)
+MF.Start('inversion', item)
+
 PointInformation = UT.Unpickle_File(fname)
 INV_parameters, point = PointInformation.InversionParameters, PointInformation.point
 
@@ -53,7 +67,8 @@ else:
 	sys.exit('Inversion method not defined // check that you provided the mandatory input hydrodynamic data')
 
 #save point information
-UT.Create_TransferFile(args,Point,'Inversion')
+InversionFile = UT.Create_TransferFile(args,Point,'Inversion')
+MF.Commit('inversion', item, [InversionFile])
 
 #clean directory
 os.remove(args.input)
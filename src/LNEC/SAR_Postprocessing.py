@@ -11,7 +11,7 @@
 =====================================================================================================
 """
 
-import os, glob, shutil
+import os, sys, glob, shutil
 #
 import argparse
 #
@@ -20,6 +20,7 @@ import numpy as np
 import Toolbox.CSAR_Classes as CL
 import Toolbox.CSAR_Utilities as UT
 import Toolbox.CSAR_PostProcessing as POST
+import Toolbox.CSAR_Manifest as MF
 #
 import shutil
 
@@ -35,6 +36,11 @@ if args.verbose:
 	print '|	Post-Processing		 |'
 	print '|--------------------------------|'
 
+# bathymetry map already created by an interrupted run
+if MF.Done('postprocessing', 'all'):
+	sys.exit(0)
+MF.Start('postprocessing', 'all')
+
 # get list of parameters and image data
 fname2='Image.out'
 data = UT.Unpickle_File(fname2)
@@ -76,13 +82,14 @@ if args.verbose:
 	print 'number of Processed Points', len(ProcessedPoints)
 
 # post-processing step
-POST.BathymetryMap(ProcessedPoints, args.output)
+POST.BathymetryMap(ProcessedPoints, args.output, getattr(data, 'EPSG', None))
 #print 'OK1_Main'
 POST.PostProcessing(ProcessedPoints, data)
 #print 'OK2_Main'
 
+MF.Commit('postprocessing', 'all')
 
-# clean directory
+# clean directory (once the bathymetry map is committed)
 if args.input:
 	os.remove(args.input)
 else:
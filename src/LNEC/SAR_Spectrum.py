@@ -10,7 +10,10 @@
  Last update: Nov/2017
 =====================================================================================================
 """
-import os
+import os, sys, copy, shutil
+#
+import Toolbox.CSAR_Worker as WK
+WK.Delegate(__file__)		# run by the warm worker of CORESYF_WORKER (see SAR_Worker)
 #
 import numpy as np
 #
@@ -19,6 +22,8 @@ import Toolbox.CSAR_Utilities as UT
 import Toolbox.CSAR_Spectrum as SP
 import Toolbox.CSAR_DepthInversion as INV
 import Toolbox.CSAR_PostProcessing as POST
+import Toolbox.CSAR_Metrics as MT
+import Toolbox.CSAR_Manifest as MF
 
 #********************************************
 #  Spectrum and Peak Wavelength Computation
@@ -28,48 +33,92 @@ import Toolbox.CSAR_PostProcessing as POST
 ComputingParameterSpectrum, args = SP.InputSpectrumParameters()
 
 
-# read parameters, point and subset data
+# box spectra shared by the grid points processed by this script (neighbouring points overlap)
+SP.SetBoxCache(int(args.box_cache * 2**20), args.plots)
+
 cwd = os.getcwd()
 path = cwd+'/'
-fname = path + args.input
-index = int(filter(str.isdigit, fname))
-Subset = UT.Unpickle_File(fname)
-SubsetsParameters, point, Subsets = Subset.parameters, Subset.point, Subset.SubsetData
-
-if args.verbose and index==0:
-	print '|-------------------------------------------|'
-	print '| Compute Spectra and estimate wavelengths  |'
-	print '|-------------------------------------------|'
-
-##################################
-# pb here
-##################################
-
-# compute global subset spectrum
-Spectrum, OutputSpectrumData = SP.ComputeSpectrum(SubsetsParameters, ComputingParameterSpectrum, Subsets) 
+states = MF.States()		# manifest read once for the grid points of the chunk
+for start in range(0, len(args.input), args.peak_batch):
+	# block of grid points whose peak wavelengths are estimated together
+	Block = []
+	for SubsetFile in args.input[start:start+args.peak_batch]:
+		# read parameters, point and subset data
+		fname = path + SubsetFile
+		index = int(filter(str.isdigit, fname)); MT.SetPoint(index)
+		PointArgs = copy.copy(args); PointArgs.input = SubsetFile
+
+		# spectrum already computed by an interrupted run
+		if MF.Done('spectrum', index, states):
+			if os.path.exists(SubsetFile):
+				os.remove(SubsetFile)
+			continue
+		MF.Start('spectrum', index)
+
+		Subset = UT.Unpickle_File(fname)
+		SubsetsParameters, point, Subsets = Subset.parameters, Subset.point, Subset.SubsetData
+
+		if args.verbose and index==0:
+			print '|-------------------------------------------|'
+			print '| Compute Spectra and estimate wavelengths  |'
+			print '|-------------------------------------------|'
+
+		##################################
+		# pb here
+		##################################
+
+		# compute global subset spectrum (peak wavelength estimated with the block)
+		if MT.Sampled(index, args.profile_every, args.profile_points):
+			# profile this grid point (the subsets file is kept to run it again offline)
+			basename = os.path.join(args.profile_dir, 'spectrum' + str(index))
+			parameters = {'index': index, 'input': SubsetFile, 'point': point, 'SubsetParameters': SubsetsParameters,
+				'ComputingParameters': ComputingParameterSpectrum, 'boxes': [subset.image.shape for subset in Subsets]}
+			Spectrum, OutputSpectrumData = MT.Profile(basename, parameters, SP.ComputeSpectrum, SubsetsParameters, ComputingParameterSpectrum, Subsets, False)
+			shutil.copy(fname, basename + '_' + os.path.basename(SubsetFile))
+		else:
+			Spectrum, OutputSpectrumData = SP.ComputeSpectrum(SubsetsParameters, ComputingParameterSpectrum, Subsets, False) 
+
+		# subsets kept for the validation mode only
+		Block.append((index, SubsetFile, PointArgs, point, SubsetsParameters, Subsets if args.validate_precision else None, Spectrum, OutputSpectrumData))
+
+	# peak wavelengths of the block (batched peak detection)
+	SP.BatchWavelengthEstimate(ComputingParameterSpectrum, [Spectrum for _, _, _, _, _, _, Spectrum, _ in Block])
+
+	for index, SubsetFile, PointArgs, point, SubsetsParameters, Subsets, Spectrum, OutputSpectrumData in Block:
+		MT.SetPoint(index)
+
+		# validation mode: deltas of the selected precision against float64
+		if args.validate_precision:
+			ReferenceParameters = copy.deepcopy(ComputingParameterSpectrum); ReferenceParameters.SetPrecision('float64')
+			Reference, ReferenceSpectrumData = SP.ComputeSpectrum(SubsetsParameters, ReferenceParameters, Subsets)
+			deltas = SP.PrecisionDeltas(Spectrum, Reference, OutputSpectrumData, ReferenceSpectrumData)
+			MF.Append(dict(deltas, point=index, precision=args.precision), args.validate_precision)
+			if args.verbose:
+				print 'point', index, args.precision, 'vs float64: wavelength delta (m)', deltas['wavelength_delta'], 'direction delta (deg)', deltas['direction_delta']
 	
-# create and store spectra and subsets figure for each grid point 
-POST.Plot_Subset_Spectrum(index, OutputSpectrumData, Spectrum)
+		# create and store spectra and subsets figure for each grid point (matplotlib imported by the first one)
+		if args.plots:
+			POST.Plot_Subset_Spectrum(index, OutputSpectrumData, Spectrum)
 	
-#********************************************
-#  	Grid Point Distribution
-#********************************************
-# estimate wave number and determine offshore points
-wavelength = Spectrum.WaveSpectrum.Wavelength
-apriori_Bathymetry = point.apriori_bathymetry;
-
-#discriminate grid points (deep water, near deep water, nearshore, other)
-Flag = INV.DiscriminateGridPoints(apriori_Bathymetry, wavelength)
+		#********************************************
+		#  	Grid Point Distribution
+		#********************************************
+		# estimate wave number and determine offshore points
+		wavelength = Spectrum.WaveSpectrum.Wavelength
+		apriori_Bathymetry = point.apriori_bathymetry;
 
-#********************************************
-#  	Gather and save point information
-#********************************************
-#gather point information
-pt =  CL.GridPointsData(point.IndexEasting, point.IndexNorthing, point.easting, point.northing, apriori_Bathymetry, Spectrum, wavelength, Flag)
+		#discriminate grid points (deep water, near deep water, nearshore, other)
+		Flag = INV.DiscriminateGridPoints(apriori_Bathymetry, wavelength)
 
-#save point information
-UT.Create_TransferFile(args,pt,'Spectrum')
+		#********************************************
+		#  	Gather and save point information
+		#********************************************
+		#gather point information
+		pt =  CL.GridPointsData(point.IndexEasting, point.IndexNorthing, point.easting, point.northing, apriori_Bathymetry, Spectrum, wavelength, Flag)
 
-#remove subsets info file
-os.remove(args.input)
+		#save point information
+		SpectrumFile = UT.Create_TransferFile(PointArgs,pt,'Spectrum')
+		MF.Commit('spectrum', index, [SpectrumFile])
 
+		#remove subsets info file (once the spectrum is committed)
+		os.remove(SubsetFile)
@@ -0,0 +1,129 @@
+#!/usr/bin/python2.7
+# -*- coding: utf-8 -*-
+
+"""
+=====================================================================================================
+ Co-ReSyF Research Application: Synthetic SAR swell scene (known bathymetry)
+
+ Generate a georeferenced GeoTIFF of a swell field refracted over a known depth field (planar
+ beach, depth increasing offshore towards the West) and the matching grid points file (npz with
+ easting, northing, bathymetry) to run and benchmark the processing chain without real data:
+
+	python SAR_SyntheticScene.py -o Synthetic.tif -b synthetic_bathymetry.npz -n 1000 -T 16.6
+	python SAR_Tiling.py -a Config_Image.ini -i Synthetic.tif -b synthetic_bathymetry.npz -p contrast -r 32629 32629 -T 16.6
+
+ The local wavelength follows the linear dispersion relation inverted by DepthEstimate and the
+ wave direction follows Snell's law over the straight depth contours. The true wavelength, direction
+ and depth of the grid points are saved in a second npz file (<bathymetry file>_truth.npz).
+ The image is generated by blocks of rows (see coresyf_randRasterGen) so any size can be created.
+
+ Date: Oct/2026
+=====================================================================================================
+"""
+
+import os, sys
+#
+import argparse
+#
+import numpy as np
+#
+from osgeo import gdal, osr
+#
+import Toolbox.CSAR_DepthInversion as INV
+#
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from coresyf_randRasterGen import generate_blocks, gdal_create_image, BLOCK_ROWS, CHUNK_PIXELS
+from raster_blocks import tiled_options
+
+############################
+# input parameters
+############################
+parser = argparse.ArgumentParser(description='Co-ReSyF: SAR Bathymetry Research Application (synthetic scene)')
+#output
+parser.add_argument('-o', '--output', help='Output synthetic SAR image (GeoTIFF)', default='Synthetic_SAR.tif', required=False)
+parser.add_argument('-b', '--bathymetry', help='Output grid points file (npz: easting, northing, bathymetry)', default='synthetic_bathymetry.npz', required=False)
+#image
+parser.add_argument('-W', '--width', help='Image width (pixels)', default=4000, type=int, required=False)
+parser.add_argument('-H', '--height', help='Image height (pixels)', default=4000, type=int, required=False)
+parser.add_argument('-R', '--resolution', help='Pixel resolution (m)', default=10., type=float, required=False)
+parser.add_argument('-r', '--reference_system', help='EPSG code of the (projected) image', default='32629', required=False)
+parser.add_argument('-e', '--origin', nargs=2, help='Easting/Northing of the upper left corner (m)', default=[500000., 4500000.], type=float, required=False)
+#bathymetry
+parser.add_argument('--depth_min', help='Depth at the eastern (coast) edge of the image (m)', default=5., type=float, required=False)
+parser.add_argument('--depth_max', help='Maximum (offshore) depth (m)', default=150., type=float, required=False)
+parser.add_argument('--slope', help='Bottom slope', default=0.01, type=float, required=False)
+#waves
+parser.add_argument('-T', '--Tp', help='Peak wave period (s)', default=16.6, type=float, required=False)
+parser.add_argument('-D', '--direction', help='Offshore wave direction (degrees from the shore normal, towards North if > 0)', default=20., type=float, required=False)
+parser.add_argument('-m', '--modulation', help='Modulation of the backscatter by the swell (0-1)', default=0.3, type=float, required=False)
+parser.add_argument('-l', '--looks', help='Number of looks of the speckle noise (0: no speckle)', default=4, type=int, required=False)
+parser.add_argument('-s', '--seed', help='Seed of the random generator', default=0, type=int, required=False)
+#grid points
+parser.add_argument('-n', '--points', help='(Approximate) number of grid points', default=1000, type=int, required=False)
+parser.add_argument('-d', '--margin', help='Distance between the grid points and the image borders (m), ideally half the subscene dimension', default=1000., type=float, required=False)
+#comments
+parser.add_argument('-v','--verbose', help="comments and screen outputs", action="store_true")
+
+args = parser.parse_args()
+
+#-------------------------------------------------------------------
+# depth, wavelength and wave phase (functions of the column only)
+#-------------------------------------------------------------------
+res = args.resolution; E0, N0 = args.origin
+distance = (args.width - np.arange(args.width) - 0.5) * res	# distance to the coast (eastern edge)
+depth = np.minimum(args.depth_min + args.slope * distance, args.depth_max)
+wavelength = INV.WavelengthEstimate(depth, args.Tp)
+
+# Snell's law: the alongshore wavenumber is conserved (offshore value)
+k = 2 * np.pi / wavelength
+ky = k[0] * np.sin(np.radians(args.direction))
+kx = np.sqrt(k**2 - ky**2)
+direction = np.degrees(np.arctan2(ky, kx))
+phase_x = np.cumsum(kx) * res
+
+#-------------------------------------------------------------------
+# synthetic image (intensity modulated by the swell, with speckle)
+#-------------------------------------------------------------------
+if args.verbose:
+	print '|------------------------------------------------|'
+	print '| 	Generate synthetic SAR image		 |'
+	print '|------------------------------------------------|'
+	print 'image size (pixels)', args.width, args.height
+	print 'depth range (m)', depth.min(), depth.max()
+	print 'wavelength range (m)', wavelength.min(), wavelength.max()
+
+def SwellBlock(rng, yoff, rows):
+	#------------------------------------------------------------
+	# intensity of the rows yoff:yoff+rows (northing decreasing)
+	#------------------------------------------------------------
+	y = (np.arange(yoff, yoff + rows) + 0.5)[:, np.newaxis] * res
+	swell = 1 + args.modulation * np.cos(phase_x[np.newaxis, :] - ky * y)
+	speckle = rng.gamma(args.looks, 1. / args.looks, swell.shape) if args.looks > 0 else 1.
+	return np.clip(500 * swell * speckle, 1, 65535)
+
+block_rows = max(BLOCK_ROWS, CHUNK_PIXELS // args.width // BLOCK_ROWS * BLOCK_ROWS)
+blocks = generate_blocks(1, args.height, block_rows, SwellBlock, args.seed, np.uint16)
+dataset = gdal_create_image(args.output, args.width, args.height, 1, 'GTiff', blocks, gdal.GDT_UInt16, tiled_options('GTiff'))
+srs = osr.SpatialReference(); srs.ImportFromEPSG(int(args.reference_system))
+dataset.SetGeoTransform((E0, res, 0, N0, 0, -res)); dataset.SetProjection(srs.ExportToWkt())
+dataset.FlushCache(); dataset = None
+
+#-------------------------------------------------------------------
+# grid points (regular grid within the margins) and true values
+#-------------------------------------------------------------------
+width, height = args.width * res - 2 * args.margin, args.height * res - 2 * args.margin
+if width <= 0 or height <= 0:
+	sys.exit("image too small for the grid points margin")
+spacing = np.sqrt(width * height / args.points)
+E = E0 + args.margin + np.arange(0, width, spacing)
+N = N0 - args.margin - np.arange(0, height, spacing)
+E, N = np.meshgrid(E, N); E, N = E.ravel(), N.ravel()
+col = np.clip(((E - E0) / res).astype(int), 0, args.width - 1)
+
+Points = np.column_stack((E, N, -depth[col]))
+np.savez(args.bathymetry, Points)
+np.savez(os.path.splitext(args.bathymetry)[0] + '_truth.npz', Points=Points, wavelength=wavelength[col], direction=direction[col], Tp=args.Tp)
+
+if args.verbose:
+	print 'number of grid points', Points.shape[0]
+	print 'grid points spacing (m)', spacing
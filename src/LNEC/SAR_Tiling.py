@@ -11,7 +11,7 @@
 =====================================================================================================
 """
 #
-import os,sys,shutil
+import os,sys,shutil,json
 #
 import numpy as np
 #
@@ -19,6 +19,8 @@ import Toolbox.CSAR_Classes as CL
 import Toolbox.CSAR_Utilities as UT
 import Toolbox.CSAR_ImageProcessing as IP
 import Toolbox.CSAR_Subsets as SUB
+import Toolbox.CSAR_Metrics as MT
+import Toolbox.CSAR_Manifest as MF
 #
 
 #-------------------
@@ -32,9 +34,21 @@ SubsetsParameters, ImageParameters, args, verbose = IP.InputSubsetParameters()
 #
 #**********************************
 
+# resume the run of the manifest if it has the same parameters (and input files)
+signature = dict(vars(args), files=[[f, os.path.getsize(f), os.path.getmtime(f)] for f in [args.input, args.bathymetry] if os.path.exists(f)])
+signature.pop('verbose'); signature.pop('param')
+resume = MF.Signature() == json.loads(json.dumps(signature))
+if resume and MF.Done('tiling', 'all'):
+	if verbose:
+		print 'subsets already created (see', MF.MANIFEST + ')'
+	sys.exit(0)
+
 # clean old directories and create new ones
-if os.path.isdir('Output'):
-	shutil.rmtree('Output')
+if not resume:
+	MF.Reset(signature)
+	if os.path.isdir('Output'):
+		shutil.rmtree('Output')
+MF.Start('tiling', 'all'); states = MF.States()
 
 # create new directory and subdirectories 
 Main_Dir, Sub_Dir = ['Output'], ['SubsetSpectra', 'Results', 'Bathymetry']
@@ -48,13 +62,14 @@ if verbose:
 	print '|------------------------------------------------|'
 coordinates, image, pixelresolution = IP.ReadSARImg(ImageParameters)
 FlagFlip = IP.CheckImageOrientation(coordinates)			# check whether preprocessing image flip process affects direction estimate
-data = CL.Subset(0, image, coordinates, pixelresolution, FlagFlip)	# store main data (image, coordinates) as list
+EPSG = IP.GetEPSG(ImageParameters.SpatialReferenceSystem.EPSG_Flag_Out)	# projection of the coordinates (bathymetry raster)
+data = CL.Subset(0, image, coordinates, pixelresolution, FlagFlip, EPSG)	# store main data (image, coordinates) as list
 if verbose:
 	print 'nb of pixels (x,y)', coordinates.easting.shape[0], coordinates.northing.shape[1]
 	print 'pixel resolution (m)', pixelresolution
 
 # npz files to (1) save processed and image coordinates and (2) save parameters
-UT.Create_Image_Parameters_TransferFile(SubsetsParameters, ImageParameters, data)
+ImageFile = UT.Create_Image_Parameters_TransferFile(SubsetsParameters, ImageParameters, data)
 #UT.CreateImageParametersNPZ(parameters,data)
 
 #---------------------
@@ -93,6 +108,9 @@ if verbose:
 	print '|-------------------------------|'
 
 for index, point in enumerate(Points):  
+	MT.SetPoint(index)
+	if resume and MF.Done('tiling', index, states):
+		continue
 	#***********************
 	# Subset definitions
 	#***********************
@@ -109,5 +127,12 @@ for index, point in enumerate(Points):
         Subsets = SUB.GetFFTBoxes(Subsetparameters, data, dimension)
 	
 	# store data
-	UT.Create_Subset_TransferFile(index, SubsetsParameters, point, Subsets, args.output)
+	SubsetFile = UT.Create_Subset_TransferFile(index, SubsetsParameters, point, Subsets, args.output)
+	MF.Commit('tiling', index, [SubsetFile])
+	MT.Count('FFT_boxes', len(Subsets))
+
+# spatial order of the subsets for the spectrum workers (rows of points one box offset apart)
+WorkOrder = UT.Create_WorkOrder(Points, SubsetsParameters.Shift*dimension.BoxRange[0], args.output)
 
+# all the subsets are created
+MF.Commit('tiling', 'all', [ImageFile, WorkOrder])
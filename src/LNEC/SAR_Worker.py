@@ -0,0 +1,88 @@
+#!/usr/bin/python2.7
+# -*- coding: utf-8 -*-
+
+"""
+=====================================================================================================
+ Co-ReSyF Research Application: warm worker of SAR_Spectrum and SAR_Inversion
+
+ Start a long-lived process that imports the Toolbox and computes the tables of the box
+ dimensions once, then runs the SAR_Spectrum and SAR_Inversion tasks it receives (see CSAR_Worker)
+ on a unix socket or on stdin. The orchestrator keeps the same commands: with CORESYF_WORKER set
+ to the socket, the scripts send their command line to the worker instead of running it:
+
+	export CORESYF_WORKER=${XDG_RUNTIME_DIR:-/tmp/coresyf-$(id -u)}/coresyf_worker.sock
+	python SAR_Worker.py -b 128 128 &
+	python SAR_Spectrum.py -i subset12.out
+	python SAR_Inversion.py -i Computation12.out
+	python SAR_Worker.py --stop
+
+ The tasks run with the rights of the worker user: the socket is accessible to this user only
+ (mode 600, by default in the private directory above).
+
+ Concurrency: a worker runs one task at a time; the scripts launched together queue on its socket
+ (up to 1024 connections, or the system limit net.core.somaxconn) and wait for their answer. A
+ script refused by a full queue tries again for CORESYF_WORKER_WAIT seconds (default 600), then
+ runs locally (cold start, noted on stderr); it runs locally at once when no worker socket exists.
+ With -f each task runs in a child process of the worker (tasks in parallel); otherwise start one
+ worker (socket) per processor and spread the scripts over them.
+
+ or, tasks as JSON lines on stdin:
+
+	echo '{"script": "SAR_Inversion", "argv": ["-i", "Computation12.out"], "cwd": "'$PWD'"}' | python SAR_Worker.py --stdin
+
+ The per point time of the scripts is then the time of their computations (the interpreter
+ startup and the imports are paid once per worker).
+
+ Date: Oct/2026
+=====================================================================================================
+"""
+
+import os, sys
+#
+import argparse
+#
+import numpy as np
+#
+import Toolbox.CSAR_Classes as CL
+import Toolbox.CSAR_Utilities as UT
+import Toolbox.CSAR_Spectrum as SP
+import Toolbox.CSAR_DepthInversion as INV
+import Toolbox.CSAR_PostProcessing as POST
+import Toolbox.CSAR_Metrics as MT
+import Toolbox.CSAR_Manifest as MF
+import Toolbox.CSAR_Worker as WK
+
+############################
+# input parameters
+############################
+parser = argparse.ArgumentParser(description='Co-ReSyF: SAR Bathymetry Research Application (warm worker)')
+parser.add_argument('-s', '--socket', help='Unix socket of the worker (default: CORESYF_WORKER, else in a private directory of the user)', default=WK.SOCKET or WK.PrivateSocket(), required=False)
+parser.add_argument('--stdin', help='Tasks read on stdin (answers on stdout) instead of the socket', action="store_true")
+parser.add_argument('-b', '--box_sizes', nargs=2, action='append', help='Dimensions (rows columns) of the FFT boxes whose tables are computed at startup (repeatable)', type=int, default=[], required=False)
+parser.add_argument('-f', '--fork', help='Run each task in a child process (parallel tasks, the box spectra are not kept)', action="store_true")
+parser.add_argument('--stop', help='Stop the worker of the socket', action="store_true")
+parser.add_argument('-v','--verbose', help="comments and screen outputs", action="store_true")
+
+args = parser.parse_args()
+
+if args.stop:
+	try:
+		answer = WK.Stop(args.socket)
+	except (IOError, WK.socket.error), message:
+		sys.exit('no worker on %s (%s)' % (args.socket, message))
+	if args.verbose:
+		print 'worker stopped after', answer['tasks'], 'tasks'
+	sys.exit(0)
+
+#-------------------------------------------------------------------
+# warm up: tables of the box dimensions
+#-------------------------------------------------------------------
+SP.WarmTables(args.box_sizes)
+
+if args.stdin:
+	WK.ServeStdin(args.verbose)
+else:
+	if args.verbose:
+		print 'worker listening on', os.path.abspath(args.socket), '(pid %d)' % os.getpid()
+		sys.stdout.flush()
+	WK.Serve(args.socket, args.fork, args.verbose)
@@ -28,10 +28,10 @@ CONTENT:
 
 """
 #
-import	cv2 
-# 
 import cPickle as pickle
 #
+import CSAR_Metrics as MT
+#
 #**************************
 #	ROI
 #**************************
@@ -73,6 +73,7 @@ class StoreIndices:
         self.indices = []
 
     def select_point(self,event,x,y,flags,param):
+            import cv2
             if event == cv2.EVENT_LBUTTONDOWN:
                 #cv2.circle(image,(x,y),3,(255,0,0),-1)
                 self.indices.append((x,y))
@@ -95,6 +96,7 @@ class GridPointsData:
 		self.Tp = Tp
 		self.bathymetry = bathymetry
 
+	@MT.Timed('pickle_write', written=1)
 	def pickle(self,fname):	
 		with open(fname, 'wb') as f:
         		pickle.dump(self, f, pickle.HIGHEST_PROTOCOL)	
@@ -143,13 +145,14 @@ class Processing_Parameters:
 	#--------------------------------------------
 	# gather processing parameters and flag
 	#--------------------------------------------
-	def __init__(self, DataType='uint16',SlantRangeCorrection_Flag=False, ScaleFactor=1., ContrastStretch_Flag=False, LandMaskParameters=None, Band=1):
+	def __init__(self, DataType='uint16',SlantRangeCorrection_Flag=False, ScaleFactor=1., ContrastStretch_Flag=False, LandMaskParameters=None, Band=1, ContrastStretchMethod='clahe'):
 		self.DataType = DataType
 		self.SlantRangeCorrection_Flag = SlantRangeCorrection_Flag	
 		self.ScaleFactor =  ScaleFactor
 		self.ContrastStretch_Flag = ContrastStretch_Flag
 		self.LandMaskParameters = LandMaskParameters
 		self.Band = Band
+		self.ContrastStretchMethod = ContrastStretchMethod
 		
 		
 class Spatial_Reference_System:
@@ -190,10 +193,11 @@ class Subset:
 	#------------------------------------------------
 	# gather subset data (image + coordinates)
 	#------------------------------------------------
-	def __init__(self, CenterPoint, image, coordinates, resolution, FlagFlip):
+	def __init__(self, CenterPoint, image, coordinates, resolution, FlagFlip, EPSG=None):
 		self.CenterPoint = CenterPoint; self.image = image; self.coordinates =  coordinates; 
-		self.resolution =  resolution; self.FlagFlip = FlagFlip;
+		self.resolution =  resolution; self.FlagFlip = FlagFlip; self.EPSG = EPSG
 
+	@MT.Timed('pickle_write', written=1)
 	def pickle(self,fname):	
 		with open(fname, 'wb') as f:
         		pickle.dump(self, f, pickle.HIGHEST_PROTOCOL)			
@@ -206,6 +210,7 @@ class SubsetTransferData:
 	def __init__(self, parameters=[], point=[], SubsetData=[]):
 		self.parameters=parameters; self.point=point; self.SubsetData=SubsetData;
 
+	@MT.Timed('pickle_write', written=1)
 	def pickle(self,fname):	
 		with open(fname, 'wb') as f:
         		pickle.dump(self, f, pickle.HIGHEST_PROTOCOL)			
@@ -244,18 +249,28 @@ class ComputingParametersSpectrum:
 	#-------------------------------------------------------------------------------------------------------------------------------------
 	# gather parameters for subset Processing and Spectrum, main direction determination, Filter (Butterworth) and waves Spectra estimate 
 	#--------------------------------------------------------------------------------------------------------------------------------------
-	def __init__(self, SubsetProcessingParameters, DirectionEstimateParameters, FilterParameters, SpectrumParameters):
+	def __init__(self, SubsetProcessingParameters, DirectionEstimateParameters, FilterParameters, SpectrumParameters, Precision='float64'):
 		self.SubsetProcessingParameters = SubsetProcessingParameters; self.DirectionEstimateParameters = DirectionEstimateParameters;
 		self.FilterParameters = FilterParameters; self.SpectrumParameters = SpectrumParameters;	
+		self.SetPrecision(Precision)
+
+	def SetPrecision(self, Precision):
+		#-------------------------------------------------------------------------------------
+		# precision policy of the spectrum computations ('float64' or 'float32': images,
+		# spectra and filters kept in float32/complex64), passed to the stage parameters
+		#-------------------------------------------------------------------------------------
+		self.Precision = Precision
+		for parameters in [self.SubsetProcessingParameters, self.DirectionEstimateParameters, self.FilterParameters, self.SpectrumParameters.WaveSpectrumParameters]:
+			parameters.Precision = Precision
 
 class SubsetProcessingParameters:
 	#-------------------------------------------------
 	# gather parameters for subset Processing  
 	#-------------------------------------------------
-	def __init__(self, IntensityType=32, ConstrastStretchFlag=False, MeanSubstractionFlag=True, PowerSpectrumFlag=True, DecibelRepresentationFlag=False):
+	def __init__(self, IntensityType=32, ConstrastStretchFlag=False, MeanSubstractionFlag=True, PowerSpectrumFlag=True, DecibelRepresentationFlag=False, ContrastStretchMethod='clahe'):
 		self.IntensityType = IntensityType; self.ConstrastStretchFlag = ConstrastStretchFlag;
 		self.MeanSubstractionFlag = MeanSubstractionFlag; self.PowerSpectrumFlag = PowerSpectrumFlag; 
-		self.DecibelRepresentationFlag = DecibelRepresentationFlag
+		self.DecibelRepresentationFlag = DecibelRepresentationFlag; self.ContrastStretchMethod = ContrastStretchMethod
 
 class DirectionEstimateParameters:
 	#---------------------------------------------------
@@ -326,6 +341,7 @@ class SpectrumData:
 	def __init__(self, k, Spectrum):
 		self.k = k; self.Spectrum = Spectrum; 
 
+	@MT.Timed('pickle_write', written=1)
 	def pickle(self,fname):	
 		with open(fname, 'wb') as f:
         		pickle.dump(self, f, pickle.HIGHEST_PROTOCOL)	
@@ -338,6 +354,7 @@ class SpectrumProcessedData:
 		self.k = k; self.Spectrum = Spectrum; 
 		self.StandardDeviation=StandardDeviation; 
 		self.Wavelength = Wavelength;
+	@MT.Timed('pickle_write', written=1)
 	def pickle(self,fname):	
 		with open(fname, 'wb') as f:
         		pickle.dump(self, f, pickle.HIGHEST_PROTOCOL)
@@ -408,6 +425,7 @@ class InversionData:
 	def __init__(self, InversionParameters, point):
 		self.InversionParameters = InversionParameters; self.point=point;
 
+	@MT.Timed('pickle_write', written=1)
 	def pickle(self,fname):	
 		with open(fname, 'wb') as f:
         		pickle.dump(self, f, pickle.HIGHEST_PROTOCOL)		
@@ -420,6 +438,7 @@ class Global_Parameters:
 		self.ImageParameters = ImageParameters; self.SubsetParameters = SubsetParameters;
 		self.ComputingParameters = ComputingParameters;
 
+	@MT.Timed('pickle_write', written=1)
 	def pickle(self,fname):	
 		with open(fname, 'wb') as f:
         		pickle.dump(self, f, pickle.HIGHEST_PROTOCOL)		
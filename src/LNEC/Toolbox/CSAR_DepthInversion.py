@@ -5,10 +5,9 @@
 import sys, os
 #
 import numpy as np
-#
-from scipy.optimize import minimize
 # 
 import CSAR_Classes as CL
+import CSAR_Metrics as MT
 import CSAR_Utilities as UT
 
 """
@@ -27,6 +26,7 @@ CONTENT:
 #		Inversion Methods
 #***************************************************
 
+@MT.Timed('DirectDepthInversion')
 def DirectDepthInversion(point, Tp):
 	#-------------------------------------------------------------------------------
         #
@@ -63,9 +63,10 @@ def WavePeriodEstimate(Lambda, h):
 	fac = 2*np.pi*h/Lambda	
 	den = np.tanh(fac)
 
-	Tp = np.sqrt(num/den) if (kh<threshold_DW) else np.sqrt(num) 
+	# (vectorised: Lambda and h can be arrays)
+	Tp = np.where(kh<threshold_DW, np.sqrt(num/den), np.sqrt(num))
 	
-	return Tp
+	return Tp[()]
 
 def DepthEstimate(Lambda, Tp):
 	#---------------------------------------------------------------
@@ -87,6 +88,26 @@ def DepthEstimate(Lambda, Tp):
 
 	return depth
 
+def WavelengthEstimate(h, Tp, iterations=20):
+	#---------------------------------------------------------------
+	#	estimate wavelength (given a depth and wave period),
+	#	linear dispersion relation w^2 = g k tanh(k h) solved by 
+	#	Newton iterations (vectorised, h can be an array)
+	#---------------------------------------------------------------
+	g = 9.80665
+	
+	w2 = (2*np.pi/Tp)**2; h = np.asarray(h, dtype=np.float64)
+	
+	# deep water wavenumber as first guess
+	k = np.zeros(h.shape) + w2/g
+	for i in range(iterations):
+		th = np.tanh(k*h)
+		f = g*k*th - w2
+		df = g*th + g*k*h*(1 - th**2)
+		k = k - f/df
+	
+	return 2*np.pi/k
+
 
 #***************************************************
 #	Grid Points Discrimination
@@ -95,42 +116,25 @@ def DiscriminatedGroups(parameters, Points):
 	#----------------------------------------------------------------------------------------
 	# Gather points in groups (DW, nDW, SW or other) and affect a method for depth inversion		
 	#----------------------------------------------------------------------------------------
-	Points = np.asarray(Points);
-	# look for exception points (Deep Water or shallow water)
-	DWpoints, SWpoints, nDWpoints, Otherpoints, GlobalPoints = [], [], [], [], []
-	for point in Points:	 
-		flag = point.DiscriminationFlag
-		if flag == 0:
-			Tp = WavePeriodEstimate(point.wavelength, abs(point.apriori_bathymetry))
-			pt = CL.GridPointsData(point.IndexEasting, point.IndexNorthing, point.easting, point.northing, 
-						point.apriori_bathymetry, point.Spectrum, point.wavelength, flag, Tp, point.apriori_bathymetry) 
-			DWpoints.append(pt)
-		elif flag == -1:
-			pt = CL.GridPointsData(point.IndexEasting, point.IndexNorthing, point.easting, point.northing, 
-						point.apriori_bathymetry, point.Spectrum, point.wavelength, flag, 0, np.nan)
-			SWpoints.append(pt)
-		else:
-			Otherpoints.append(point)
-	# gather points
-	DWpoints=np.asarray(DWpoints); SWpoints=np.asarray(SWpoints)
+	# columnar table of the points, groups given by masks on the discrimination flag
+	table = UT.PointsTable(Points, ('DiscriminationFlag', 'wavelength', 'apriori_bathymetry'))
+	Points, flag = table['points'], table['DiscriminationFlag']
+	DW, SW = (flag == 0), (flag == -1)
+	Other = ~(DW | SW)
+
+	# look for exception points (Deep Water or shallow water): Tp estimated in deep water
+	Tp = WavePeriodEstimate(table['wavelength'][DW], abs(table['apriori_bathymetry'][DW]))
+	DWpoints = np.asarray([CL.GridPointsData(point.IndexEasting, point.IndexNorthing, point.easting, point.northing, point.apriori_bathymetry, 
+				point.Spectrum, point.wavelength, point.DiscriminationFlag, T, point.apriori_bathymetry) for point, T in zip(Points[DW], Tp)])
+	SWpoints = np.asarray([CL.GridPointsData(point.IndexEasting, point.IndexNorthing, point.easting, point.northing, point.apriori_bathymetry, 
+				point.Spectrum, point.wavelength, point.DiscriminationFlag, 0, np.nan) for point in Points[SW]])
 	ExceptionPoints = CL.ExceptionPoints(DWpoints,SWpoints)
 
 	# if no deep water points look for near deep water point
-	lDW = len(DWpoints)
-	Otherpoints=np.asarray(Otherpoints)
-	if lDW == 0 and parameters.InversionMethod != 'direct':
-		nDWpoints = []; 
-		for point in Otherpoints:
-			flag = point.DiscriminationFlag
-			if flag == 0.5:
-				nDWpoints.append(point)
-			else:
-				GlobalPoints.append(point)
-	else:
-		GlobalPoints = Otherpoints
-
-	#gather points
-	nDWpoints = np.asarray(nDWpoints); GlobalPoints = np.asarray(GlobalPoints)
+	nDW = np.zeros(flag.shape, dtype=bool)
+	if not DW.any() and parameters.InversionMethod != 'direct':
+		nDW = Other & (flag == 0.5)
+	nDWpoints, GlobalPoints = Points[nDW], Points[Other & ~nDW]
 	ComputationPoints = CL.ComputationPoints(GlobalPoints, nDWpoints)
 	 
 	# sum up grid point status
@@ -21,14 +21,15 @@ CONTENT:
 	IMAGE PROCESSING
 		ImageCenter		
 
-		ScaleImage		ContrastStretch		ContrastStretch2	ImageContrastStretch
-		SlantRangeGTiFF		SlantRangeCorrection
+		ScaleImage		ContrastStretch		CLAHE			ContrastStretch2	ImageContrastStretch
+		SlantRangeGTiFF		SlantRangeCorrection	SlantRangeProfile
+		StretchHistograms	StretchParameters	ClaheLuts	StretchBlock	ClaheTileSize
 
 		LabelToString		ImageLabel		
 
 		UnibandTransform	Convert1BandTiff
 
-		ReadGtiffRaster		GetGtiffInformation	CreateOutputGtiff	array2raster	CreateGTiFF			
+		ReadGtiffRaster		GetGtiffInformation	CreateOutputGtiff	OpenOutputGtiff	array2raster	CreateGTiFF			
 						
 		ImagePadding		ResolutionPixels
 	
@@ -43,20 +44,23 @@ import glob
 #
 import argparse
 import ConfigParser
+import multiprocessing
+from multiprocessing.pool import ThreadPool
 #
 import numpy as np
-import matplotlib.pyplot as plt
 #
 import cv2
-from skimage import exposure
-from osgeo import gdal, osr
 #
 import CSAR_Classes as CL
+import CSAR_Imports as LI
+import CSAR_Metrics as MT
 import CSAR_Utilities as UT
 import CSAR_ROI as ROI
 #
 from datetime import datetime
 #
+plt = LI.Lazy('matplotlib.pyplot')
+gdal, osr = LI.Lazy('osgeo.gdal'), LI.Lazy('osgeo.osr')
 
 ###########################################################
 #
@@ -75,6 +79,7 @@ def InputSubsetParameters():
 	parser.add_argument('-i', '--input', help='Input image (to be processed)', required=True)
 	parser.add_argument('-b','--bathymetry', help='Bathymetric grid in a txt or npz file',required=True)
 	parser.add_argument('-p', '--processing', nargs='+', help='Image Processing Filters (Slant Range Correction, ContrastStretch)', default=[True, True], required=False)
+	parser.add_argument('--contrast_method', help='Contrast stretch method: percentile (2-98%%), histogram (equalization), clahe (adaptive equalization) or minmax', choices=CONTRAST_METHODS, default='clahe', required=False)
 	parser.add_argument('-r', '--reference_system', nargs='+', help='Spatial Reference system EPSG code (Selected Image and Projection, cf. gdalinfo for image information and \
 				http://spatialreference.org/ref/epsg/)', required=True)
 
@@ -99,6 +104,7 @@ def InputSubsetParameters():
 	#image
 	Config.set("Arguments", "Input_image", args.input); Config.set("Arguments", "Bathymetry_file", args.bathymetry)
 	Config.set("Arguments", "Image_processing_filters", args.processing); Config.set("Arguments", "Reference_systems", args.reference_system)
+	Config.set("Arguments", "Contrast_stretch_method", args.contrast_method)
 	#subscene	
 	Config.set("Arguments", "Subscene_list", args.output); Config.set("Arguments", "Box_dimension", args.dimension)
 	Config.set("Arguments", "Number_of_boxes", args.window); Config.set("Arguments", "Box_shift", args.shift)	
@@ -115,13 +121,14 @@ def InputSubsetParameters():
 	file_path_name = CL.File_path_name('', args.input, '', '')
 	Point = np.zeros(2) + 1000; Point = Point.astype(int)
 	LandMask_Parameters = CL.LandMaskParameters()	
-	ProcessingParameters = CL.Processing_Parameters('uint16', Slant_Correction, 1., Contrast_Stretch, LandMask_Parameters)
+	ProcessingParameters = CL.Processing_Parameters('uint16', Slant_Correction, 1., Contrast_Stretch, LandMask_Parameters, ContrastStretchMethod=args.contrast_method)
 	SpatialReferenceSystem = CL.Spatial_Reference_System(args.reference_system[0], args.reference_system[1])
 	Subsetparameters = CL.SubsetParameters(Point, float(args.dimension), True, float(args.shift), int(float(args.window)))
 	Image_Parameters = CL.ImageParameters(file_path_name, ProcessingParameters, SpatialReferenceSystem)
 	
 	return Subsetparameters, Image_Parameters, args, args.verbose
 
+@MT.Timed('ReadSARImg')
 def ReadSARImg(parameters):
 
 	#------------------------------------------------------------
@@ -157,7 +164,7 @@ def ReadSARImg(parameters):
 	if parameters.ProcessingParameters.SlantRangeCorrection_Flag:
 		if (ImgType["ENVISAT"] or ImgType["ERS1/2"] or ImgType["GeoTIFF"]):
 			fileout_slant  = fname_input[:-4]+"_Slant.tif"; fout = path_input + fileout_slant
-			SlantRangeGTiFF(flin,fout, EPSG_in)
+			SlantRangeGTiFF(flin,fout, EPSG_in, parameters.ProcessingParameters.ContrastStretchMethod)
 			filein = fileout_slant
 
 	# Scale image
@@ -210,7 +217,7 @@ def ReadSARImg(parameters):
 	
 	# stretch contrast (CS is the reference image)
 	if parameters.ProcessingParameters.ContrastStretch_Flag:
-		img = ImageContrastStretch(coordinates, img, flin, EPSG_out)
+		img = ImageContrastStretch(coordinates, img, flin, EPSG_out, Method=parameters.ProcessingParameters.ContrastStretchMethod)
 	else:
 		flin = path + filein; fout = path_output + filein[:-4].split(pattern)[-1] + "_CS.tif"
 		os.system("cp " + flin + " " + fout)
@@ -442,9 +449,16 @@ def ScaleImage(img,type):
 	return img_new
 
 
-def ContrastStretch(img,intensitytype=32):
+# contrast stretch methods (ContrastStretch, the former choice 1-4 in this order)
+CONTRAST_METHODS = ['percentile', 'histogram', 'clahe', 'minmax']
+
+def ContrastStretch(img,intensitytype=32,method='clahe',clip_limit=0.03):
 	#------------------------------------------------------------------
 	# stretch image band (0->1, 0->255,...) depending on image format
+	#	percentile	rescale the 2-98% percentile range (0->fac)
+	#	histogram	histogram equalization (0->1)
+	#	clahe		contrast limited adaptive histogram equalization (0->1)
+	#	minmax		rescale the min-max range (0->fac)
 	#------------------------------------------------------------------
 	
 	# intensity reference
@@ -455,22 +469,24 @@ def ContrastStretch(img,intensitytype=32):
 	elif intensitytype == 32:
 		fac = 1.
 	
-	# normalize image
-	#img = img /np.max(img)		
+	# former numeric choice
+	if method in range(1, len(CONTRAST_METHODS)+1):
+		method = CONTRAST_METHODS[method-1]
 
 	# equalize image histogram
-	choice = 3
-
-	if choice == 1:
-		p2 = np.percentile(img, 2)
-		p98 = np.percentile(img, 98)
-		img_eq = exposure.rescale_intensity(img, in_range=(p2, p98))
-	elif choice == 2:
-		img_eq = exposure.equalize_hist(img)
-	elif choice == 3:	
-	        img_eq = exposure.equalize_adapthist(img, clip_limit=0.03)
-	elif choice == 4:
+	if method == 'percentile':
+		p2, p98 = np.percentile(img, [2, 98])
+		img_eq = fac * np.clip((img - p2) / float(max(p98 - p2, np.finfo(float).tiny)), 0, 1)
+	elif method == 'histogram':
+		hist, edges = np.histogram(img, 256)
+		cdf = np.cumsum(hist) / float(hist.sum())
+		img_eq = np.interp(img, (edges[:-1] + edges[1:]) / 2., cdf)
+	elif method == 'clahe':	
+		img_eq = CLAHE(img, clip_limit)
+	elif method == 'minmax':
 		img_eq = fac * (img - np.min(img)) / (np.max(img) - np.min(img))
+	else:
+		sys.exit("Contrast stretch method not defined (" + ", ".join(CONTRAST_METHODS) + ")")
 	#figure (control)
 	flagplot=0
 	
@@ -484,8 +500,54 @@ def ContrastStretch(img,intensitytype=32):
 	
    	return img_eq
 
+@MT.Timed('CLAHE')
+def CLAHE(img, clip_limit=0.03, tiles=(8, 8), workers=None, ParallelPixels=1 << 22):
+	#-----------------------------------------------------------------------------------------
+	# contrast limited adaptive histogram equalization with cv2 (parameters of skimage
+	# equalize_adapthist: tiles of 1/8 of the image, 256 bins, clip limit as a fraction
+	# of the tile pixels), output between 0 and 1.
+	# Images larger than ParallelPixels are processed in bands of tile rows on a pool of
+	# threads: each band is equalized with one tile row of overlap on both sides (the
+	# pixels of a tile are interpolated between the neighbouring tiles only), so the bands
+	# give the scene result
+	#-----------------------------------------------------------------------------------------
+	rows, cols = img.shape; ty, tx = tiles
+	th, tw = ClaheTileSize(img.shape, tiles)
+
+	# 8 bits image (256 bins) scaling
+	vmin, vmax = float(np.nanmin(img)), float(np.nanmax(img))
+	scale = 255. / max(vmax - vmin, np.finfo(float).tiny)
+	equalized = np.empty((rows, cols), dtype=np.uint8)
+
+	def Band(band):
+		#-----------------------------------------------------------------------
+		# equalize the tile rows band[0]:band[1] (with one tile row of overlap)
+		#-----------------------------------------------------------------------
+		first, last = max(band[0] - 1, 0), min(band[1] + 1, ty)
+		image = np.nan_to_num(img[first*th:last*th]) if img.dtype.kind == 'f' else img[first*th:last*th]
+		image = cv2.convertScaleAbs(image, alpha=scale, beta=-vmin*scale)
+		# padded to whole tiles as cv2 does for the scene (see ClaheTileSize)
+		image = cv2.copyMakeBorder(image, 0, (last - first)*th - image.shape[0], 0, tx*tw - cols, cv2.BORDER_REFLECT_101)
+		clahe = cv2.createCLAHE(clipLimit=clip_limit*256, tileGridSize=(tx, last - first))
+		top, bottom = band[0]*th, min(band[1]*th, rows)
+		equalized[top:bottom] = clahe.apply(image)[top - first*th:bottom - first*th, :cols]
+
+	# bands of tile rows, one per thread
+	workers = workers or multiprocessing.cpu_count()
+	if rows * cols <= ParallelPixels or workers == 1 or ty < 3:
+		Band((0, ty))
+	else:
+		height = -(-ty // min(workers, ty))
+		pool = ThreadPool(min(workers, -(-ty // height)))
+		pool.map(Band, [(first, min(first + height, ty)) for first in range(0, ty, height)])
+		pool.close(); pool.join()
+
+	# rescale (0->1)
+	emin, emax = cv2.minMaxLoc(equalized)[:2]
+	return (equalized - emin) / max(emax - emin, 1.)
 
-def ImageContrastStretch(coordinates, img, filein, EPSG, Band=1):
+
+def ImageContrastStretch(coordinates, img, filein, EPSG, Band=1, Method='clahe'):
 	#---------------------------------------------------------------------
 	# stretch contrast of the image according to its type and save raster
 	#---------------------------------------------------------------------	
@@ -496,12 +558,12 @@ def ImageContrastStretch(coordinates, img, filein, EPSG, Band=1):
                 pattern =  '\\'
                 
 	path = pattern.join(filein.split(pattern)[:-1]); pathf ='' if path=='' else  path + pattern # detect path
-	fileext =  pathf + filein[:-4].split(pattern)[-1]; ext = "_CS.tif";  fileCS = glob.glob(fileext + ext) #output path
+	fileext =  pathf + filein[:-4].split(pattern)[-1]; ext = "_CS.tif" if Method == 'clahe' else "_CS_" + str(Method) + ".tif";  fileCS = glob.glob(fileext + ext) #output path
 
 	if len(fileCS)==0:
 		#A create file if it does not exist
 		# Stretch contrast
-		img = ContrastStretch(img)
+		img = ContrastStretch(img, method=Method)
 
 		#consider 1st band if multiband gray image
 		if len(img.shape)==3:
@@ -523,35 +585,164 @@ def ImageContrastStretch(coordinates, img, filein, EPSG, Band=1):
 
 	return img
 
-def SlantRangeGTiFF(filein,fileout,EPSG):
-	#------------------------------------------------------------
-	# Perform slant range correction and create corrected image 
-	#------------------------------------------------------------
+@MT.Timed('SlantRangeGTiFF', read=0, written=1)
+def SlantRangeGTiFF(filein,fileout,EPSG,Method='clahe',BlockRows=256):
+	#-----------------------------------------------------------------------------------------
+	# Perform slant range correction and create corrected image, streamed by blocks of rows
+	# (same result as ContrastStretch, SlantRangeCorrection and ScaleImage(8) of the image, 
+	# with a few blocks in memory instead of copies of the image):
+	#	1) histograms of the image (of its CLAHE tiles) -> contrast stretch
+	#	2) stretched column profile (and extrema) -> slant range correction and scaling
+	#	3) stretch, correction and scaling of each block written in the output
+	#-----------------------------------------------------------------------------------------
 	
 	# open file and get information
-	img, Info = GetGtiffInformation(filein)
-	
-	# image processing
-	img1 = ContrastStretch(img)		# stretch contrast
-	img2 = SlantRangeCorrection(img1,EPSG)	# Slant Range correction
-	imgr = ScaleImage(img2,8)		# image scaling according to type
-	
-	# create Gtiff output image
-	CreateOutputGtiff(imgr, fileout, Info)
+	_, Info = GetGtiffInformation(filein, ReadImage=False)
+	f = gdal.Open(filein); band = f.GetRasterBand(1)
+	rows, cols = band.YSize, band.XSize
+	blocks = [(yoff, min(BlockRows, rows - yoff)) for yoff in range(0, rows, BlockRows)]
+	def Read(block):
+		return band.ReadAsArray(0, block[0], cols, block[1]).astype(np.uint16)
+
+	# 1) contrast stretch
+	tiles = (8, 8) if Method in ['clahe', 3] else (1, 1)
+	histograms = np.zeros((tiles[0]*tiles[1], 65536), dtype=np.int32)
+	for block in blocks:
+		StretchHistograms(histograms, Read(block), block[0], (rows, cols), tiles)
+	stretch = StretchParameters(Method, histograms, (rows, cols), tiles)
+
+	# 2) column profile of the stretched image
+	total, cmin, cmax = np.zeros(cols), np.inf, -np.inf
+	for block in blocks:
+		img = StretchBlock(stretch, Read(block), block[0])
+		total += img.sum(axis=0); cmin = np.minimum(cmin, img.min(axis=0)); cmax = np.maximum(cmax, img.max(axis=0))
+	# equalized (CLAHE) image rescaled between its extrema
+	emin, emax = cmin.min(), cmax.max()
+	if 'luts' in stretch:
+		stretch['offset'], stretch['range'] = emin, max(emax - emin, 1.)
+		total, cmin, cmax = (total - rows*emin) / stretch['range'], (cmin - emin) / stretch['range'], (cmax - emin) / stretch['range']
+	slant_corr = SlantRangeProfile(total / rows)
+	vmax = np.maximum(cmin * slant_corr, cmax * slant_corr).max()
+
+	# 3) corrected and scaled (8 bits) image
+	output_raster = OpenOutputGtiff(fileout, Info)
+	for block in blocks:
+		img = StretchBlock(stretch, Read(block), block[0]) * slant_corr[np.newaxis, :]
+		output_raster.GetRasterBand(1).WriteArray(np.array(img*255./vmax, dtype=np.uint8), 0, block[0])
+	output_raster = None; f = None
 
 	return None
 
-def SlantRangeCorrection(img,EPSG):
-
-	#---------------------------------------------
-	# perform slant range correction
-	#---------------------------------------------
+def ClaheTileSize(shape, tiles):
+	#---------------------------------------------------------------------------------
+	# CLAHE tile size (rows, columns) of an image: cv2 pads the image by reflection
+	# with (tiles - size % tiles) rows and columns unless both dimensions are whole 
+	# numbers of tiles
+	#---------------------------------------------------------------------------------
+	(rows, cols), (ty, tx) = shape, tiles
+	if rows % ty == 0 and cols % tx == 0:
+		return rows // ty, cols // tx
+	return (rows + ty - rows % ty) // ty, (cols + tx - cols % tx) // tx
+
+def StretchHistograms(histograms, img, yoff, shape, tiles=(1, 1)):
+	#--------------------------------------------------------------------------------
+	# add the rows yoff: of an image (shape) to the histograms (uint16 values) of its
+	# tiles: image padded to whole tiles by reflection as cv2 CLAHE does
+	#--------------------------------------------------------------------------------
+	rows, cols = shape; ty, tx = tiles
+	th, tw = ClaheTileSize(shape, tiles)
+	# source row/column of the padded image rows/columns
+	source = lambda n, size: np.where(np.arange(n) < size, np.arange(n), 2*(size - 1) - np.arange(n))
+	srows, scols = source(ty*th, rows), source(tx*tw, cols)
+	# padded rows whose source is in the block, by row of tiles
+	padded = np.nonzero((srows >= yoff) & (srows < yoff + img.shape[0]))[0]
+	tile = (np.arange(tx*tw) // tw)[np.newaxis, :] * 65536
+	for row in np.unique(padded // th):
+		values = img[srows[padded[padded // th == row]] - yoff][:, scols]
+		histograms[row*tx:(row+1)*tx] += np.bincount((tile + values).ravel(), minlength=tx*65536).reshape(tx, 65536).astype(histograms.dtype)
+	return histograms
+
+def StretchParameters(method, histograms, shape, tiles=(1, 1), intensitytype=32, clip_limit=0.03):
+	#------------------------------------------------------------------------------------
+	# contrast stretch of uint16 values (see ContrastStretch) from the image histograms:
+	# lut of the values (percentile, histogram, minmax) or quantization and tiles luts
+	# (clahe, see CLAHE)
+	#------------------------------------------------------------------------------------
+	fac = {8: 255., 16: 65536., 32: 1.}[intensitytype]
+	if method in range(1, len(CONTRAST_METHODS)+1):
+		method = CONTRAST_METHODS[method-1]
+	histogram = histograms.sum(axis=0, dtype=np.int64); values = np.arange(65536, dtype=np.float64)
+	present = np.nonzero(histogram)[0]; vmin, vmax = float(present[0]), float(present[-1])
+	stretch = {'offset': 0., 'range': 1.}
+
+	if method == 'percentile':
+		# percentiles (linear interpolation) from the cumulated histogram
+		cumulated = np.cumsum(histogram); position = np.array([2, 98]) / 100. * (cumulated[-1] - 1)
+		lower = np.searchsorted(cumulated, np.floor(position), side='right'); upper = np.searchsorted(cumulated, np.ceil(position), side='right')
+		p2, p98 = lower + (upper - lower) * (position - np.floor(position))
+		stretch['lut'] = fac * np.clip((values - p2) / float(max(p98 - p2, np.finfo(float).tiny)), 0, 1)
+	elif method == 'histogram':
+		hist, edges = np.histogram(present, 256, range=(vmin, vmax), weights=histogram[present])
+		cdf = np.cumsum(hist) / float(hist.sum())
+		stretch['lut'] = np.interp(values, (edges[:-1] + edges[1:]) / 2., cdf)
+	elif method == 'clahe':
+		# 8 bits quantization (as cv2.convertScaleAbs) and luts of the tiles histograms
+		scale = 255. / max(vmax - vmin, np.finfo(float).tiny)
+		stretch['quantization'] = np.uint8(np.clip(np.rint(np.abs(values.astype(np.float32) * np.float32(scale) + np.float32(-vmin*scale))), 0, 255))
+		hist = np.zeros((histograms.shape[0], 256), dtype=np.int64)
+		for tile in range(histograms.shape[0]):
+			hist[tile] = np.bincount(stretch['quantization'], weights=histograms[tile], minlength=256)
+		rows, cols = shape; ty, tx = tiles
+		th, tw = ClaheTileSize(shape, tiles)
+		stretch['luts'] = ClaheLuts(hist, th*tw, clip_limit).reshape(ty, tx, 256)
+		stretch['tile'] = (th, tw)
+	elif method == 'minmax':
+		stretch['lut'] = fac * (values - vmin) / (vmax - vmin)
+	else:
+		sys.exit("Contrast stretch method not defined (" + ", ".join(CONTRAST_METHODS) + ")")
+	return stretch
+
+def ClaheLuts(hist, area, clip_limit):
+	#--------------------------------------------------------------------------------
+	# CLAHE luts of the tiles histograms (256 bins), clipped and redistributed as cv2
+	#--------------------------------------------------------------------------------
+	limit = max(int(clip_limit * 256 * area / 256.), 1)
+	hist = hist.copy()
+	clipped = np.maximum(hist - limit, 0).sum(axis=1); hist = np.minimum(hist, limit)
+	hist += (clipped // 256)[:, np.newaxis]
+	for tile, residual in enumerate(clipped % 256):
+		if residual:
+			step = max(256 // residual, 1)
+			hist[tile, np.arange(0, 256, step)[:residual]] += 1
+	return np.uint8(np.clip(np.rint(np.cumsum(hist, axis=1).astype(np.float32) * np.float32(255. / area)), 0, 255))
+
+def StretchBlock(stretch, img, yoff):
+	#-------------------------------------------------------------------
+	# contrast stretch of the rows yoff: of an image (float64 values)
+	#-------------------------------------------------------------------
+	if 'lut' in stretch:
+		return stretch['lut'][img]
+
+	# CLAHE: bilinear interpolation of the luts of the neighbouring tiles (as cv2)
+	luts, (th, tw) = stretch['luts'], stretch['tile']; ty, tx = luts.shape[:2]
+	def Neighbours(n, size, tiles, offset=0):
+		position = (np.arange(offset, offset + n, dtype=np.float32) * np.float32(1. / size) - np.float32(0.5))
+		first = np.floor(position).astype(int); weight = (position - first).astype(np.float32)
+		return np.maximum(first, 0), np.minimum(first + 1, tiles - 1), weight
+	y1, y2, ya = Neighbours(img.shape[0], th, ty, yoff); x1, x2, xa = Neighbours(img.shape[1], tw, tx)
+	q = stretch['quantization'][img]
+	top = luts[y1[:, np.newaxis], x1, q] * (1 - xa) + luts[y1[:, np.newaxis], x2, q] * xa
+	bottom = luts[y2[:, np.newaxis], x1, q] * (1 - xa) + luts[y2[:, np.newaxis], x2, q] * xa
+	equalized = np.clip(np.rint(top * (1 - ya)[:, np.newaxis] + bottom * ya[:, np.newaxis]), 0, 255)
+	return (equalized - stretch['offset']) / stretch['range']
+
+def SlantRangeProfile(slant_profile):
+	#----------------------------------------------------------------------
+	# slant range correction (column-wise) from the mean intensity profile
+	#----------------------------------------------------------------------
 	fac = 0.15
-	# get mean pixel intensity line (column-wise)
-	slant_profile=np.mean(img, axis=0)
-	
 	# define filtering window according to image width
-	width=img.shape[1]
+	width=slant_profile.shape[0]
 	window=int(width*fac)
 	
 	# estimate intensity extremum value at the line (image) edge
@@ -561,6 +752,19 @@ def SlantRangeCorrection(img,EPSG):
 	slant_corr=np.linspace(s_min,smax,num=slant_profile.shape[0])	
 	slant_corr=slant_corr[::-1]
 	
+	return slant_corr
+
+def SlantRangeCorrection(img,EPSG):
+
+	#---------------------------------------------
+	# perform slant range correction
+	#---------------------------------------------
+	# get mean pixel intensity line (column-wise)
+	slant_profile=np.mean(img, axis=0)
+	
+	# create correction vector
+	slant_corr=SlantRangeProfile(slant_profile)
+	
 	#apply correction to the whole image
 	img_corr=img*slant_corr[:,np.newaxis].transpose()
 
@@ -607,6 +811,7 @@ def Convert1BandTiff(filein,band):
 	return fileout
 
 
+@MT.Timed('ReadGtiffRaster', read=0)
 def ReadGtiffRaster(filein, datatype = 'uint16'):
 	# read projected image and get rasterband
 	f = gdal.Open(filein); a = f.GetRasterBand(1)
@@ -619,10 +824,13 @@ def ReadGtiffRaster(filein, datatype = 'uint16'):
 	
 	return f, a, img 
  
-def GetGtiffInformation(filein,EPSG=0):
+def GetGtiffInformation(filein,EPSG=0,ReadImage=True):
 
-	# open file and get information
-	f, a, img = ReadGtiffRaster(filein)
+	# open file and get information (without reading the pixels if not ReadImage)
+	if ReadImage:
+		f, a, img = ReadGtiffRaster(filein)
+	else:
+		f = gdal.Open(filein); a = f.GetRasterBand(1); img = None
 	
 	# metadata
 	Metadata = f.GetMetadata()
@@ -654,6 +862,21 @@ def GetGtiffInformation(filein,EPSG=0):
 def CreateOutputGtiff(img, fileout, GtiffInformation):
 	
 	#create the output Gtiff file
+	output_raster = OpenOutputGtiff(fileout, GtiffInformation)
+
+	# write array in raster
+	output_raster.GetRasterBand(1).WriteArray(img)   
+
+	# deallocate raster	
+	output_raster = None;
+	
+	return None
+
+def OpenOutputGtiff(fileout, GtiffInformation):
+	#------------------------------------------------------------------
+	# create the output (8 bits) Gtiff file with the input information,
+	# to be written by blocks
+	#------------------------------------------------------------------
 	ncols = GtiffInformation.ncols; nrows = GtiffInformation.nrows;
 	output_raster = gdal.GetDriverByName('GTiff').Create(fileout,ncols, nrows, 1 ,gdal.GDT_Byte)  # Open the file
 	
@@ -671,15 +894,9 @@ def CreateOutputGtiff(img, fileout, GtiffInformation):
 
 
 	#print GtiffInformation.Metadata
-	# write array in raster
-	output_raster.GetRasterBand(1).WriteArray(img)   
 	output_raster.GetRasterBand(1).SetNoDataValue(0) # exception (dark)
 	
-
-	# deallocate raster	
-	output_raster = None;
-	
-	return None
+	return output_raster
 
 def array2raster(img, coordinates, EPSG, filein, fileout="ImgOut.tif"):
 	#------------------------------------------------------------
@@ -0,0 +1,38 @@
+#!/usr/bin/python2.7
+# -*- coding: utf-8 -*-
+
+
+"""
+=====================================================================================================
+Lazy imports of the heavy dependencies (matplotlib, GDAL, scikit-image, scipy.interpolate)
+=====================================================================================================
+ Date: Oct/2026
+=====================================================================================================
+	The scripts of the processing chain are launched once per grid point, so the Toolbox modules
+	import at startup only what their main computations need (numpy, cv2). The other dependencies
+	are modules imported the first time one of their attributes is used:
+
+		plt = LI.Lazy('matplotlib.pyplot')	# matplotlib imported by the first plt.subplots()
+
+	(see SAR_ImportTime for the import time of the scripts)
+
+	Lazy
+"""
+#
+import importlib
+#
+
+class Lazy(object):
+	#------------------------------------------------------------------
+	# module imported on the first access to one of its attributes
+	#------------------------------------------------------------------
+	def __init__(self, name):
+		self.__dict__['_name'] = name; self.__dict__['_module'] = None
+
+	def __getattr__(self, attribute):
+		if self._module is None:
+			self.__dict__['_module'] = importlib.import_module(self._name)
+		return getattr(self._module, attribute)
+
+	def __repr__(self):
+		return '<lazy module %s%s>' % (self._name, '' if self._module is None else ' (imported)')
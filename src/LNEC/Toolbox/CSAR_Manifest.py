@@ -0,0 +1,177 @@
+#!/usr/bin/python2.7
+# -*- coding: utf-8 -*-
+
+
+"""
+=====================================================================================================
+Run manifest: state of each grid point in each stage to resume interrupted runs
+=====================================================================================================
+ Date: Oct/2026
+=====================================================================================================
+	The manifest (RunManifest.jsonl in the run directory) is a journal appended by the scripts
+	(which may run in parallel, the file is locked while appending): one line per state change of
+	an item (grid point index or 'all') of a stage (tiling, spectrum, subdivision, inversion,
+	postprocessing):
+
+		pending		the stage started processing the item
+		done		the outputs of the item are written (with their md5 checksums)
+		failed		the script exited before committing the item (error, sys.exit)
+
+	A stage skips the items already done (whose outputs, if still present, match their
+	checksum) and removes its input files only after committing its outputs, so that a run
+	killed at any time resumes without recomputation by running the same commands again.
+	SAR_Tiling starts a new manifest (and cleans the Output directory) only when the run
+	parameters differ from the ones of the manifest.
+
+	The scripts run once per grid point check a single item: the done record of each item is
+	also written as a marker file (RunManifest.d/<stage>/<item>.json, removed when the item is
+	started again), read instead of the whole journal. The scripts checking many items read the
+	journal once (States).
+
+	Signature	Reset		Start		Commit		Done
+	States		Marker		Checksum
+"""
+#
+import os, json, time, fcntl, atexit, hashlib, shutil
+#
+
+MANIFEST = 'RunManifest.jsonl'
+
+# items started by this script and not committed yet
+Running = set()
+
+#******************************************************
+#	   JOURNAL
+#******************************************************
+def Checksum(fname):
+	#------------------------------
+	# md5 checksum of a file
+	#------------------------------
+	md5 = hashlib.md5()
+	with open(fname, 'rb') as f:
+		for chunk in iter(lambda: f.read(1 << 20), b''):
+			md5.update(chunk)
+	return md5.hexdigest()
+
+def Records(fname=MANIFEST):
+	#----------------------------------------------------------------------
+	# records of the journal (a line truncated by a crash is ignored)
+	#----------------------------------------------------------------------
+	records = []
+	if os.path.exists(fname):
+		with open(fname) as f:
+			for line in f:
+				try:
+					records.append(json.loads(line))
+				except ValueError:
+					pass
+	return records
+
+def Append(record, fname=MANIFEST, mode='a'):
+	record['time'] = time.strftime('%Y-%m-%dT%H:%M:%S')
+	with open(fname, mode) as f:
+		fcntl.flock(f, fcntl.LOCK_EX)
+		f.write(json.dumps(record, sort_keys=True) + '\n')
+		f.flush(); os.fsync(f.fileno())
+
+def Markers(fname=MANIFEST):
+	#------------------------------------------------
+	# directory of the marker files of the manifest
+	#------------------------------------------------
+	return os.path.splitext(fname)[0] + '.d'
+
+def Marker(stage, item, fname=MANIFEST):
+	#-------------------------------------------------------------------------------
+	# marker file of an item (in the markers directory of the manifest)
+	#-------------------------------------------------------------------------------
+	return os.path.join(Markers(fname), stage, str(item) + '.json')
+
+def States(fname=MANIFEST):
+	#------------------------------------------
+	# last record of each (stage, item) pair
+	#------------------------------------------
+	return dict(((record['stage'], record['item']), record) for record in Records(fname) if 'stage' in record)
+
+#******************************************************
+#	   RUN
+#******************************************************
+def Signature(fname=MANIFEST):
+	#------------------------------------------------------
+	# run parameters of the manifest (None: no manifest)
+	#------------------------------------------------------
+	for record in Records(fname):
+		if 'run' in record:
+			return record['run']
+	return None
+
+def Reset(signature, fname=MANIFEST):
+	#------------------------------------------------------
+	# start a new manifest with the run parameters
+	#------------------------------------------------------
+	Append({'run': signature}, fname, 'w')
+	if os.path.isdir(Markers(fname)):
+		shutil.rmtree(Markers(fname))
+	os.makedirs(Markers(fname))
+
+#******************************************************
+#	   STAGES
+#******************************************************
+def Done(stage, item, states=None, fname=MANIFEST):
+	#-------------------------------------------------------------------------------
+	# whether an item is done (outputs consumed by the next stage are not checked);
+	# states: records of the manifest (see States) when checking many items, else
+	# the marker file of the item is read (the journal of a manifest without
+	# markers, written by a previous version)
+	#-------------------------------------------------------------------------------
+	if states is not None:
+		record = states.get((stage, str(item)))
+	elif not os.path.isdir(Markers(fname)):
+		record = States(fname).get((stage, str(item)))
+	else:
+		try:
+			with open(Marker(stage, item, fname)) as f:
+				record = json.load(f)
+		except (IOError, ValueError):
+			record = None
+	if record is None or record['state'] != 'done':
+		return False
+	return all(Checksum(output) == checksum for output, checksum in record['outputs'].items() if os.path.exists(output))
+
+def Start(stage, item, fname=MANIFEST):
+	#---------------------------------------------------------------------
+	# mark an item as pending (failed if the script exits before Commit)
+	#---------------------------------------------------------------------
+	if os.path.exists(Marker(stage, item, fname)):
+		os.remove(Marker(stage, item, fname))
+	Append({'stage': stage, 'item': str(item), 'state': 'pending', 'pid': os.getpid()}, fname)
+	Running.add((stage, str(item), os.path.abspath(fname)))
+
+def Commit(stage, item, outputs=(), fname=MANIFEST):
+	#------------------------------------------------------
+	# mark an item as done, with the checksum of its outputs
+	#------------------------------------------------------
+	checksums = dict((output, Checksum(output)) for output in outputs)
+	record = {'stage': stage, 'item': str(item), 'state': 'done', 'outputs': checksums}
+	Append(record, fname)
+	if os.path.isdir(Markers(fname)):
+		# marker written complete (renamed), the parallel scripts read it
+		marker = Marker(stage, item, fname)
+		if not os.path.isdir(os.path.dirname(marker)):
+			try:
+				os.makedirs(os.path.dirname(marker))
+			except OSError:
+				pass		# created by a parallel script
+		with open(marker + '.%d' % os.getpid(), 'w') as f:
+			json.dump(record, f, sort_keys=True)
+		os.rename(marker + '.%d' % os.getpid(), marker)
+	Running.discard((stage, str(item), os.path.abspath(fname)))
+
+def Failed():
+	#----------------------------------------------
+	# mark the items not committed at exit as failed
+	#----------------------------------------------
+	for stage, item, fname in sorted(Running):
+		Append({'stage': stage, 'item': item, 'state': 'failed', 'pid': os.getpid()}, fname)
+	Running.clear()
+
+atexit.register(Failed)
@@ -0,0 +1,265 @@
+#!/usr/bin/python2.7
+# -*- coding: utf-8 -*-
+
+
+"""
+=====================================================================================================
+Timing and memory instrumentation of the processing stages
+=====================================================================================================
+ Date: Oct/2026
+=====================================================================================================
+	The Toolbox functions of the main stages are wrapped with Timed (calls, time, bytes read and
+	written) and the scripts label their grid point with SetPoint. Nothing is recorded (the
+	functions are not even wrapped) unless the CORESYF_METRICS environment variable gives the
+	output file:
+
+		CORESYF_METRICS=metrics.jsonl	JSON lines appended by each script at exit: one line per
+						(grid point, stage) with count, total, p50/p95/max of the
+						calls and bytes read/written, and one line per script with
+						its wall time and peak RSS
+		CORESYF_METRICS=metrics.prom	Prometheus text file aggregated over all the scripts of
+						the run (stage time per grid point as a summary with p50/p95,
+						calls, bytes, counters and peak RSS); the running totals are
+						kept in metrics.prom.json
+
+	Sampled and Profile profile the computation of a few grid points (cProfile statistics, memory
+	allocations and point parameters saved to reproduce the hot spots offline).
+
+	Timed		SetPoint	Count		AddBytes	Restart
+	Flush		PrometheusText
+	Sampled		Profile		Parameters
+"""
+#
+import os, sys, time, json, fcntl, atexit, resource, functools
+import cProfile, pstats
+#
+import numpy as np
+#
+try:
+	import tracemalloc	# python >= 3.4 (or pytracemalloc)
+except ImportError:
+	tracemalloc = None
+
+OUTPUT = os.environ.get('CORESYF_METRICS', '')
+ENABLED = bool(OUTPUT)
+
+# durations, bytes (read, written) and counters by (grid point, stage)
+Durations, Bytes, Counters = {}, {}, {}
+State = {'point': None, 'start': time.time(), 'script': os.path.splitext(os.path.basename(sys.argv[0] if sys.argv else ''))[0]}
+
+#******************************************************
+#	   RECORDING
+#******************************************************
+def Restart(script):
+	#--------------------------------------------------------------------------
+	# start the records of a new script run in the same process (warm worker)
+	#--------------------------------------------------------------------------
+	Durations.clear(); Bytes.clear(); Counters.clear()
+	State.update({'point': None, 'start': time.time(), 'script': script})
+
+def SetPoint(index):
+	#-------------------------------------------------------
+	# label the next records with the grid point index
+	#-------------------------------------------------------
+	State['point'] = index
+
+def Timed(stage, read=None, written=None):
+	#------------------------------------------------------------------------
+	# decorator timing each call of a function; read/written: position of
+	# the argument giving the file read or written by the function
+	#------------------------------------------------------------------------
+	if not ENABLED:
+		return lambda function: function
+
+	def decorator(function):
+		@functools.wraps(function)
+		def timed(*args, **kwargs):
+			start = time.time()
+			try:
+				return function(*args, **kwargs)
+			finally:
+				Durations.setdefault((State['point'], stage), []).append(time.time() - start)
+				if read is not None:
+					AddBytes(stage, read=FileSize(args[read]))
+				if written is not None:
+					AddBytes(stage, written=FileSize(args[written]))
+		return timed
+	return decorator
+
+def Count(name, value=1):
+	#---------------------
+	# increment a counter
+	#---------------------
+	if ENABLED:
+		key = (State['point'], name); Counters[key] = Counters.get(key, 0) + value
+
+def AddBytes(stage, read=0, written=0):
+	#------------------------------------------
+	# bytes read and written by a stage
+	#------------------------------------------
+	if ENABLED:
+		total = Bytes.setdefault((State['point'], stage), [0, 0]); total[0] += read; total[1] += written
+
+def FileSize(fname):
+	try:
+		return os.path.getsize(fname)
+	except (OSError, TypeError):
+		return 0
+
+#******************************************************
+#	   OUTPUT
+#******************************************************
+def Records():
+	#------------------------------------------------------------------
+	# JSON records of the script: per (grid point, stage) and process
+	#------------------------------------------------------------------
+	common = {'script': State['script'], 'pid': os.getpid()}
+	records = []
+	for key in sorted(set(Durations) | set(Bytes) | set(Counters), key=str):
+		point, stage = key
+		record = dict(common, point=point, stage=stage)
+		if key in Durations:
+			durations = np.array(Durations[key])
+			record.update({'count': len(durations), 'total_s': durations.sum(), 'p50_s': np.percentile(durations, 50),
+				'p95_s': np.percentile(durations, 95), 'max_s': durations.max()})
+		if key in Bytes:
+			record.update({'bytes_read': Bytes[key][0], 'bytes_written': Bytes[key][1]})
+		if key in Counters:
+			record['counter'] = Counters[key]
+		records.append(record)
+	# peak resident memory (ru_maxrss is in kB on Linux)
+	records.append(dict(common, stage='process', wall_s=time.time() - State['start'],
+		peak_rss_bytes=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024))
+	return records
+
+def Merge(totals, records):
+	#-------------------------------------------------------------
+	# add the records of a script to the running totals of a run
+	#-------------------------------------------------------------
+	for record in records:
+		if record['stage'] == 'process':
+			script = totals['scripts'].setdefault(record['script'], {'runs': 0, 'wall_s': 0., 'peak_rss_bytes': 0})
+			script['runs'] += 1; script['wall_s'] += record['wall_s']
+			script['peak_rss_bytes'] = max(script['peak_rss_bytes'], record['peak_rss_bytes'])
+			continue
+		stage = totals['stages'].setdefault(record['stage'], {'count': 0, 'total_s': 0., 'points_s': [], 'bytes_read': 0, 'bytes_written': 0, 'counter': 0})
+		if 'count' in record:
+			stage['count'] += record['count']; stage['total_s'] += record['total_s']; stage['points_s'].append(record['total_s'])
+		stage['bytes_read'] += record.get('bytes_read', 0); stage['bytes_written'] += record.get('bytes_written', 0)
+		stage['counter'] += record.get('counter', 0)
+	return totals
+
+def PrometheusText(totals):
+	#--------------------------------------------------------
+	# Prometheus text exposition of the totals of the run
+	#--------------------------------------------------------
+	stages = sorted(totals['stages'].items()); scripts = sorted(totals['scripts'].items())
+	lines = ['# HELP coresyf_stage_seconds Time spent in a processing stage per grid point (script run)',
+		'# TYPE coresyf_stage_seconds summary']
+	for name, stage in stages:
+		if stage['points_s']:
+			for quantile in [50, 95]:
+				lines.append('coresyf_stage_seconds{stage="%s",quantile="%.2f"} %.6f' % (name, quantile / 100., np.percentile(stage['points_s'], quantile)))
+			# observations: the per grid point totals (the calls are counted by coresyf_stage_calls_total)
+			lines.append('coresyf_stage_seconds_sum{stage="%s"} %.6f' % (name, stage['total_s']))
+			lines.append('coresyf_stage_seconds_count{stage="%s"} %d' % (name, len(stage['points_s'])))
+	for metric, key, description in [('coresyf_stage_calls_total', 'count', 'Calls of the functions of a processing stage'),
+			('coresyf_stage_read_bytes_total', 'bytes_read', 'Bytes read by a processing stage'),
+			('coresyf_stage_written_bytes_total', 'bytes_written', 'Bytes written by a processing stage'),
+			('coresyf_stage_counter_total', 'counter', 'Items counted by a processing stage')]:
+		lines.extend(['# HELP %s %s' % (metric, description), '# TYPE %s counter' % metric])
+		lines.extend(['%s{stage="%s"} %d' % (metric, name, stage[key]) for name, stage in stages if stage[key]])
+	lines.extend(['# HELP coresyf_script_peak_rss_bytes Peak resident memory of a script', '# TYPE coresyf_script_peak_rss_bytes gauge'])
+	lines.extend(['coresyf_script_peak_rss_bytes{script="%s"} %d' % (name, script['peak_rss_bytes']) for name, script in scripts])
+	lines.extend(['# HELP coresyf_script_seconds_total Wall time of a script (all runs)', '# TYPE coresyf_script_seconds_total counter'])
+	lines.extend(['coresyf_script_seconds_total{script="%s"} %.6f' % (name, script['wall_s']) for name, script in scripts])
+	lines.extend(['# HELP coresyf_script_runs_total Runs of a script', '# TYPE coresyf_script_runs_total counter'])
+	lines.extend(['coresyf_script_runs_total{script="%s"} %d' % (name, script['runs']) for name, script in scripts])
+	return '\n'.join(lines) + '\n'
+
+def Flush():
+	#----------------------------------------------------------------------
+	# write the records at exit (the scripts of a run may run in parallel,
+	# the output file is locked while being updated)
+	#----------------------------------------------------------------------
+	records = Records()
+	if OUTPUT.endswith('.prom'):
+		with open(OUTPUT + '.json', 'a+') as f:
+			fcntl.flock(f, fcntl.LOCK_EX)
+			f.seek(0); content = f.read()
+			totals = json.loads(content) if content else {'stages': {}, 'scripts': {}}
+			totals = Merge(totals, records)
+			f.seek(0); f.truncate(); json.dump(totals, f); f.flush()
+			with open(OUTPUT + '.tmp', 'w') as prom:
+				prom.write(PrometheusText(totals))
+			os.rename(OUTPUT + '.tmp', OUTPUT)
+	else:
+		with open(OUTPUT, 'a') as f:
+			fcntl.flock(f, fcntl.LOCK_EX)
+			f.write(''.join(json.dumps(record, sort_keys=True) + '\n' for record in records))
+
+#******************************************************
+#	   PROFILING
+#******************************************************
+def Sampled(index, every=0, points=()):
+	#--------------------------------------------------------------
+	# whether a grid point is profiled (one in every N or listed)
+	#--------------------------------------------------------------
+	return (every > 0 and index % every == 0) or index in points
+
+def Parameters(data, depth=4):
+	#-------------------------------------------------------------
+	# JSON-compatible description of the (nested) parameter data
+	#-------------------------------------------------------------
+	if isinstance(data, np.ndarray):
+		return data.tolist() if data.size <= 16 else {'shape': list(data.shape), 'dtype': str(data.dtype)}
+	if isinstance(data, np.generic):
+		return data.item()
+	if isinstance(data, (list, tuple)):
+		return [Parameters(value, depth) for value in data]
+	if isinstance(data, dict):
+		return dict((str(key), Parameters(value, depth)) for key, value in data.items())
+	if hasattr(data, '__dict__'):
+		if depth == 0:
+			return data.__class__.__name__
+		return dict([('class', data.__class__.__name__)] + [(key, Parameters(value, depth - 1)) for key, value in vars(data).items()])
+	if data is None or isinstance(data, (bool, int, long, float, basestring)):
+		return data
+	return repr(data)
+
+def Profile(basename, parameters, function, *args, **kwargs):
+	#--------------------------------------------------------------------------
+	# run the function with cProfile (and tracemalloc when available), save
+	# basename.pstats, basename.txt (top functions and allocations) and the
+	# parameters in basename.json
+	#--------------------------------------------------------------------------
+	directory = os.path.dirname(basename)
+	if directory and not os.path.isdir(directory):
+		try:
+			os.makedirs(directory)
+		except OSError:
+			pass	# created by a parallel run
+	if tracemalloc is not None:
+		tracemalloc.start(25)
+	profile = cProfile.Profile()
+	start = time.time(); rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	try:
+		result = profile.runcall(function, *args, **kwargs)
+	finally:
+		elapsed = time.time() - start
+		allocations = []
+		if tracemalloc is not None:
+			snapshot = tracemalloc.take_snapshot(); tracemalloc.stop()
+			allocations = snapshot.statistics('lineno')[:25]
+		profile.dump_stats(basename + '.pstats')
+		with open(basename + '.txt', 'w') as f:
+			pstats.Stats(basename + '.pstats', stream=f).sort_stats('cumulative').print_stats(40)
+			f.write('top memory allocations\n')
+			f.write(''.join(str(statistic) + '\n' for statistic in allocations) if tracemalloc is not None else 'tracemalloc not available\n')
+		with open(basename + '.json', 'w') as f:
+			json.dump({'parameters': Parameters(parameters), 'wall_s': elapsed, 'peak_rss_bytes': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+				'peak_rss_increase_bytes': (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss) * 1024}, f, indent=1, sort_keys=True)
+	return result
+
+if ENABLED:
+	atexit.register(Flush)
@@ -1,15 +1,17 @@
 #!/usr/bin/python2.7
 # -*- coding: utf-8 -*-
 
-import os,sys, re
+import os,sys, re, fractions
 #
 import numpy as np
-import matplotlib.pyplot as plt
-import matplotlib.cm as cmplt
-import matplotlib.colors as pltcl
 #
 import CSAR_Utilities as UT
 import CSAR_Classes as CL
+import CSAR_Metrics as MT
+import CSAR_Imports as LI
+#
+plt, cmplt, pltcl = LI.Lazy('matplotlib.pyplot'), LI.Lazy('matplotlib.cm'), LI.Lazy('matplotlib.colors')
+gdal, osr = LI.Lazy('osgeo.gdal'), LI.Lazy('osgeo.osr')
 """
 ===============================================================================
 Post-Processing and Plot of simulation results  
@@ -21,6 +23,9 @@ Post-Processing and Plot of simulation results
 ===============================================================================
 	LABEL
 		LabelToString		ImageLabel	
+	BATHYMETRY MAP
+		BathymetryMap		BathymetryFileName	BathymetryTextFile
+		BathymetryGrid		BathymetryRaster	SortGridPoints
 """
 
 def LabelToString(x_label, y_label,rdi):
@@ -119,25 +124,9 @@ def MergeData(ExceptionPoints, BathymetryPoints):
 	# Merge all processed data for post-processing
 	#------------------------------------------------
 
-	ProcessedPoints=[]
-
-	#Deep water points
-	if len(ExceptionPoints.DeepWaterPoints)>0:
-		DWPoints=np.asarray(ExceptionPoints.DeepWaterPoints)
-		for point in DWPoints:
-			ProcessedPoints.append(point)
-
-	#global grid points
-	BathymetryPoints=np.asarray(BathymetryPoints)
-	if len(BathymetryPoints)>0:
-		for point in BathymetryPoints:
-			ProcessedPoints.append(point)
-
-	#shallow water points
-	if len(ExceptionPoints.ShallowWaterPoints)>0:
-		SWPoints=np.asarray(ExceptionPoints.ShallowWaterPoints)
-		for point in SWPoints:
-			ProcessedPoints.append(point)
+	# deep water, global grid and shallow water points
+	groups = [ExceptionPoints.DeepWaterPoints, BathymetryPoints, ExceptionPoints.ShallowWaterPoints]
+	ProcessedPoints = np.concatenate([UT.PointsTable(group, ())['points'] for group in groups])
 
 	return ProcessedPoints
 
@@ -157,7 +146,8 @@ def DetectExceptionPoints(Points):
 # 	OUTPUT BATHYMETRY MAP CREATION 
 ################################################
 
-def BathymetryMap(ProcessedPoints,OutputFile=None):
+@MT.Timed('BathymetryMap')
+def BathymetryMap(ProcessedPoints,OutputFile=None,EPSG=None):
 	
 	#--------------------------------------------------------------------
 	# Create bathymetry map (.txt and .tiff) file from Processed Points 
@@ -170,70 +160,126 @@ def BathymetryMap(ProcessedPoints,OutputFile=None):
 	BathymetryTextFile(Points,OutputFile)
 
 	# bathymetry raster
-	
-def BathymetryTextFile(Points, OutputFile):
+	BathymetryRaster(Points,OutputFile,EPSG)
+
+def BathymetryFileName(OutputFile, extension):
 	#-------------------------------------------------------------------------
-	# write bathymetry in a .txt file 
-	# 		with: index, coordinates, direction, wavelength, bathy
+	# output file name (Output/Bathymetry directory): the output file with
+	# the given extension if any, Bathymetry.<extension> otherwise
 	#-------------------------------------------------------------------------
 	#path
 	cwd = os.getcwd()
 	path = cwd+'/Output/Bathymetry/'
 
 	# output file name
+	filename = 'Bathymetry.' + extension
 	if OutputFile:	
-		pattern=re.compile(".*(txt).*")
+		pattern=re.compile(".*(" + extension + ").*")
 		filen = [m.group(0) for l in OutputFile for m in [pattern.search(l)] if m]
-		filename = str(filen[0])
-	else:
-		filename='Bathymetry.txt'
+		if filen:
+			filename = str(filen[0])
 
-	fname= path + filename	
-	# write point information and bathy to file
-	OutputFile=open(fname,"w")
-	for n,point in enumerate(Points):
-		OutputFile.write("%4d %16.3f %16.3f %10.3f %10.3f %10.3f %10.3f" % (n+1,point.easting, point.northing, point.Spectrum.WaveDirection, point.Tp, point.wavelength, point.bathymetry)+"\n")
-	OutputFile.close()
+	return path + filename
+	
+def BathymetryTextFile(Points, OutputFile):
+	#-------------------------------------------------------------------------
+	# write bathymetry in a .txt file 
+	# 		with: index, coordinates, direction, Tp, wavelength, bathy
+	#-------------------------------------------------------------------------
+	fname = BathymetryFileName(OutputFile, 'txt')
+
+	# point information and bathy as a structured array written at once
+	fields = ['easting', 'northing', 'Spectrum.WaveDirection', 'Tp', 'wavelength', 'bathymetry']
+	table = UT.PointsTable(Points, fields)
+	data = np.zeros(len(Points), dtype=[('index', int)] + [(field, np.float64) for field in fields])
+	data['index'] = np.arange(1, len(Points)+1)
+	for field in fields:
+		data[field] = table[field]
+	np.savetxt(fname, data, fmt="%4d %16.3f %16.3f %10.3f %10.3f %10.3f %10.3f")
+
+def BathymetryGrid(Points):
+	#-------------------------------------------------------------------------
+	# scatter the points on the regular grid given by their pixel indices:
+	# bands (bathymetry, wavelength, direction, Tp, flag; NaN where no point) 
+	# and geotransform of the grid (from the coordinates of the points)
+	#-------------------------------------------------------------------------
+	fields = ['bathymetry', 'wavelength', 'Spectrum.WaveDirection', 'Tp', 'DiscriminationFlag']
+	table = UT.PointsTable(Points, fields + ['IndexEasting', 'IndexNorthing', 'easting', 'northing'])
+
+	# grid step (pixels): greatest common divisor of the point indices spacing
+	index, step, coordinate = {}, {}, {}
+	for axis, name in [('IndexEasting', 'easting'), ('IndexNorthing', 'northing')]:
+		indices = np.round(table[axis]).astype(int)
+		step[axis] = max(reduce(fractions.gcd, np.diff(np.unique(indices)).tolist(), 0), 1)
+		index[axis] = (indices - indices.min()) // step[axis]
+		# coordinates of the grid nodes: linear in the node index (origin, spacing)
+		if np.unique(index[axis]).size > 1:
+			spacing, origin = np.polyfit(index[axis], table[name], 1)
+		else:
+			spacing, origin = (1. if name == 'easting' else -1.), table[name].mean()
+		coordinate[axis] = (origin, spacing)
+	ix, iy = index['IndexEasting'], index['IndexNorthing']
+
+	# bands
+	bands = np.full((len(fields), iy.max()+1, ix.max()+1), np.nan, dtype=np.float32)
+	for n, field in enumerate(fields):
+		bands[n, iy, ix] = table[field]
+
+	# geotransform (upper left corner of the first node cell)
+	(E0, dE), (N0, dN) = coordinate['IndexEasting'], coordinate['IndexNorthing']
+	Geotransform = (E0 - dE/2., dE, 0., N0 - dN/2., 0., dN)
 
+	return bands, ['bathymetry', 'wavelength', 'direction', 'Tp', 'flag'], Geotransform
 
-def BathymetryRaster(Points,OutputFile):
+def BathymetryRaster(Points,OutputFile,EPSG=None,TileSize=256):
 	#-------------------------------------------------------------------------
-	# write bathymetry in a georeferenced GeoTiff file
+	# write bathymetry in a georeferenced GeoTiff file: Cloud Optimized 
+	# GeoTiff (tiled, compressed, with overviews), one band per variable
 	#-------------------------------------------------------------------------
-	#path
-	cwd = os.getcwd()
-	path = cwd+'/Output/Bathymetry/'
-
-	# output file name
-	if OutputFile:	
-		pattern=re.compile(".*(tif).*")
-		filen = [m.group(0) for l in OutputFile for m in [pattern.search(l)] if m]
-		filename = str(filen[0])
-	else:
-		filename='Bathymetry.tif'
+	fname = BathymetryFileName(OutputFile, 'tif')
+	if len(Points) == 0:
+		return
+
+	bands, names, Geotransform = BathymetryGrid(Points)
+	nb, nrows, ncols = bands.shape
+
+	# raster in memory (with its overviews, down to a single tile)
+	raster = gdal.GetDriverByName('MEM').Create('', ncols, nrows, nb, gdal.GDT_Float32)
+	raster.SetGeoTransform(Geotransform)
+	if EPSG:
+		srs = osr.SpatialReference(); srs.ImportFromEPSG(int(EPSG))
+		raster.SetProjection(srs.ExportToWkt())
+	for n, name in enumerate(names):
+		band = raster.GetRasterBand(n+1)
+		band.SetDescription(name); band.SetNoDataValue(np.nan)
+		band.WriteArray(bands[n])
+	levels = [2**i for i in range(1, 32) if max(ncols, nrows) > TileSize * 2**(i-1)]
+	if levels:
+		raster.BuildOverviews('AVERAGE', levels)
+		# discrimination flag: no averaging
+		flag = raster.GetRasterBand(nb)
+		gdal.RegenerateOverviews(flag, [flag.GetOverview(i) for i in range(flag.GetOverviewCount())], 'NEAREST')
+
+	# cloud optimized layout: tiles and overviews copied before the data
+	options = ['TILED=YES', 'BLOCKXSIZE=%d' % TileSize, 'BLOCKYSIZE=%d' % TileSize, 'COMPRESS=DEFLATE', 'PREDICTOR=3', 'COPY_SRC_OVERVIEWS=YES']
+	gdal.GetDriverByName('GTiff').CreateCopy(fname, raster, options=options)
+	raster = None
 
 def SortGridPoints(ProcessedPoints):
 	#-------------------------------------------------------------------------
 	# sort grid points in geographical order (west to east, north to south)
 	#-------------------------------------------------------------------------
-	Points=[]
-	npt = ProcessedPoints.shape[0]; 
-	easting, northing = np.zeros(npt), np.zeros(npt)
-	
-	# create easting and northing vector
-	for n, point in enumerate(ProcessedPoints):
-		easting[n], northing[n] = point.easting, point.northing
-
-	# sort the easting array in ascending order (west to east)
-	Easting = np.unique(easting)
-	for i, east in enumerate(Easting):
-		ens = np.where( abs(easting-east) < 1 )
-		ind = ens[0]
-		Northing, indices = np.unique(northing[ind],return_index=True)
-		for index in indices:
-			pt = ProcessedPoints[ind[index]]
-			Points.append(pt)
-	Points = np.asarray(Points)
+	table = UT.PointsTable(ProcessedPoints, ('easting', 'northing'))
+	
+	# easting within 1m snapped to the same column, then sort columns (west to east) 
+	# and northing in each column
+	columns, northing = UT.SnapCoordinates(table['easting'], 1.), table['northing']
+	order = np.lexsort((northing, columns))
+	
+	# a single point per position (first one)
+	keep = np.ones(order.size, dtype=bool)
+	keep[1:] = (np.diff(columns[order]) != 0) | (np.diff(northing[order]) != 0)
+	Points = table['points'][order[keep]]
 	
 	return Points
 """
@@ -282,6 +328,7 @@ Info.Geotransform = geotransform;
 # 		FIGURES
 #######################################
 
+@MT.Timed('PostProcessing_plots')
 def PostProcessing(Points, data):
 	
 	#----------------------------------------------------------------
@@ -509,6 +556,7 @@ def PostProcessing(Points, data):
 #############################################
 #	Spectra and Subsets at grid points
 #############################################
+@MT.Timed('Plot_Subset_Spectrum')
 def Plot_Subset_Spectrum(index,Spectrum, MeanSpectrum):
 	#-------------------------------------------------------
 	# Plot various Subsets and Spectra for each grid points 
@@ -16,15 +16,16 @@ import os, sys
 import time
 #
 import numpy as np
-import matplotlib.pyplot as plt
 #
 import CSAR_Classes as CL
 import CSAR_Utilities as UT
 import CSAR_ImageProcessing as IP
+import CSAR_Imports as LI
 #
 import cv2
 #
-from scipy.interpolate import griddata, Rbf
+plt = LI.Lazy('matplotlib.pyplot')
+interpolate = LI.Lazy('scipy.interpolate')
 #
 #%#%#%#%#%#%#%#%#%#%#%#%#%#%#%#%#%#%#%#%#%#%#%#%#%
 #		IMAGE ROI
@@ -84,8 +85,8 @@ def DefineComputationGrid(parameters, data):
 		for i in range(DomainPoints.shape[0]):
 			ax.plot(DomainPoints[i].easting, DomainPoints[i].northing,'xg')	
 
-	# plot & close windows
-	plt.show()
+		# plot & close windows
+		plt.show()
 
 	return DomainPoints
 
@@ -402,10 +403,10 @@ def InterpolateBathymetry(parameters, Coordinates, bathydata):
 	#interpolate on the grid points
 	
 	if parameters.InterpolationMethod == 'multiquadric':
-		rbfi = Rbf(e, n, bathy)
+		rbfi = interpolate.Rbf(e, n, bathy)
 		bathymetry = rbfi(easting, northing) 
 	else:
-		bathymetry = griddata((e.ravel(),n.ravel()), bathy.ravel(), (easting,northing), method=parameters.InterpolationMethod)
+		bathymetry = interpolate.griddata((e.ravel(),n.ravel()), bathy.ravel(), (easting,northing), method=parameters.InterpolationMethod)
 	
 	BathymetryData = CL.BathymetryData(Coordinates, bathymetry)
 
@@ -12,16 +12,27 @@ Compute/estimate  Spectrum-Related distribution and parameters
 =====================================================================================================
 	
 	DIRECTION ESTIMATE:		DirectionEstimate	MaskPlot	DirectionalProjection
+					DirectionalIntegration	DirectionBins
 
 	IMAGE SPECTRUM:			SpectrumRange	ImageSpectrum	
+
+	BOX CACHE:			SetBoxCache	BoxKey		ParametersKey	CachedBox	CacheBox
+					TrimBoxCache	BoxBytes
+
+	SHAPE TABLES:			RadialBins	DirectionSort	DirectionTable	FilterGrid
+					ReadOnly	WarmTables
 		
+	WAVE SPECTRUM:			ComputeSpectrum	WavelengthEstimate	WavelengthsEstimate
+					BatchWavelengthEstimate	PrecisionDeltas
+
 	WAVE SERIES SPECTRA:		SubsetSpectrum	WavesMeanSpectrum	
 	
 	RADIAL PROJECTION SPECTRUM:	RadialSpectrum RadialProjection	
 	
 	FILTERS
 					ButterworthEllipticFilter	ImageFilter
-					imfft		imifft
+					imfft		imifft		imrfft		imirfft
+					HalfPlane2Full	FloatType
 		
 
 	UTILITIES			Spectrum1D	DefineLine	FindOffsetPoints	dx	dy	
@@ -30,11 +41,10 @@ Compute/estimate  Spectrum-Related distribution and parameters
 	
 """
 #
-import re
+import sys, re, hashlib
+from collections import OrderedDict
 #
 import numpy as np
-import matplotlib.pyplot as plt
-#
 #
 import argparse
 import ConfigParser
@@ -42,21 +52,25 @@ from datetime import datetime
 #
 import cv2
 #
-from scipy.optimize import minimize
-from scipy import misc
-from scipy.cluster.vq import kmeans2
-
-#
-from sklearn.cluster import KMeans 
-from sklearn.utils import shuffle
-#
-from skimage.measure import profile_line
-#
 import CSAR_Classes as CL
+import CSAR_Metrics as MT
 import CSAR_Utilities as UT
 import CSAR_ImageProcessing as IP
+import CSAR_Imports as LI
+#
+plt = LI.Lazy('matplotlib.pyplot')
+measure = LI.Lazy('skimage.measure')
 #
 
+# spectra of the FFT boxes already computed by the script, shared by the grid points it processes
+# (the boxes of neighbouring points overlap): direction and wave spectrum of each box (and its
+# image spectrum for the figures), least recently used boxes discarded beyond budget (bytes)
+BoxCache = {'budget': 0, 'bytes': 0, 'images': False, 'boxes': OrderedDict()}
+BOX_OVERHEAD = 1024		# bytes of a cache entry besides its arrays (key, objects)
+
+# tables depending only on the box dimension (sorted radius and direction bins, filter grids),
+# computed once per dimension (and kept by the warm worker, see CSAR_Worker)
+Tables = {}
 
 ###########################################################
 #
@@ -75,12 +89,17 @@ def InputSpectrumParameters():
 	
 	# input/ output files	
 	parser.add_argument('-a', '--param', help='Parameters file for Wings (.ini file)', default = 'Config_Spectrum.ini',required=False)
-	parser.add_argument('-i', '--input', help='Input subset files (subsets#.out) for Spectrum and wavelength estimation', required=True)
-	parser.add_argument('-o', '--output', help='Output transfer file (spectrum#.out)', required=False)
+	parser.add_argument('-i', '--input', nargs='+', help='Input subset files (subsets#.out) for Spectrum and wavelength estimation, processed in this order (see SpectrumWorkOrder.txt)', required=True)
+	parser.add_argument('-o', '--output', help='Output transfer file (spectrum#.out), single input file only', required=False)
+	parser.add_argument('--box_cache', help='Memory (MB) of the FFT boxes spectra kept to be reused by the next grid points (0: no cache; about 3 kB per box, 0.5 MB per 256 pixels box with --plots)', default=16, type=float, required=False)
+	parser.add_argument('--peak_batch', help='Number of grid points whose peak wavelengths are estimated together', default=64, type=int, required=False)
 	
 	# parameters for direction estimate
 	parser.add_argument('-c', '--coast_orientation', help='Coast normal orientation (nautical convention ex: 270-> West facing)', default=270, required=False)
 	
+	# subset processing parameters
+	parser.add_argument('--contrast_stretch', help='Contrast stretch of the subscenes (none, or method: percentile, histogram, clahe, minmax)', choices=['none'] + IP.CONTRAST_METHODS, default='none', required=False)
+
 	# filter parameters
 	parser.add_argument('-f', '--filter', help='Flag whether to filter subscenes. Filter type: ellipsoidd Butterworth Filter', default = True,required=False)
 	
@@ -88,25 +107,39 @@ def InputSpectrumParameters():
 	parser.add_argument('-m', '--method', help='method for spectrum estimate: derived from wave series (subscene) or from radial projection of the subscene spectrum', required=True)
 	parser.add_argument('-p', '--number_of_profiles', help='number of wave profiles derived required to estimate spectrum', default = 5, required=False)
 	parser.add_argument('-d', '--offset_profiles', help='offset (m) in between wave profiles', default = 50, required=False)
+
+	# numeric precision of the spectrum computations
+	parser.add_argument('--precision', help='Precision of images, spectra and filters (float32 halves the memory traffic)', choices=['float64', 'float32'], default='float64', required=False)
+	parser.add_argument('--validate_precision', help='Validation mode: also compute the spectrum in float64 and append the wavelength and direction deltas to this file (JSON lines)', default='', required=False)
+
+	# profiling of sampled grid points
+	parser.add_argument('--profile_every', help='Profile (cProfile and memory allocations) one grid point in every N', default=0, type=int, required=False)
+	parser.add_argument('--profile_points', nargs='+', help='Indices of the grid points to profile', default=[], type=int, required=False)
+	parser.add_argument('--profile_dir', help='Directory of the profiles (.pstats, allocations and point parameters)', default='Profiles', required=False)
 		
-	#comments
+	#comments and figures
 	parser.add_argument('-v','--verbose', help="comments and screen outputs", action="store_true")
+	parser.add_argument('--plots', help="figures of the subsets and spectra of each grid point (Output/SubsetSpectra)", action="store_true")
 
 	#store
 	args = parser.parse_args()
+	if args.output and len(args.input) > 1:
+		parser.error('--output requires a single input file')
 	RunId = datetime.now().strftime('%Y%m%dT%H%M%S')
 
 	#create config.ini file
 	parOut = open(args.param, "w"); Config = ConfigParser.ConfigParser(); Config.add_section("Arguments")
 
 	#input/output	
-	Config.set("Arguments", "Input_file", args.input);
+	Config.set("Arguments", "Input_file", ' '.join(args.input));
 	Config.set("Arguments", "Output_file", args.output); 
 
 	#spectrum parameters
 	Config.set("Arguments", "Coast_Orientation", args.coast_orientation); 
 	Config.set("Arguments", "Filter_Flag", args.filter)
 	Config.set("Arguments", "Spectrum_method", args.method); 
+	Config.set("Arguments", "Precision", args.precision)
+	Config.set("Arguments", "Contrast_stretch", args.contrast_stretch)
 	if args.method == 'Waves':
 		Config.set("Arguments", "Number_of_profiles", args.number_of_profiles)
 		Config.set("Arguments", "Offset_inbetween_profiles", args.offset_profiles)
@@ -118,7 +151,7 @@ def InputSpectrumParameters():
 
 	# store parameters in classes
 	# subset processing
-	IP_Parameters = CL.SubsetProcessingParameters()
+	IP_Parameters = CL.SubsetProcessingParameters(ConstrastStretchFlag=(args.contrast_stretch != 'none'), ContrastStretchMethod=args.contrast_stretch)
 	# direction estimate
 	DP_Parameters =  CL.DirectionEstimateParameters(float(args.coast_orientation))
 	# Image Filter
@@ -132,13 +165,14 @@ def InputSpectrumParameters():
 	# global wave spectrum and wavelength parameters	
 	SP_Parameters =	CL.SpectrumParameters(WavesSpectrumParameters, WavelengthEstimateParameters)
 	# global parameters list	
-	parameters = CL.ComputingParametersSpectrum(IP_Parameters, DP_Parameters, IF_Parameters, SP_Parameters)	
+	parameters = CL.ComputingParametersSpectrum(IP_Parameters, DP_Parameters, IF_Parameters, SP_Parameters, args.precision)	
 	
 	return parameters, args
 
 #******************************************************
 #	    DIRECTION ESTIMATE
 #******************************************************
+@MT.Timed('DirectionEstimate')
 def DirectionEstimate(parameters, subset, spectrum):
 	#-------------------------------------------------------------------
 	# Estimate main wave direction from image (radon) or image spectrum 
@@ -214,37 +248,49 @@ def Direction_distribution(parameters, subset, spectrum):
 # direction (projection): bin method
 #*?*?*?*?*?*?*?*?*?*?*?*?*?*?*?*?*?*?*?*?*?*?*?*?
 def DirectionalIntegration(spectrum):
-    	"""
-    	Estimate swell direction by spectrum directionnal integration.
-    	remark: Radial Spectrum mask required
-   	"""
-	# image phase
-	theta = ImagePhase(spectrum)
-	
-	# sort the directions (crescent)
-   	ind = np.argsort(theta.flat)
-
-   	theta_sorted = theta.flat[ind] # sorted radius
-   	spectrum_sorted = spectrum.flat[ind] # sorted image pixels (same order)	
-
-   	# theta is integer (bin wise)
-	theta_int = np.round(theta_sorted)	
-	
 	"""
-	fig, ((ax1,ax2), (ax3,ax4), (ax5,ax6)) = plt.subplots(3,2)
-	ax1.imshow(theta)
-	ax2.plot(spectrum.flat)
-	ax3.plot(theta_sorted)
-	ax4.plot(spectrum_sorted)
-	ax5.imshow(spectrum)	
-	ax6.plot(theta_sorted, spectrum_sorted)
-	
-	plt.show()
+	Estimate swell direction by spectrum directionnal integration.
+	The spectrum of a real image is symmetric (S(-k) = S(k)): the directions are
+	integrated over the upper half plane (0-180 deg) and folded to 180-360 deg
+	(the 180-ambiguity is solved by Direction180Ambiguity).
+	remark: Radial Spectrum mask required
 	"""
+	# upper half plane and its phase (0-180 deg) around the zero frequency pixel
+	center = np.array(spectrum.shape[::-1]) // 2
+	half = spectrum[center[1]:]
+	theta, table = DirectionTable(spectrum.shape)
 
-	# unique r decomposition, indi reflect the direction bin 
-	thetau, ind, indi, count = np.unique(theta_int,return_index=True, return_inverse=True, return_counts=True) 
- 	csim = np.cumsum(spectrum_sorted, dtype=float)
+	# direction bins of the half plane
+	thetau, distribution = DirectionBins(theta, half, table)
+
+	# fold over 180 deg (bins found in both halves are kept once)
+	thetau, index = np.unique(np.concatenate((thetau, thetau + 180)), return_index=True)
+	distribution = np.concatenate((distribution, distribution))[index]
+ 
+	#figure: directional bin distribution
+	flagplot = 0
+	if flagplot>0:	
+		fig, (ax1, ax2, ax3) = plt.subplots(3)
+		ax1.imshow(theta)		
+		ax2.imshow(spectrum)
+		ax3.plot(thetau, distribution,'o')			
+		ax3.set_xlabel("Direction (deg)")
+		ax3.set_ylabel("Intensity")
+		plt.show()
+
+	return thetau, distribution
+
+def DirectionBins(theta, spectrum, table=None):
+	#------------------------------------------------------------------
+	# mean spectrum in each direction bin (1 deg) of the theta values
+	# (table: sorting and bins of theta given by DirectionTable)
+	#------------------------------------------------------------------
+	# sort the directions (crescent) and bin them (theta is integer bin wise)
+	order, thetau, ind = DirectionSort(theta) if table is None else table
+
+	spectrum_sorted = spectrum.flat[order] # sorted image pixels (same order)	
+
+	csim = np.cumsum(spectrum_sorted, dtype=float)
 	
 	#verification number of non-zeros bins per direction
 	countbin = np.zeros((thetau.shape[0]))
@@ -267,18 +313,6 @@ def DirectionalIntegration(spectrum):
 	# normalize by the number of pixel with same radius
 	distribution = np.zeros((thetau.shape[0]))
 	distribution[countbin>0] = tbin[countbin>0]/countbin[countbin>0]
- 
-	#figure: directional bin distribution
-	flagplot = 0
-	if flagplot>0:	
-		fig, (ax1, ax2, ax3) = plt.subplots(3)
-		ax1.imshow(theta)		
-		ax2.imshow(spectrum)
-		ax3.plot(thetau, distribution,'o')			
-		ax3.set_xlabel("Direction (deg)")
-		ax3.set_ylabel("Intensity")
-		plt.show()
-
 
 	return thetau, distribution
 
@@ -325,7 +359,7 @@ def  Direction_PeakDetection(parameters, theta, distribution, Flag):
 		ax1.plot(theta2,distribution2,'o')	
 		ax1.axvline(x=Directions[0]), ax1.axvline(x=Directions[1])
 		ax1.axhline(y=ratio*np.max(distribution1)), ax1.axhline(y=ratio*np.max(distribution2))
-	plt.show()
+		plt.show()
 	
 	return Directions
 
@@ -424,18 +458,19 @@ def MaskPlot(radius, subset):
 
 	return mask
 
-def ImagePhase(img):
-    	"""
-    	Compute image phase (directions)
-   	"""	
+def ImagePhase(img, row=0, center=None):
+	"""
+	Compute image phase (directions) of the rows from row
+	"""	
 	# indices of image center	
-	center = IP.ImageCenter(img) 
+	if center is None:
+		center = IP.ImageCenter(img) 
 
 	# image indices
-   	y, x = np.indices(img.shape)	
+	y, x = np.indices(img[row:].shape); y = y + row
 	
 	# phase	
-   	theta = cv2.phase(np.float32(x - center[0]), np.float32(y - center[1]))
+	theta = cv2.phase(np.float32(x - center[0]), np.float32(y - center[1]))
 
 	#transform radian to degree	
 	theta = theta*180/np.pi	
@@ -469,31 +504,27 @@ def SpectrumRange(magnitude, kx, ky, SPthr) :
 	return kr 
 
 
+@MT.Timed('ImageSpectrum')
 def ImageSpectrum(parameters, subset):
 	#----------------------------------------------
 	# Compute Image Spectrum or Power Spectrum  
 	#----------------------------------------------
-	image = subset.image 						# given subset image
+	dtype = FloatType(parameters)
+	image = np.asarray(subset.image, dtype) 			# given subset image
 	if parameters.MeanSubstractionFlag:
 		image = image - np.mean(image)					# substract mean value
-	Spectrum = imfft(image)   					# FFT of the given image  
-	mag = cv2.magnitude(Spectrum[:,:,0],Spectrum[:,:,1])          
-	if parameters.DecibelRepresentationFlag:		
-		mag = 20*np.log(mag)	# amplitude spectrum (sqrt(Im**2 +Re**2)) 
-	
-
-	#power Spectrum
-	S = Spectrum[:,:,0] + 1j*Spectrum[:,:,1]
-	mag2 = np.real(S*np.conjugate(S))
-	if parameters.DecibelRepresentationFlag:
-		mag2 = 20*np.log(mag2) 
-	#mag2 = np.abs(mag)**2						
+	Spectrum = imrfft(image, dtype)   				# FFT of the given image (half plane)
 
-	# selected spectrum to be plotted
+	# selected spectrum (computed on the half plane only)
 	if parameters.PowerSpectrumFlag == True:
-		spectrum = mag2
+		spectrum = Spectrum.real**2 + Spectrum.imag**2		# power spectrum
 	else:
-		spectrum = mag	
+		spectrum = np.abs(Spectrum)				# amplitude spectrum (sqrt(Im**2 +Re**2))
+	if parameters.DecibelRepresentationFlag:
+		spectrum = 20*np.log(spectrum)
+
+	# centered spectrum (full plane by symmetry)
+	spectrum = HalfPlane2Full(spectrum, image.shape)
 	
 	#--------------------------------
 	#    define the wavenumber axis
@@ -502,7 +533,7 @@ def ImageSpectrum(parameters, subset):
 	freqs = np.linspace(0,(spectrum.shape[1]-1)*step/spectrum.shape[1],spectrum.shape[1])
 	fCenter = 0.5 * (freqs[np.int(spectrum.shape[1]/2)] + freqs[np.int(spectrum.shape[1]/2)-1] )
 	freqs =freqs - fCenter  # axis centered on 0
-	k = 2*np.pi*(freqs) 
+	k = dtype(2*np.pi*(freqs)) 
 	
 	#store data
 	ImageSpectrum = CL.SpectrumData(k, spectrum)
@@ -515,26 +546,33 @@ def ImageSpectrum(parameters, subset):
 #
 ###########################################################
 
-def ComputeSpectrum(SubsetParameters, ComputingParameters, Subsets):
+@MT.Timed('ComputeSpectrum')
+def ComputeSpectrum(SubsetParameters, ComputingParameters, Subsets, FlagWavelength=True):
 	#--------------------------------------------------------------------------
 	# Estimate Subsets Spectra and directions and determine their mean values
+	# (FlagWavelength=False: peak wavelength left to BatchWavelengthEstimate)
 	#--------------------------------------------------------------------------
 	
 	WaveSpectra, Directions, ImageSpectra = [], [], []
 	
 	for i in range(SubsetParameters.BoxNb):
 		subset = Subsets[i]
-		# Compute wave related spectrum
-		if ComputingParameters.SpectrumParameters.WaveSpectrumParameters.SpectrumType in {'waves', 'Waves'}:
-			# use a multiple of wave signal
-			SpectrumComputedData = SubsetSpectrum(ComputingParameters, subset) 
-		elif ComputingParameters.SpectrumParameters.WaveSpectrumParameters.SpectrumType in {'radial', 'Radial'}:
-			# use the radial integration of the Image Spectrum
-			SpectrumComputedData = RadialSpectrum(ComputingParameters, subset)
-		else:
-			sys.exit("Method for Spectrum Estimation not defined")
+		# box already processed for a neighbouring point
+		key = BoxKey(ComputingParameters, subset) if BoxCache['budget'] > 0 else None
+		SpectrumComputedData = CachedBox(key)
+		if SpectrumComputedData is None:
+			# Compute wave related spectrum
+			if ComputingParameters.SpectrumParameters.WaveSpectrumParameters.SpectrumType in {'waves', 'Waves'}:
+				# use a multiple of wave signal
+				SpectrumComputedData = SubsetSpectrum(ComputingParameters, subset) 
+			elif ComputingParameters.SpectrumParameters.WaveSpectrumParameters.SpectrumType in {'radial', 'Radial'}:
+				# use the radial integration of the Image Spectrum
+				SpectrumComputedData = RadialSpectrum(ComputingParameters, subset)
+			else:
+				sys.exit("Method for Spectrum Estimation not defined")
+			CacheBox(key, SpectrumComputedData)
 		
-		# store data		
+		# store data (image spectra for the figures: None for the boxes cached without images)
 		Directions.append(SpectrumComputedData.WaveDirection); 
 		WaveSpectra.append(SpectrumComputedData.WaveSpectrum);  
 		ImageSpectra.append(SpectrumComputedData.ImageSpectrum);
@@ -543,8 +581,9 @@ def ComputeSpectrum(SubsetParameters, ComputingParameters, Subsets):
 	direction = np.nanmean(Directions)
 	
 	# compute mean Spectrum
-	K = np.zeros((SubsetParameters.BoxNb, WaveSpectra[0].k.shape[0])); 
-	WSP = np.zeros((SubsetParameters.BoxNb,WaveSpectra[0].Spectrum.shape[0]))
+	dtype = FloatType(ComputingParameters)
+	K = np.zeros((SubsetParameters.BoxNb, WaveSpectra[0].k.shape[0]), dtype); 
+	WSP = np.zeros((SubsetParameters.BoxNb,WaveSpectra[0].Spectrum.shape[0]), dtype)
 	for i in range(SubsetParameters.BoxNb):
 		K[i,:] = WaveSpectra[i].k; WSP[i,:] = WaveSpectra[i].Spectrum
 	k = np.mean(K,axis=0); spectrum = np.mean(WSP,axis=0); spectrumstd = np.std(WSP,axis=0)
@@ -557,7 +596,7 @@ def ComputeSpectrum(SubsetParameters, ComputingParameters, Subsets):
 	"""
 
 	# compute peak wavelength
-	PeakWavelength = WavelengthEstimate(ComputingParameters, k, spectrum)
+	PeakWavelength = WavelengthEstimate(ComputingParameters, k, spectrum) if FlagWavelength else np.nan
 	
 	# store processed data
 	Spectrum = CL.SpectrumProcessedData(k, spectrum, spectrumstd, PeakWavelength)
@@ -571,27 +610,218 @@ def ComputeSpectrum(SubsetParameters, ComputingParameters, Subsets):
 	return ComputedSpectrumData, SubscenesSpectrum
 
 
+#******************************************************
+#	    BOX CACHE
+#******************************************************
+def SetBoxCache(budget, images=False):
+	#----------------------------------------------------------------------------
+	# memory (bytes) of the FFT boxes spectra kept (0: no box cache); images:
+	# image spectra of the boxes also kept (figures of the grid points)
+	#----------------------------------------------------------------------------
+	# (the spectra already cached are kept: successive runs of the warm worker)
+	BoxCache['budget'] = budget; BoxCache['images'] = images
+	TrimBoxCache()
+
+def BoxKey(parameters, subset):
+	#-----------------------------------------------------------------------------------
+	# key of a FFT box: center pixel, dimension, processing parameters and the digest
+	# of its pixels (boxes of another image with the same center are not mixed up)
+	#-----------------------------------------------------------------------------------
+	center = tuple(int(value) for value in subset.CenterPoint)
+	digest = hashlib.md5(np.ascontiguousarray(subset.image)).hexdigest()
+	return center, subset.image.shape, digest, ParametersKey(parameters)
+
+def ParametersKey(parameters):
+	#-------------------------------------------------------
+	# hashable description of the (nested) parameters
+	#-------------------------------------------------------
+	if hasattr(parameters, '__dict__'):
+		return tuple(sorted((key, ParametersKey(value)) for key, value in vars(parameters).items()))
+	return parameters
+
+def CachedBox(key):
+	#-------------------------------------------------------------------
+	# spectrum computed data of a box already processed (None if not)
+	#-------------------------------------------------------------------
+	if key is None:
+		return None
+	data, size = BoxCache['boxes'].pop(key, (None, 0))
+	if data is not None and BoxCache['images'] and data.ImageSpectrum is None:
+		BoxCache['bytes'] -= size; data = None		# cached without its image spectrum
+	if data is None:
+		MT.Count('box_cache_misses')
+		return None
+	BoxCache['boxes'][key] = data, size		# most recently used
+	MT.Count('box_cache_hits')
+	return data
+
+def CacheBox(key, data):
+	#--------------------------------------------------------------------------
+	# keep what ComputeSpectrum reuses of a box (not the filtered subset)
+	#--------------------------------------------------------------------------
+	if key is None:
+		return
+	data = CL.SpectrumComputedData(data.WaveDirection, data.WaveSpectrum, data.ImageSpectrum if BoxCache['images'] else None)
+	size = BoxBytes(data)
+	if key in BoxCache['boxes']:
+		BoxCache['bytes'] -= BoxCache['boxes'].pop(key)[1]
+	BoxCache['boxes'][key] = data, size
+	BoxCache['bytes'] += size
+	TrimBoxCache()
+
+def TrimBoxCache():
+	#-------------------------------------------------------------
+	# discard the least recently used boxes beyond the budget
+	#-------------------------------------------------------------
+	while BoxCache['boxes'] and BoxCache['bytes'] > BoxCache['budget']:
+		BoxCache['bytes'] -= BoxCache['boxes'].popitem(last=False)[1][1]
+
+def BoxBytes(data):
+	#------------------------------------------------------
+	# memory of a cache entry (arrays of its data objects)
+	#------------------------------------------------------
+	size, items = BOX_OVERHEAD, [data]
+	while items:
+		item = items.pop()
+		if isinstance(item, np.ndarray):
+			size += item.nbytes
+		elif hasattr(item, '__dict__'):
+			items.extend(vars(item).values())
+	return size
+
+#******************************************************
+#	    SHAPE TABLES
+#******************************************************
+def RadialBins(shape):
+	#----------------------------------------------------------------------------
+	# pixels of a box sorted by radius, radius bins (integer radius), first
+	# sorted pixel and number of pixels of each bin (see RadialProjection)
+	#----------------------------------------------------------------------------
+	key = ('radial', shape)
+	if key not in Tables:
+		# indices of image center and image indices
+		center = IP.ImageCenter(np.empty(shape, np.bool_))
+		y, x = np.indices(shape)
+
+		#radial axis
+		r = cv2.magnitude(np.float32(x - center[0]), np.float32(y - center[1]))
+
+		# sort the radius (crescent) and bin them
+		order = np.argsort(r.flat)
+		ru, ind, count = np.unique(np.round(r.flat[order]), return_index=True, return_counts=True)
+		Tables[key] = ReadOnly(order, ru, ind, count)
+	return Tables[key]
+
+def DirectionSort(theta):
+	#------------------------------------------------------------------
+	# directions sorted (crescent), direction bins (1 deg) and first
+	# sorted pixel of each bin
+	#------------------------------------------------------------------
+	order = np.argsort(theta.flat)
+	thetau, ind = np.unique(np.round(theta.flat[order]), return_index=True)
+	return order, thetau, ind
+
+def DirectionTable(shape):
+	#----------------------------------------------------------------------------
+	# directions of the upper half plane of a spectrum (see DirectionalIntegration)
+	# and their sorting and bins (see DirectionBins)
+	#----------------------------------------------------------------------------
+	key = ('direction', shape)
+	if key not in Tables:
+		center = np.array(shape[::-1]) // 2
+		theta = ImagePhase(np.empty(shape, np.bool_), center[1], center)
+		Tables[key] = ReadOnly(theta), ReadOnly(*DirectionSort(theta))
+	return Tables[key]
+
+def FilterGrid(shape, dtype):
+	#-------------------------------------------------------------------
+	# x and y coordinates of a box normalized in between +- 0.5
+	# (see ButterworthEllipticFilter)
+	#-------------------------------------------------------------------
+	key = ('filter', shape, np.dtype(dtype).str)
+	if key not in Tables:
+		rows, cols = shape
+		tmp1 = np.linspace(1,cols,cols,dtype=dtype); tmp2 = np.linspace(1,rows,rows,dtype=dtype);
+		a1 = 1./(cols-1); b1 = -0.5 *(cols+1)/(cols-1); a2 = 1./(rows-1); b2 = -0.5 *(rows+1)/(rows-1); # define substitution (1:dimension -> -0.5:0.5)
+		tmp1 = a1 * tmp1 + b1; tmp2 = a2 * tmp2 + b2; # perform substitution
+
+		#initialize x and y 
+		x = np.outer(np.ones(rows,dtype),tmp1) 
+		y = np.outer(np.transpose(tmp2),np.transpose(np.ones(cols,dtype)))
+		Tables[key] = ReadOnly(x, y)
+	return Tables[key]
+
+def ReadOnly(*arrays):
+	# arrays shared by all the boxes of a dimension (not modified in place)
+	for array in arrays:
+		array.flags.writeable = False
+	return arrays[0] if len(arrays) == 1 else arrays
+
+def WarmTables(shapes):
+	#------------------------------------------------------------
+	# compute the tables of the box dimensions in advance
+	#------------------------------------------------------------
+	for shape in shapes:
+		shape = tuple(shape)
+		RadialBins(shape); DirectionTable(shape)
+		for dtype in [np.float64, np.float32]:
+			FilterGrid(shape, dtype)
+
 def WavelengthEstimate(ComputingParameters, k, spectrum):
 	#-----------------------------------------
 	#	Estimate Peak Wavelength
 	#---------------------------------------- 
-	# parameters
+	return WavelengthsEstimate(ComputingParameters, k, spectrum[np.newaxis])[0]
+
+def WavelengthsEstimate(ComputingParameters, k, spectra):
+	#-------------------------------------------------------------
+	#	Estimate Peak Wavelengths of spectra (rows) sharing k
+	#------------------------------------------------------------- 
+	# parameters (the peak is fitted in double precision whatever the spectrum precision)
+	k = np.float64(k); spectra = np.float64(spectra)
 	if ComputingParameters.SpectrumParameters.WaveSpectrumParameters.SpectrumType == 'Radial':
 		kth = 0.01 	
-		data = CL.DataPeak(k[np.where(k>kth)], spectrum[np.where(k>kth)])		
-	else:		
-		data = CL.DataPeak(k, spectrum)
+		k, spectra = k[np.where(k>kth)], spectra[:, np.where(k>kth)[0]]
 	WavelengthParameters = ComputingParameters.SpectrumParameters.WavelengthEstimationParameters
 	peak_parameters = CL.PeakParameters(WavelengthParameters.Power)
 
 	# mean wavenumber estimate
-	PeakWavenumber = UT.PeakDetection(peak_parameters, WavelengthParameters.PeakDeterminationMethod, data)
+	PeakWavenumber = UT.PeakDetectionBatch(peak_parameters, WavelengthParameters.PeakDeterminationMethod, k, spectra)
 
 	# wavelength
 	PeakWavelength = 2*np.pi/PeakWavenumber
 
 	return PeakWavelength
 
+def BatchWavelengthEstimate(ComputingParameters, Spectra):
+	#-------------------------------------------------------------------------------
+	# Estimate the Peak Wavelengths of the mean spectra of several grid points
+	# (SpectrumComputedData computed without wavelength) in one batch per
+	# wavenumber axis, stored in their WaveSpectrum
+	#-------------------------------------------------------------------------------
+	groups = {}
+	for i, Spectrum in enumerate(Spectra):
+		groups.setdefault(np.float64(Spectrum.WaveSpectrum.k).tostring(), []).append(i)
+	for indices in groups.values():
+		k = Spectra[indices[0]].WaveSpectrum.k
+		wavelengths = WavelengthsEstimate(ComputingParameters, k, np.array([Spectra[i].WaveSpectrum.Spectrum for i in indices]))
+		for i, wavelength in zip(indices, wavelengths):
+			Spectra[i].WaveSpectrum.Wavelength = wavelength
+
+def PrecisionDeltas(Spectrum, Reference, Subscenes, SubscenesReference):
+	#---------------------------------------------------------------------------------
+	# validation of the precision policy: wavelength and direction deltas of a
+	# spectrum (and of its subscenes directions) against the float64 computation
+	#---------------------------------------------------------------------------------
+	AngularDelta = lambda a, b: np.abs(np.mod(np.asarray(a, float) - np.asarray(b, float) + 180, 360) - 180)
+	wavelength, wavelength64 = float(Spectrum.WaveSpectrum.Wavelength), float(Reference.WaveSpectrum.Wavelength)
+	deltas = AngularDelta(Subscenes.WaveDirection, SubscenesReference.WaveDirection)
+	return {'wavelength': wavelength, 'wavelength_float64': wavelength64, 'wavelength_delta': wavelength - wavelength64,
+		'wavelength_relative_delta': (wavelength - wavelength64) / wavelength64,
+		'direction': float(Spectrum.WaveDirection), 'direction_float64': float(Reference.WaveDirection),
+		'direction_delta': float(AngularDelta(Spectrum.WaveDirection, Reference.WaveDirection)),
+		'subscenes_direction_delta_max': float(np.nanmax(deltas)) if np.any(np.isfinite(deltas)) else None}
+
 #******************************************************
 #	    WAVE SPECTRUM from Wave Series
 #******************************************************
@@ -612,7 +842,7 @@ def SubsetSpectrum(parameters, subset_input):
 
 	#stretch contrast
 	if IP_Parameters.ConstrastStretchFlag:
-		image = IP.ContrastStretch(image, IP_Parameters.IntensityType)
+		image = IP.ContrastStretch(image, IP_Parameters.IntensityType, IP_Parameters.ContrastStretchMethod)
 		subset = CL.Subset(subset.CenterPoint, image, subset.coordinates, subset.resolution, subset.FlagFlip)
 	#--------------------------
 	# B) Subset Spectrum
@@ -655,6 +885,7 @@ def SubsetSpectrum(parameters, subset_input):
 	return Spectrum_Computed_Data
 
 
+@MT.Timed('WavesMeanSpectrum')
 def WavesMeanSpectrum(parameters, subset, direction):
 
 	#----------------------------------------------------------------------------------
@@ -682,11 +913,12 @@ def WavesMeanSpectrum(parameters, subset, direction):
 	ortholine = DefineLine(image, direction, center, FlagOrtho = 1)
 
 	#define group of offset
-	if np.mod(parameters.ProfileNumber,2)>0:
-		parameters.ProfileNumber = parameters.ProfileNumber - 1  # even number (central profile included)  
+	ProfileNumber = parameters.ProfileNumber
+	if np.mod(ProfileNumber,2)>0:
+		ProfileNumber = ProfileNumber - 1  # even number (central profile included)  
 	
 	# information for offset points estimate
-	information = CL.offsetinformation(parameters.ProfileNumber, parameters.ProfileOffsetDistance, direction, subset.resolution) 	
+	information = CL.offsetinformation(ProfileNumber, parameters.ProfileOffsetDistance, direction, subset.resolution) 	
 	
 	# find points on the orthogonal line
 	points = FindOffsetPoints(center, information)
@@ -695,8 +927,8 @@ def WavesMeanSpectrum(parameters, subset, direction):
 	padding = resolutionpadding(image, parameters.PaddingExtraPower)
 
 	#array initialization
-	dim = points.shape[0]
-	K = np.zeros((dim, np.int(padding/2))); S =  np.zeros((dim, np.int(padding/2)));  distance = np.zeros(dim);
+	dim = points.shape[0]; dtype = FloatType(parameters)
+	K = np.zeros((dim, np.int(padding/2)), dtype); S =  np.zeros((dim, np.int(padding/2)), dtype);  distance = np.zeros(dim);
 	
 	"""
 	fig, (ax1,ax2,ax3) = plt.subplots(3)
@@ -718,7 +950,7 @@ def WavesMeanSpectrum(parameters, subset, direction):
 		"""
 
 		# extract profile and evaluate distance
-		yline = profile_line(image, edpt.point1, edpt.point2, linewidth=1, order=2)
+		yline = dtype(measure.profile_line(image, edpt.point1, edpt.point2, linewidth=1, order=2))
 		yline = yline - np.mean(yline)
 		xline = Distance4Line(yline,edpt,subset.resolution)
 		dmax = np.max(xline)
@@ -727,7 +959,7 @@ def WavesMeanSpectrum(parameters, subset, direction):
 		xline, yline = zerospadding(xline, yline, padding)
 				
 		# spectrum of the wave series
-		ks, Spectrum = Spectrum1D(xline, yline, parameters.PowerSpectrumFlag);
+		ks, Spectrum = Spectrum1D(xline, yline, parameters.PowerSpectrumFlag, dtype);
 	
 		# store data
 		K[i,:] = ks; S[i,:] = Spectrum; distance[i] = dmax;
@@ -748,7 +980,7 @@ def WavesMeanSpectrum(parameters, subset, direction):
 	SumDistance = np.sum(distance);
 	if parameters.MeanMethod > 0:
 		# mean weighted (distance of line segment) Spectrum 
-		Ks = np.dot(distance,K) / SumDistance; Sp = np.dot(distance,S) / SumDistance
+		Ks = np.dot(dtype(distance),K) / dtype(SumDistance); Sp = np.dot(dtype(distance),S) / dtype(SumDistance)
 	else:
 		# mean Spectrum
 		Ks = np.mean(K, axis=0); Sp = np.mean(S, axis=0)
@@ -768,6 +1000,7 @@ def WavesMeanSpectrum(parameters, subset, direction):
 #************************************************************
 #	    WAVE SPECTRUM from Spectrum Radial Integration
 #************************************************************
+@MT.Timed('RadialSpectrum')
 def RadialSpectrum(parameters, subset_input):
 	#--------------------------
 	# A) Subset Processing
@@ -779,7 +1012,7 @@ def RadialSpectrum(parameters, subset_input):
 	subset = CL.Subset(subset_input.CenterPoint, image, subset_input.coordinates, subset_input.resolution, subset_input.FlagFlip)
 	#stretch contrast
 	if IP_Parameters.ConstrastStretchFlag>0:
-		image = IP.ContrastStretch(image, IP_Parameters.IntensityType)
+		image = IP.ContrastStretch(image, IP_Parameters.IntensityType, IP_Parameters.ContrastStretchMethod)
 		subset = CL.Subset(subset.CenterPoint, image, subset.coordinates, subset.resolution, subset.FlagFlip)
 	#--------------------------
 	# B) Subset Spectrum
@@ -856,25 +1089,10 @@ def RadialProjection(img):
     	integrate the spectrum to create the averaged radial profile.
     
    	"""
-	# indices of image center	
-	center = IP.ImageCenter(img) 
-
-	# image indices
-   	y, x = np.indices(img.shape)	
-
-   	#radial axis
-   	r = cv2.magnitude(np.float32(x - center[0]), np.float32(y - center[1]))
-
-   	# sort the radius (crescent)
-   	ind = np.argsort(r.flat)
-   	r_sorted = r.flat[ind] # sorted radius
-   	img_sorted = img.flat[ind] # sorted image pixels (same order)
+	# pixels sorted by radius (crescent) and radius bins (r is integer bin wise)
+	order, ru, ind, count = RadialBins(img.shape)
+   	img_sorted = img.flat[order] # sorted image pixels (same order)
 
-   	# r is integer (bin wise)
-	r_int = np.round(r_sorted)	
-	
-	# unique r decomposition, indi reflect the radius bin 
-	ru, ind, indi, count = np.unique(r_int,return_index=True, return_inverse=True, return_counts=True) 
  	csim = np.cumsum(img_sorted, dtype=float)
 
 	# sum all the magnitude/imtensity of pixel with same radius	
@@ -883,8 +1101,8 @@ def RadialProjection(img):
 	tbin[0] = csim[ind[1]-1]
 	tbin[-1] = csim[-1]-csim[ind[-1]-1]
 
-	# normalize by the number of pixel with same radius
-	radial_profile = tbin / count	
+	# normalize by the number of pixel with same radius (sums accumulated in double precision)
+	radial_profile = (tbin / count).astype(img.dtype)	
 	
 	# store data   	
 	Radius = ru; RadialIntegration = radial_profile
@@ -912,23 +1130,17 @@ def ButterworthEllipticFilter(parameters, subset, angle):
 	if subset.FlagFlip:
 		angle = 360-angle
 	
-	# get rows and column number from dimension
+	# image dimension
 	dimension = subset.image.shape	
-	rows = dimension[0]; cols = dimension[1];
 	
-	# create vectors normalized in between +- 0.5
-	tmp1 = np.linspace(1,cols,cols); tmp2 = np.linspace(1,rows,rows);
-	a1 = 1./(cols-1); b1 = -0.5 *(cols+1)/(cols-1); a2 = 1./(rows-1); b2 = -0.5 *(rows+1)/(rows-1); # define substitution (1:dimension -> -0.5:0.5)
-	tmp1 = a1 * tmp1 + b1; tmp2 = a2 * tmp2 + b2; # perform substitution
-
-	#initialize x and y 
-	x = np.outer(np.ones(rows,),tmp1) 
-	y = np.outer(np.transpose(tmp2),np.transpose(np.ones(cols,))); 
+	# x and y normalized in between +- 0.5
+	dtype = FloatType(parameters)
+	x, y = FilterGrid(dimension, dtype)
 		
 	# applies a linear transformation to rotate through alpha. 
 	angle = angle*np.pi/180
-	x2 = (x*np.cos(angle) - y*np.sin(-angle));
-	y2 = (x*np.sin(-angle) + y*np.cos(angle));
+	x2 = (x*dtype(np.cos(angle)) - y*dtype(np.sin(-angle)));
+	y2 = (x*dtype(np.sin(-angle)) + y*dtype(np.cos(angle)));
 	
 	#ellipse radius
 	a = parameters.EllipseBigRadius/2;
@@ -939,6 +1151,7 @@ def ButterworthEllipticFilter(parameters, subset, angle):
 	
 	return Filter
 
+@MT.Timed('ImageFilter')
 def ImageFilter(parameters, subset, angle):
 	#-----------------------------------------------------	
 	# Filter image:	
@@ -946,25 +1159,20 @@ def ImageFilter(parameters, subset, angle):
 	#               - apply filter in frequency domain
 	#               - reconstitute image
 	#----------------------------------------------------	
-	# image spectrum
-	Spectrum = imfft(subset.image)		
-        # magnitude          	
-	mag = 20*np.log(cv2.magnitude(Spectrum[:,:,0],Spectrum[:,:,1]))   	                 	
-	# define filter
-	Filter1 = ButterworthEllipticFilter(parameters, subset, angle)
-	Filter = np.tile(Filter1[...,None], (1,1,2))
+	# image spectrum (half plane)
+	Spectrum = imrfft(subset.image, FloatType(parameters))		
+	# define filter (centered), symmetrize it (F(k)+F(-k))/2 for a real filtered image and keep the same half plane
+	Filter = np.fft.ifftshift(ButterworthEllipticFilter(parameters, subset, angle))
+	Filter = 0.5 * (Filter + np.roll(np.roll(Filter[::-1, ::-1], 1, axis=0), 1, axis=1))[:, :Spectrum.shape[1]]
 	# apply filter
 	Spectrum = np.multiply(Filter,Spectrum)
-	# magnitude of filtered spectrum
-	magf = 20*np.log(cv2.magnitude(Spectrum[:,:,0],Spectrum[:,:,1]))
 	#image restitution
-	image = imifft(Spectrum)
+	image = imirfft(Spectrum, subset.image.shape)
 	
 	"""
-	fig,((ax1),(ax2),(ax3)) = plt.subplots(1,3)
-	ax1.imshow(mag);ax1.axis('off');
-	ax2.imshow(cv2.magnitude(Filter[:,:,0],Filter[:,:,1]));ax2.axis('off')
-	ax3.imshow(magf);ax3.axis('off')
+	fig,((ax1),(ax2)) = plt.subplots(1,2)
+	ax1.imshow(np.fft.fftshift(ButterworthEllipticFilter(parameters, subset, angle)));ax1.axis('off')
+	ax2.imshow(20*np.log(HalfPlane2Full(np.abs(Spectrum), subset.image.shape)));ax2.axis('off')
 	"""
 	return image
 	
@@ -977,20 +1185,51 @@ def imifft(Spectrum):
 	f =  cv2.idft(np.fft.ifftshift(Spectrum))
 	return cv2.magnitude(f[:,:,0], f[:,:,1]) 
 
+def imrfft(image, dtype=np.float64):
+	#real to complex fft transform of 2D image (half plane: columns 0 to N/2, the other
+	#half is given by the Hermitian symmetry S(-k) = conj(S(k))); numpy.fft computes in
+	#double precision, the single precision (complex64) transform is done by OpenCV
+	if dtype == np.float32:
+		return cv2.dft(np.float32(image), flags = cv2.DFT_COMPLEX_OUTPUT).view(np.complex64)[:, :image.shape[1]//2+1, 0]
+	return np.fft.rfft2(np.float64(image))
+
+def imirfft(Spectrum, shape):
+	#inverse (complex to real) fft transform of the half plane Spectrum to image
+	if Spectrum.dtype == np.complex64:
+		rows, cols = shape; ncols = Spectrum.shape[1]
+		full = np.empty(shape, dtype=np.complex64)
+		full[:, :ncols] = Spectrum
+		full[:, ncols:] = np.conj(Spectrum[np.mod(-np.arange(rows), rows)][:, cols - np.arange(ncols, cols)])
+		return np.abs(cv2.idft(full.view(np.float32).reshape(rows, cols, 2), flags = cv2.DFT_REAL_OUTPUT | cv2.DFT_SCALE))
+	return np.abs(np.fft.irfft2(Spectrum, shape))
+
+def FloatType(parameters):
+	#float type of the spectrum computations (precision policy of CL.ComputingParametersSpectrum)
+	return np.float32 if getattr(parameters, 'Precision', 'float64') == 'float32' else np.float64
+
+def HalfPlane2Full(half, shape):
+	#centered full plane (central low-frequencies, as imfft) of a symmetric half plane
+	#quantity (power or amplitude spectrum of a real image): full[-i,-j] = half[i,j]
+	rows, cols = shape; ncols = half.shape[1]
+	full = np.empty(shape, dtype=half.dtype)
+	full[:, :ncols] = half
+	full[:, ncols:] = half[np.mod(-np.arange(rows), rows)][:, cols - np.arange(ncols, cols)]
+	return np.fft.fftshift(full)
+
 
 #******************************************************
 #	    WAVE SPECTRUM Utilities
 #******************************************************
-def Spectrum1D(xline, yline, PowerSpectrumFlag):
+def Spectrum1D(xline, yline, PowerSpectrumFlag, dtype=np.float64):
 	#------------------------------------------------
 	# estimate spectrum from intensity pixel lines  
 	#------------------------------------------------
 	diml = yline.shape[0]; resl = np.sum(np.diff(xline))/(diml-1); step = 1./resl; 
 	# wavenumber axis
 	freqs = np.linspace(0,(diml-1)*step/diml,diml); frqs =  freqs[range(diml/2)]
-	ks = 2*np.pi*freqs; ks = ks[range(diml/2)]
-	# fourier transform
-	Y = np.fft.fft(yline); Y = Y[range(diml/2)]; YY = np.reshape(cv2.magnitude(np.real(Y),np.imag(Y)), (Y.shape[0])); 
+	ks = dtype(2*np.pi*freqs); ks = ks[range(diml/2)]
+	# fourier transform (real line: half spectrum)
+	Y = imrfft(yline[np.newaxis], dtype)[0]; Y = Y[range(diml/2)]; YY = np.reshape(cv2.magnitude(np.real(Y),np.imag(Y)), (Y.shape[0])); 
 	if PowerSpectrumFlag:
 		YY = Y*np.conjugate(Y)
 	return ks, np.real(YY)
@@ -1159,7 +1398,7 @@ def MeanWaveSeriesSpectrum(image, direction, res, linewidth, paddingextrapower):
 	edpt = DetectLineEdge(image, linecenter)
 	
 	# extract 
-	yline = profile_line(image, edpt.point1, edpt.point2, linewidth, order=2);
+	yline = measure.profile_line(image, edpt.point1, edpt.point2, linewidth, order=2);
 	xline = Distance4Line(yline,edpt,res)
 
 	# perform zero padding (to increase spectrum resolution)
@@ -19,12 +19,15 @@ Definition of the different subset (and FFT Boxes) associated with the grid poin
 import os
 #
 import numpy as np
-import matplotlib.pyplot as plt
 #
 import cv2
 #
 import CSAR_Classes as CL
+import CSAR_Metrics as MT
 import CSAR_ImageProcessing as IP
+import CSAR_Imports as LI
+#
+plt = LI.Lazy('matplotlib.pyplot')
 #
 
 def GetBoxDim(subsetparameters, subset):
@@ -108,6 +111,7 @@ def GetSubsetCenters(Point, offset, BoxNb):
 				(np.int(Point[0]+np.ceil(offset[1])),	np.int(Point[1]+np.ceil(offset[1])))]
 	return subset_centers
 
+@MT.Timed('GetFFTBoxes')
 def GetFFTBoxes(subsetparameters, data, dimension):
 
 	#---------------------------------------------------------------------------------------------------------------
@@ -15,9 +15,11 @@ Gather all the utilities functions
 
 	Conversion 	
 					List2Array	Array2List	rads2deg
+					PointsTable	SnapCoordinates
 
 	ReadWrite	
 					ReadPointsfromFile	WritePointstoFile
+					Subset_TransferFileName	SpatialOrder	Create_WorkOrder
 	
 	Interpolation/Averaging
 					find_nearest	groupedAvg
@@ -26,7 +28,8 @@ Gather all the utilities functions
 					RMSE		Correlation
 
 	Peak Detection
-					PeakDetection	CentroidPeakPosition	ClusterPeakPosition	DistributionFitPeakPosition	
+					PeakDetection	PeakDetectionBatch	CentroidPeakPosition	ClusterPeakPosition	
+					KMeans2		DistributionFitPeakPosition	RayleighMode	RayleighFit	
 					ThresholdCrossing	AboveThresholdValues	
 	Statistical Fit Functions	objective_peak	objective_sin	
 					RayleighDistribution	ChiDistribution
@@ -36,26 +39,22 @@ Gather all the utilities functions
 					sigma0
 """
 #
-import sys, os, re
+import sys, os, re, operator
 #
 import numpy as np
 #
 import cPickle as pickle
 #
 import CSAR_Classes as CL
-#
-import cv2
+import CSAR_Metrics as MT
 #
 import itertools
-#
-import sklearn.cluster as skc
-import scipy.cluster.vq as svq
-from scipy.optimize import minimize
 
 #*********************
 #	ROI
 #*********************
 def ResizeArray(array, fac):
+	import cv2
 	return cv2.resize(array, (1200,1200), interpolation = cv2.INTER_NEAREST)
 
 def List2Array(data):
@@ -64,16 +63,13 @@ def List2Array(data):
         # convert coordinate data in list into an workable numpy coordinate array
         #
         #---------------------------------------------------------------------------
-	nx = data.shape[0];
-	array  = np.zeros((nx,2))
-	for i in range(data.shape[0]):
-		array[i,0] = data[i].easting;  array[i,1] = data[i].northing;		
-		
-	return array
+	table = PointsTable(data, ('easting', 'northing'))
+	return np.column_stack((table['easting'], table['northing']))
 
 #***********************************
 # save temporary computation files
 #***********************************
+@MT.Timed('pickle_read', read=0)
 def Unpickle_File(fname):
 	#-----------------------------
 	# load temporary file
@@ -83,6 +79,7 @@ def Unpickle_File(fname):
 		data = pickle.load(f)
 	return data
 
+@MT.Timed('pickle_write', written=0)
 def Pickle_File(fname,data):
 	#-----------------------------
 	# save temporary file
@@ -126,6 +123,8 @@ def Create_Image_Parameters_TransferFile(Subsetparameters, ImageParameters, data
 	#filename = path + 'parameters.out'
 	#parameters.pickle(filename)
 
+	return filename
+
 def Create_Subset_TransferFile(index, parameters, point, SubsetData, outlist):
 	#-----------------------------------------------------------------------
 	# Create transfer file to save grid point subsets data and information
@@ -133,16 +132,43 @@ def Create_Subset_TransferFile(index, parameters, point, SubsetData, outlist):
 	# path and filename
 	cwd = os.getcwd()
 	path = cwd+'/'
-	fname = 'subset'
-	if outlist:
-		transfer_file = path + outlist[index]
-	else:
-		transfer_file = path + fname + str(index) + '.out'
+	transfer_file = path + Subset_TransferFileName(index, outlist)
 	# gather data	
 	Subset = CL.SubsetTransferData(parameters, point, SubsetData)
 	
 	# save data
 	Subset.pickle(transfer_file)
+
+	return transfer_file
+
+def Subset_TransferFileName(index, outlist):
+	#------------------------------------------------
+	# name of the subsets transfer file of a point
+	#------------------------------------------------
+	fname = 'subset'
+	if outlist:
+		return outlist[index]
+	return fname + str(index) + '.out'
+
+def SpatialOrder(Points, band):
+	#-------------------------------------------------------------------------------------
+	# order of the grid points along a serpentine path: bands of rows (band: height in
+	# pixels) swept alternately West-East and East-West, so that consecutive points
+	# are neighbours and share FFT boxes
+	#-------------------------------------------------------------------------------------
+	columns = np.array([point.IndexEasting for point in Points]); rows = np.array([point.IndexNorthing for point in Points])
+	bands = np.floor(rows / float(max(band, 1))).astype(int)
+	return np.lexsort((np.where(np.mod(bands, 2) == 0, columns, -columns), bands))
+
+def Create_WorkOrder(Points, band, outlist, fname='SpectrumWorkOrder.txt'):
+	#--------------------------------------------------------------------------------------
+	# list of the subsets transfer files in spatial order (split in contiguous chunks to
+	# distribute the spectrum computation so that each worker reuses its boxes spectra)
+	#--------------------------------------------------------------------------------------
+	with open(fname, 'w') as f:
+		for index in SpatialOrder(Points, band):
+			f.write(Subset_TransferFileName(index, outlist) + '\n')
+	return os.path.join(os.getcwd(), fname)
 	
 def Create_TransferFile(args, point, datatype):
 	#----------------------------------------------------------------------------
@@ -170,6 +196,8 @@ def Create_TransferFile(args, point, datatype):
 	#save data
 	point.pickle(transfer_file)
 
+	return transfer_file
+
 #**************************
 #	Conversion
 #**************************
@@ -201,6 +229,30 @@ def rads2deg(radians):
 def CartesianNautical(angle):
 	return np.mod((360-angle)+90,360)
 
+def PointsTable(Points, fields):
+	#------------------------------------------------------------------------------------
+	# columnar table of grid points: one float array per attribute (fields, dotted
+	# names for the attributes of the point data, e.g. Spectrum.WaveDirection) and the
+	# points themselves ('points', object array) so that groups and orders of points
+	# are computed with masks and indices instead of loops over the points
+	#------------------------------------------------------------------------------------
+	points = np.empty(len(Points), dtype=object); points[:] = list(Points)
+	table = dict((field, np.array(map(operator.attrgetter(field), points), dtype=np.float64)) for field in fields)
+	table['points'] = points
+	return table
+
+def SnapCoordinates(values, tolerance=1.):
+	#------------------------------------------------------------------------------------
+	# label of the coordinates that are the same within a tolerance (sorted values
+	# closer than the tolerance to the previous one share its label, labels increase
+	# with the values)
+	#------------------------------------------------------------------------------------
+	values = np.asarray(values, dtype=np.float64)
+	order = np.argsort(values, kind='mergesort')
+	labels = np.empty(values.size, dtype=int)
+	labels[order] = np.cumsum(np.r_[0, np.diff(values[order]) >= tolerance])
+	return labels
+
 #**************************
 #	Read/Write
 #**************************
@@ -351,93 +403,150 @@ def PeakDetection(parameters, method, data):
 	#--------------------------------------------------------------
 	# 	Detect peak position in observation, data or spectrum
 	#--------------------------------------------------------------
-	# load data	
-	x = data.x; y = data.y;
+	return PeakDetectionBatch(parameters, method, data.x, data.y[np.newaxis])[0]
+
+@MT.Timed('PeakDetection')
+def PeakDetectionBatch(parameters, method, x, Y):
+	#------------------------------------------------------------------------------
+	# 	Detect peak positions of several curves Y (rows) sharing the axis x
+	#------------------------------------------------------------------------------
+	x = np.asarray(x, dtype=float); Y = np.atleast_2d(np.asarray(Y, dtype=float))
 			
 	if method in {'max', 'Max', 'maximum', 'Maximum'}:				# simple maximum detection
-		I = np.argmax(y); peakposition = x[I];	
+		peakposition = x[np.argmax(Y, axis=1)]
 
 	elif method in {'Centroid', 'centroid', 'CentroidPower','centroidpower'}:	# Centroid method
-		peakposition = CentroidPeakPosition(parameters, data)
+		peakposition = CentroidPeakPosition(parameters, x, Y)
 	
 	elif method in {'Cluster', 'cluster', 'ClusterPower','clusterpower'}:		# Cluster method
-		peakposition = ClusterPeakPosition(parameters, data)
+		peakposition = ClusterPeakPosition(parameters, x, Y)
 
 	elif method in {'RayleighDistribution', 'ChiDistribution'}:
-		peakposition = DistributionFitPeakPosition(parameters, data)		# Fit with know distribution (Rayleigh)
+		peakposition = DistributionFitPeakPosition(parameters, x, Y)		# Fit with know distribution (Rayleigh)
+	else:
+		sys.exit("Peak detection method not defined")
 	
 	return peakposition
 
 
-def CentroidPeakPosition(parameters, data):
+def CentroidPeakPosition(parameters, x, Y):
 	#------------------------------------------------------------------
 	# compute position of the curve centroid taken as the peak value
 	#-----------------------------------------------------------------	
 
 	# bins with significant energy (> ratio)
-	index = np.where(data.y> parameters.ratio*np.max(data.y))	
-	x, y = data.x[index], data.y[index]
+	mask = Y > parameters.ratio*np.max(Y, axis=1)[:, np.newaxis]
+	W = np.where(mask, Y, 0)**parameters.power
 
 	# estimate weighted peak value
-	peakposition = np.sum(np.multiply(x,y**parameters.power))/np.sum(y**parameters.power)
+	peakposition = np.dot(W, x)/np.sum(W, axis=1)
 	
 	return peakposition
 	
-def  ClusterPeakPosition(parameters, observations):
+def  ClusterPeakPosition(parameters, x, Y):
 	#-----------------------------------------------------------------------------------------------------
 	# compute position of centroid of cluster with highest y-value which is considered as the peak value 
+	# (2-means of the points (x, y**power) of all the curves at once, initialized with the first and last
+	# points of the curves as the random points of scipy kmeans2 would mostly be: low y-values)
 	#-----------------------------------------------------------------------------------------------------
 	#parameters
 	niter = 50		# number of iterations
-	ncl = 2			# number of clusters
-	thrc = 1e-5		# threshold of acceptance
-	KmeansMethod = 1	# 1: scipy, 2: scikit-learn
 
 	# transform data
-	data=np.zeros((observations.x.shape[0],2)); data[:,0] = observations.x; data[:,1] = observations.y**parameters.power
-	
-	#scipy
-	if KmeansMethod == 1:
-		center,_ = svq.kmeans2(data,ncl, iter=niter, thresh=thrc, minit='points', missing='warn') #scipy cluster
-	else: 
-		kmeans = skc.KMeans(n_clusters=ncl, init='random', n_init=10, max_iter=niter, tol=thrc).fit(data) # scikit-learn	
-		center = kmeans.cluster_centers_.squeeze(); 
-	I = np.argmax(center[:,1])
-	peakposition = center[I,0]	
+	V = Y**parameters.power; rows = np.arange(Y.shape[0])
+	initial = np.tile([0, V.shape[1]-1], (V.shape[0], 1))
+
+	Cx, Cv = KMeans2(x, V, initial, niter)
+	peakposition = Cx[rows, np.argmax(Cv, axis=1)]
 	
 	return peakposition
 
-
-def DistributionFitPeakPosition(parameters, data):
-	#--------------------------------------------------------
+def KMeans2(x, V, initial, niter):
+	#--------------------------------------------------------------------------------------
+	# 2-means (Lloyd) of the points (x, V[i]) of each row i, initial: indices of the points
+	# taken as initial centers (rows, 2); returns the centers (rows, 2)
+	#--------------------------------------------------------------------------------------
+	rows = np.arange(V.shape[0])
+	Cx = x[initial]; Cv = V[rows[:, np.newaxis], initial]
+	labels = None
+	for iteration in range(niter):
+		# assign each point to its nearest center
+		distance = [(x - Cx[:, [c]])**2 + (V - Cv[:, [c]])**2 for c in range(2)]
+		new = distance[1] < distance[0]
+		if labels is not None and np.array_equal(new, labels):
+			break
+		labels = new
+		# update the centers (an empty cluster keeps its center)
+		for c, member in enumerate([~labels, labels]):
+			count = np.sum(member, axis=1); valid = count > 0
+			Cx[valid, c] = np.sum(np.where(member, x, 0), axis=1)[valid] / count[valid]
+			Cv[valid, c] = np.sum(np.where(member, V, 0), axis=1)[valid] / count[valid]
+	return Cx, Cv
+
+
+def DistributionFitPeakPosition(parameters, x, Y):
+	#--------------------------------------------------------------------------------
 	# compute wave number associated to Spectrum peak value
-	# method: fit with common wave distribution
-	#--------------------------------------------------------
+	# method: fit with common wave distribution (Rayleigh) of the values above the
+	# threshold, all the curves at once (Levenberg-Marquardt seeded by RayleighMode)
+	#--------------------------------------------------------------------------------
 	# find maximum and crossing of threshold
-	M = np.max(data.y); thrs = parameters.ratio*M;
-	x_roi, y_roi = AboveThresholdValues(data.x, data.y, thrs)
+	M = np.max(Y, axis=1); thrs = parameters.ratio*M; rows = np.arange(Y.shape[0])
+	mask = Y > thrs[:, np.newaxis]; first = np.argmax(mask, axis=1)
 	
+	# curves relative to their first value above the threshold
+	xs = np.where(mask, x - x[first][:, np.newaxis], 0.); ys = np.where(mask, Y - Y[rows, first][:, np.newaxis], 0.)
+
 	# fit curve with given distribution
-	FirstGuess=[1, 0.004]	
-	func = RayleighDistribution
-	fg = func(x_roi-x_roi[0], FirstGuess)	
-	result = minimize(objective_peak, FirstGuess , args=(func, x_roi-x_roi[0], y_roi-y_roi[0]), method='Nelder-Mead', options={'disp': True})
-	
+	coef = RayleighFit(xs, ys, mask)
+
 	#find function maximum
-	y = RayleighDistribution(x_roi-x_roi[0],result.x)
-	I = np.argmax(y)
-	peakposition = x_roi[I]
-	"""
-	plt.plot(x,y)
-	plt.plot(x_roi, y_roi,'c')
-	plt.plot(x_roi,fg+y_roi[0],'r')
-	plt.axhline(thrs, color='k', linestyle='--')
-	plt.plot(x_roi,y+y_roi[0],'b')
-	plt.plot(peakposition,y[I]+y_roi[0],'ok')
-	plt.show()
-	"""
+	y = np.where(mask, RayleighDistribution(xs, coef.T[:, :, np.newaxis]), -np.inf)
+	peakposition = x[np.argmax(y, axis=1)]
+
 	return peakposition
 
+def RayleighMode(xs, ys, mask):
+	#-------------------------------------------------------------------------------------
+	# closed-form Rayleigh fit of the curves (rows): mode s from the second moment of the
+	# (positive) curve E[x**2] = 2 s**2 and amplitude from linear least squares
+	#-------------------------------------------------------------------------------------
+	w = np.where(mask, np.maximum(ys, 0), 0); total = np.sum(w, axis=1)
+	s = np.where(total > 0, np.sqrt(np.sum(w*xs**2, axis=1) / (2*np.where(total > 0, total, 1))), 0.004)
+	s[s <= 0] = 0.004
+	g = np.where(mask, RayleighDistribution(xs, [1., s[:, np.newaxis]]), 0)
+	norm = np.sum(g**2, axis=1)
+	A = np.where(norm > 0, np.sum(g*ys, axis=1) / np.where(norm > 0, norm, 1), 1.)
+	return np.column_stack((A, s))
+
+def RayleighFit(xs, ys, mask, niter=100, tol=1e-8):
+	#-------------------------------------------------------------------------------------
+	# least squares Rayleigh fit (objective_peak) of the curves (rows), vectorised
+	# Levenberg-Marquardt on the coefficients (amplitude, mode) of all the curves
+	#-------------------------------------------------------------------------------------
+	coef = RayleighMode(xs, ys, mask); damping = np.zeros(coef.shape[0]) + 1e-3
+	Cost = lambda coef: 0.5*np.sum(np.where(mask, RayleighDistribution(xs, coef.T[:, :, np.newaxis]) - ys, 0)**2, axis=1)
+	cost = Cost(coef)
+	for iteration in range(niter):
+		A, s = coef[:, [0]], coef[:, [1]]
+		e = np.exp(-xs**2/(2*s**2))
+		g = xs*e/s**2
+		J = [np.where(mask, g, 0), np.where(mask, A*xs*e*(xs**2/s**5 - 2/s**3), 0)]
+		r = np.where(mask, A*g - ys, 0)
+		# normal equations (2x2) of each curve
+		JJ = np.array([[np.sum(J[i]*J[j], axis=1) for j in range(2)] for i in range(2)]); Jr = np.array([np.sum(J[i]*r, axis=1) for i in range(2)])
+		a, b, d = JJ[0, 0]*(1 + damping), JJ[0, 1], JJ[1, 1]*(1 + damping)
+		det = a*d - b*b; det[det == 0] = np.inf
+		step = np.column_stack(((-d*Jr[0] + b*Jr[1])/det, (b*Jr[0] - a*Jr[1])/det))
+		trial = coef + step
+		trialcost = np.where(trial[:, 1] > 0, Cost(np.where(trial[:, [1]] > 0, trial, coef)), np.inf)
+		accept = trialcost < cost
+		coef[accept] = trial[accept]; cost[accept] = trialcost[accept]
+		damping = np.where(accept, damping/10, damping*10)
+		if np.all(np.abs(step) <= tol*(np.abs(coef) + tol)) or np.all(damping > 1e12):
+			break
+	return coef
+
 def ThresholdCrossing(x, y, thr):
 	if x.shape>2:
 		x = np.delete(x,x[0:-2])
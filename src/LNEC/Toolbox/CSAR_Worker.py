@@ -0,0 +1,294 @@
+#!/usr/bin/python2.7
+# -*- coding: utf-8 -*-
+
+
+"""
+=====================================================================================================
+Warm worker: SAR_Spectrum and SAR_Inversion runs served by a long-lived process
+=====================================================================================================
+ Date: Oct/2026
+=====================================================================================================
+	The orchestrator launches SAR_Spectrum and SAR_Inversion once per grid point, so each point
+	pays the interpreter startup and the import of the Toolbox. The worker (SAR_Worker) imports
+	the Toolbox and computes the box tables once, then runs the scripts in its own process for
+	the tasks it receives (one JSON line per task: script, command line arguments and working
+	directory) on a local (unix) socket or on stdin:
+
+		{"script": "SAR_Spectrum", "argv": ["-i", "subset12.out"], "cwd": "/data/run"}
+
+	and answers one JSON line with the exit status and the outputs of the script:
+
+		{"status": 0, "stdout": "...", "stderr": "", "seconds": 0.41}
+
+	The scripts keep their command line: with the CORESYF_WORKER environment variable giving the
+	socket of a worker, they send their arguments to it (Delegate, before importing numpy and the
+	Toolbox) and exit with its status. The tasks run with the rights of the worker (they remove
+	and write files), so the socket is readable and writable by its owner only, by default in a
+	private directory of the user (PrivateSocket). A worker runs its tasks one at a time (fork:
+	in parallel) and the connections waiting for it are queued (BACKLOG, bounded by the system);
+	a script whose connection is refused by a busy worker (whose pid is in <socket>.pid) tries
+	again for CORESYF_WORKER_WAIT seconds (default 600) before running locally.
+
+	The box spectra (see SP.SetBoxCache) and the box tables (see SP.WarmTables) are kept from
+	one task to the next. The metrics and manifest records are written per task (CORESYF_METRICS
+	of the worker environment).
+
+		Delegate	Send		Connect		Running
+		Stop		PrivateSocket	Run		Serve
+		Handle		Parse		Answer		ServeStdin
+"""
+#
+import os, sys, json, time, errno, socket, tempfile, traceback
+#
+
+SOCKET = os.environ.get('CORESYF_WORKER', '')
+WAIT = float(os.environ.get('CORESYF_WORKER_WAIT', 600))
+BACKLOG = 1024
+SCRIPTS = ['SAR_Spectrum', 'SAR_Inversion']
+LNEC = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# set in the worker process (its scripts runs are not delegated)
+State = {'serving': False, 'tasks': 0}
+
+#******************************************************
+#	   CLIENT
+#******************************************************
+def Connect(address, wait=0.):
+	#-------------------------------------------------------------------------------
+	# connection to the worker; a connection refused by a busy worker (queue of
+	# the socket full) is tried again for wait seconds (no retry when the socket
+	# does not exist or its worker is not running)
+	#-------------------------------------------------------------------------------
+	deadline, delay = time.time() + wait, 0.05
+	while True:
+		client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		try:
+			client.connect(address)
+			return client
+		except socket.error, error:
+			client.close()
+			if error.errno not in (errno.ECONNREFUSED, errno.EAGAIN) or not Running(address) or time.time() + delay > deadline:
+				raise
+		time.sleep(delay); delay = min(2 * delay, 2.)
+
+def Running(address):
+	#-------------------------------------------------------------------
+	# whether the worker of a socket is running (see its pid file)
+	#-------------------------------------------------------------------
+	try:
+		with open(address + '.pid') as f:
+			os.kill(int(f.read()), 0)
+	except (IOError, ValueError, OSError):
+		return False
+	return True
+
+def Send(task, address=SOCKET, wait=0.):
+	#--------------------------------------------------------
+	# send a task to the worker and return its answer
+	#--------------------------------------------------------
+	client = Connect(address, wait)
+	try:
+		client.sendall(json.dumps(task) + '\n')
+		stream = client.makefile('r')
+		answer = stream.readline()
+		stream.close()
+	finally:
+		client.close()
+	if not answer:
+		raise IOError('no answer from the worker ' + address)
+	return json.loads(answer)
+
+def Delegate(script):
+	#-------------------------------------------------------------------------------
+	# run the script (path of the calling script) by the worker of CORESYF_WORKER
+	# and exit with its status; the script runs locally when no worker is set
+	# (or reachable)
+	#-------------------------------------------------------------------------------
+	if not SOCKET or State['serving']:
+		return
+	name = os.path.splitext(os.path.basename(script))[0]
+	try:
+		answer = Send({'script': name, 'argv': sys.argv[1:], 'cwd': os.getcwd()}, SOCKET, WAIT)
+	except (IOError, socket.error), message:
+		sys.stderr.write('worker %s not available (%s): %s runs locally\n' % (SOCKET, message, name))
+		return
+	sys.stdout.write(answer['stdout']); sys.stderr.write(answer['stderr'])
+	sys.stdout.flush(); sys.stderr.flush()
+	sys.exit(answer['status'])
+
+def Stop(address=SOCKET):
+	#-------------------------------------------------------
+	# stop the worker (after the task being processed)
+	#-------------------------------------------------------
+	return Send({'stop': True}, address)
+
+def PrivateSocket():
+	#----------------------------------------------------------------------------------
+	# default socket, in a directory of the user only ($XDG_RUNTIME_DIR, else
+	# <tmp>/coresyf-<uid>, created by the worker)
+	#----------------------------------------------------------------------------------
+	directory = os.environ.get('XDG_RUNTIME_DIR') or os.path.join(tempfile.gettempdir(), 'coresyf-%d' % os.getuid())
+	return os.path.join(directory, 'coresyf_worker.sock')
+
+#******************************************************
+#	   WORKER
+#******************************************************
+def Run(task):
+	#---------------------------------------------------------------------------------
+	# run a script in the worker process: its outputs are captured and its exit
+	# (sys.exit, error) gives the status; the items of the manifest not committed
+	# are marked failed and the metrics are written as at the end of a script
+	#---------------------------------------------------------------------------------
+	import runpy, StringIO
+	import CSAR_Manifest as MF
+	import CSAR_Metrics as MT
+
+	name = task.get('script')
+	if name not in SCRIPTS:
+		return {'status': 2, 'stdout': '', 'stderr': 'script %s not served by the worker (%s)\n' % (name, ', '.join(SCRIPTS)), 'seconds': 0.}
+
+	start = time.time(); status = 0
+	stdout, stderr = StringIO.StringIO(), StringIO.StringIO()
+	saved = sys.argv, sys.stdout, sys.stderr, os.getcwd()
+	sys.argv = [os.path.join(LNEC, name + '.py')] + [str(argument) for argument in task.get('argv', [])]
+	sys.stdout, sys.stderr = stdout, stderr
+	MT.Restart(name)
+	try:
+		os.chdir(task.get('cwd', saved[3]))
+		runpy.run_path(sys.argv[0], run_name='__main__')
+	except SystemExit, exit:
+		if exit.code is None or isinstance(exit.code, int):
+			status = exit.code or 0
+		else:
+			stderr.write('%s\n' % exit.code); status = 1
+	except Exception:
+		stderr.write(traceback.format_exc()); status = 1
+	finally:
+		MF.Failed()
+		if MT.ENABLED:
+			MT.Flush()
+		MT.Restart('SAR_Worker')
+		sys.argv, sys.stdout, sys.stderr = saved[:3]
+		os.chdir(saved[3])
+	State['tasks'] += 1
+	return {'status': status, 'stdout': stdout.getvalue(), 'stderr': stderr.getvalue(), 'seconds': time.time() - start}
+
+def Serve(address, fork=False, verbose=False):
+	#--------------------------------------------------------------------------------
+	# serve the tasks sent on a unix socket until a stop message; fork: each task
+	# runs in a child process (tasks in parallel, the box spectra it computes are
+	# not kept by the worker)
+	#--------------------------------------------------------------------------------
+	directory = os.path.dirname(os.path.abspath(address))
+	if not os.path.isdir(directory):
+		os.makedirs(directory, 0o700)
+	if address == PrivateSocket() and (os.stat(directory).st_uid != os.getuid() or os.stat(directory).st_mode & 0o077):
+		sys.exit('directory %s of the worker socket is not private to the user' % directory)
+	if os.path.exists(address):
+		os.remove(address)		# socket of a previous worker
+	server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+	# socket created for the user only (the tasks run with the rights of the worker)
+	umask = os.umask(0o077)
+	try:
+		server.bind(address)
+	finally:
+		os.umask(umask)
+	os.chmod(address, 0o600)
+	server.listen(BACKLOG)
+	with open(address + '.pid', 'w') as f:
+		f.write('%d' % os.getpid())
+	State['serving'] = True
+	children = set()
+	try:
+		stopped = False
+		while not stopped:
+			connection, _ = server.accept()
+			try:
+				stopped = Handle(server, connection, children, fork, verbose)
+			except (socket.error, IOError):
+				pass		# client gone before sending its task
+			finally:
+				connection.close()
+	finally:
+		for pid in children:
+			os.waitpid(pid, 0)
+		server.close()
+		for fname in [address, address + '.pid']:
+			if os.path.exists(fname):
+				os.remove(fname)
+
+def Handle(server, connection, children, fork, verbose):
+	#-----------------------------------------------------------------------
+	# read, run and answer the task of a connection (True: stop message)
+	#-----------------------------------------------------------------------
+	stream = connection.makefile('rw')
+	try:
+		task, answer = Parse(stream.readline())
+		if answer is not None:
+			Answer(stream, answer)
+		elif task.get('stop'):
+			Answer(stream, {'status': 0, 'stdout': '', 'stderr': '', 'tasks': State['tasks']})
+			return True
+		elif fork:
+			# finished children
+			children.difference_update([pid for pid in list(children) if os.waitpid(pid, os.WNOHANG)[0] == pid])
+			pid = os.fork()
+			if pid == 0:
+				try:
+					server.close()
+					Answer(stream, Run(task), task, verbose)
+				finally:
+					os._exit(0)
+			children.add(pid)
+		else:
+			Answer(stream, Run(task), task, verbose)
+		return False
+	finally:
+		try:
+			stream.close()
+		except (socket.error, IOError):
+			pass
+
+def Parse(line):
+	#-------------------------------------------------------------------------
+	# task of a JSON line, or the answer to a malformed task (status 2)
+	#-------------------------------------------------------------------------
+	try:
+		task = json.loads(line)
+		if not isinstance(task, dict):
+			raise ValueError('not a JSON object')
+		if not isinstance(task.get('argv', []), list):
+			raise ValueError('argv is not a list')
+		return task, None
+	except ValueError, message:
+		return None, {'status': 2, 'stdout': '', 'stderr': 'malformed task (%s): %r\n' % (message, line[:200]), 'seconds': 0.}
+
+def Answer(stream, answer, task=None, verbose=False):
+	#-------------------------------------------------------------------
+	# send the answer of a task (ignored if the client is gone)
+	#-------------------------------------------------------------------
+	try:
+		stream.write(json.dumps(answer) + '\n'); stream.flush()
+	except (socket.error, IOError):
+		pass
+	if verbose and task is not None:
+		sys.stdout.write('%s %s: status %d (%.2f s)\n' % (task.get('script'), ' '.join(str(argument) for argument in task.get('argv', [])), answer['status'], answer['seconds']))
+		sys.stdout.flush()
+
+def ServeStdin(verbose=False):
+	#-----------------------------------------------------------------------
+	# serve the tasks read on stdin (one JSON line each, answers on stdout)
+	# until the end of the input or a stop message
+	#-----------------------------------------------------------------------
+	State['serving'] = True
+	for line in iter(sys.stdin.readline, ''):
+		if not line.strip():
+			continue
+		task, answer = Parse(line)
+		if answer is None and task.get('stop'):
+			break
+		if answer is None:
+			answer = Run(task)
+		Answer(sys.stdout, answer)
+		if verbose and task is not None:
+			sys.stderr.write('%s %s: status %d (%.2f s)\n' % (task.get('script'), ' '.join(str(argument) for argument in task.get('argv', [])), answer['status'], answer['seconds']))
@@ -19,8 +19,9 @@
 @summary: 
 This module runs the following Co-ReSyF tool:
  - IMAGE CROP
-It uses the GDAL raster utility program "gdal_warp.py" to crop an image for a 
-specific region of interest.
+It uses GDAL to crop an image for a specific region of interest. When the crop
+limits are aligned with the raster grid, only the pixel window is read (or 
+referenced by a VRT file); otherwise the image is warped (as "gdalwarp").
 It allows cropping a raster based on any polygon shapefile. The extent of the
 cropped raster is defined according with the bounding box or limits of the
 polygon.
@@ -35,6 +36,20 @@ Example 1 - Crop image using a polygon shapefile:
 ./coresyf_image_crop.py -r etopo_raster.tif -c crop_limits.shp 
                         -o cropped_image.tif 
 
+Example 2 - Crop image to limits aligned with the raster grid, creating a 
+            virtual raster (cropped_image.vrt) without copying any data:
+./coresyf_image_crop.py -r etopo_raster.tif --c_limits="-10 35 5 45"
+                        -o cropped_image.tif --vrt
+
+Example 3 - Crop one image for each polygon of a shapefile (named 
+            <FID>_aoi.tif), 8 at a time:
+./coresyf_image_crop.py -r scene.tif -c coastal_aois.shp -o aoi.tif --batch 
+                        --threads=8 --cache=1024
+
+Example 4 - Crop several regions of interest (1_aoi.tif, 2_aoi.tif):
+./coresyf_image_crop.py -r etopo_raster.tif --c_limits="-10 35 -5 40" 
+                        --c_limits="0 40 5 45" -o aoi.tif
+
 
 @attention: 
     @todo
@@ -48,13 +63,24 @@ Example 1 - Crop image using a polygon shapefile:
 @change:
 1.0
 - First release of the tool. 
+1.1
+- The image is cropped in-process instead of running "gdalwarp". Crop limits
+  aligned with the raster grid read only the pixel window (or create a VRT 
+  with --vrt); other crops are warped with multiple threads (--memory).
+1.2
+- Added batch mode: one output file for each polygon of the shapefile 
+  (--batch) or for each --c_limits. The input raster is opened once (per 
+  thread), the crops are sorted by source block and processed concurrently
+  (--threads) with a shared GDAL block cache (--cache).
 '''
 
-VERSION = '1.0'
+VERSION = '1.2'
 USAGE   = ( '\n'
             'coresyf_image_crop.py [-r <InputRaster>] [-c <CropShapefile>]\n'
             '                      [--c_limits="<LonMin> <LatMin> <LonMax> <LatMax>"]\n'
-            "                      [-o <OutputRaster>] [--o_format=<OutputFileFormat>]"
+            "                      [-o <OutputRaster>] [--o_format=<OutputFileFormat>]\n"
+            "                      [--vrt] [--memory=<MB>] [--batch] [--threads=<Value>]\n"
+            "                      [--cache=<MB>]"
  #           "[--o_type=<DataType>]" 
             "\n")
 
@@ -64,7 +90,181 @@ USAGE   = ( '\n'
 ''' SYSTEM MODULES '''
 from optparse import OptionParser
 import sys
-import subprocess
+import os
+import threading
+from multiprocessing.pool import ThreadPool
+from osgeo import gdal, ogr, osr
+
+#==============================================================================
+#                             CROPPING ENGINE
+#==============================================================================
+# Tolerance (in pixels) to consider that the crop limits fall on the edges of 
+# the raster pixels.
+ALIGN_TOLERANCE = 1e-6
+
+
+def pixel_window(data, limits):
+    """Return the (xoff, yoff, xsize, ysize) pixel window of 'data' matching the 
+    crop 'limits' (xmin, ymin, xmax, ymax, in the raster coordinate system). 
+    Returns None if the limits are not aligned with the raster grid or not 
+    inside the raster, i.e. if the crop requires warping."""
+    gt = data.GetGeoTransform()
+    if gt[2] != 0 or gt[4] != 0:    # rotated grid
+        return None
+    xmin, ymin, xmax, ymax = limits
+    edges = [(xmin - gt[0]) / gt[1], (xmax - gt[0]) / gt[1],
+             (ymax - gt[3]) / gt[5], (ymin - gt[3]) / gt[5]]
+    pixels = [int(round(edge)) for edge in edges]
+    for edge, pixel in zip(edges, pixels):
+        if abs(edge - pixel) > ALIGN_TOLERANCE:
+            return None
+    x0, x1 = sorted(pixels[:2])
+    y0, y1 = sorted(pixels[2:])
+    if x0 < 0 or y0 < 0 or x1 > data.RasterXSize or y1 > data.RasterYSize:
+        return None
+    if x1 == x0 or y1 == y0:
+        return None
+    return x0, y0, x1 - x0, y1 - y0
+
+
+def crop_image(data, output_file, img_format='GTiff', limits=None, cutline=None, 
+               vrt=False, memory=256, cutline_where=None):
+    """Crop the 'data' dataset to the 'limits' (xmin, ymin, xmax, ymax) or to 
+    the extent of the 'cutline' polygon file (restricted to the features 
+    selected by the 'cutline_where' attribute query), into 'output_file'. 
+    If the limits are aligned with the raster grid only the pixel window is 
+    read (no resampling), or referenced by a VRT file if 'vrt' is True. 
+    Otherwise (cutline masking or resampling needed) the image is warped with
+    multiple threads, using up to 'memory' MB.
+    Returns: the name of the output file."""
+    window = None
+    if cutline is None:
+        window = pixel_window(data, limits)
+    
+    if window is not None:
+        if vrt:
+            img_format = 'VRT'
+            output_file = os.path.splitext(output_file)[0] + '.vrt'
+        options = gdal.TranslateOptions(format=img_format, srcWin=list(window))
+        result = gdal.Translate(output_file, data, options=options)
+    else:
+        options = gdal.WarpOptions(format=img_format, outputBounds=limits, 
+                                   cutlineDSName=cutline, 
+                                   cutlineWhere=cutline_where,
+                                   cropToCutline=cutline is not None,
+                                   multithread=True,
+                                   warpMemoryLimit=memory * 1024 * 1024,
+                                   warpOptions=['NUM_THREADS=ALL_CPUS'])
+        result = gdal.Warp(output_file, data, options=options)
+    if result is None:
+        raise Exception ("Error! Unable to create '%s'." % output_file)
+    result = None
+    return output_file
+
+
+def numbered_file(output_file, number):
+    """Return the name of the output file of the crop 'number' of a batch
+    (e.g. 'dir/3_cropped_image.tif')."""
+    path, name = os.path.split(output_file)
+    return os.path.join(path, '%s_%s' % (number, name))
+
+
+def feature_crops(input_raster, crop_shape, output_raster):
+    """Build the list of crops (see crop_images) of the batch mode, one for each
+    polygon of the 'crop_shape' layer, named after the feature identifiers.
+    Returns: the list of crops and the list of the envelopes (xmin, ymin, xmax,
+             ymax) of the polygons, in the coordinate system of 'input_raster'."""
+    shape = ogr.Open(crop_shape)
+    if shape is None:
+        raise Exception ("Error! Unable to open '%s'." % crop_shape)
+    layer = shape.GetLayer(0)
+    
+    transform = None
+    layer_srs = layer.GetSpatialRef()
+    raster_srs = osr.SpatialReference(wkt=gdal.Open(input_raster).GetProjection())
+    if layer_srs is not None and raster_srs.ExportToWkt() and not layer_srs.IsSame(raster_srs):
+        for srs in (layer_srs, raster_srs):
+            if hasattr(srs, 'SetAxisMappingStrategy'):    # GDAL >= 3
+                srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+        transform = osr.CoordinateTransformation(layer_srs, raster_srs)
+    
+    crops = []
+    envelopes = []
+    for feature in layer:
+        fid = feature.GetFID()
+        geometry = feature.GetGeometryRef().Clone()
+        if transform is not None:
+            geometry.Transform(transform)
+        xmin, xmax, ymin, ymax = geometry.GetEnvelope()
+        crops.append((numbered_file(output_raster, fid), None, crop_shape, 'FID=%d' % fid))
+        envelopes.append((xmin, ymin, xmax, ymax))
+    return crops, envelopes
+
+
+def block_footprint(data, envelope):
+    """Return the (row, column) of the source block at the upper left corner of
+    the 'envelope' (xmin, ymin, xmax, ymax) of a crop, used to sort the crops 
+    so that neighbouring regions are processed together."""
+    gt = data.GetGeoTransform()
+    block_xsize, block_ysize = data.GetRasterBand(1).GetBlockSize()
+    xmin, ymin, xmax, ymax = envelope
+    col = max(0, int(min((xmin - gt[0]) / gt[1], (xmax - gt[0]) / gt[1])))
+    row = max(0, int(min((ymax - gt[3]) / gt[5], (ymin - gt[3]) / gt[5])))
+    return row // block_ysize, col // block_xsize
+
+
+# Input dataset opened by each thread of the batch mode (see crop_task)
+thread_data = threading.local()
+
+
+def crop_task(args):
+    """Crop one region of interest of a batch in a worker thread. Each thread 
+    opens the input raster once (GDAL datasets cannot be shared between 
+    threads); the GDAL block cache is shared by all of them."""
+    input_raster, crop, img_format, vrt, memory = args
+    if getattr(thread_data, 'data', None) is None:
+        thread_data.data = gdal.Open(input_raster, gdal.GA_ReadOnly)
+    output_file, limits, cutline, cutline_where = crop
+    return crop_image(thread_data.data, output_file, img_format, limits, cutline, 
+                      vrt, memory, cutline_where)
+
+
+def crop_images(input_raster, crops, img_format='GTiff', vrt=False, memory=256,
+                threads=1, envelopes=None):
+    """Crop 'input_raster' once for each (output_file, limits, cutline, 
+    cutline_where) of the 'crops' list (see crop_image). 
+    The crops are sorted by the source block at their upper left corner (from 
+    their limits or their 'envelopes') so that consecutive crops read the same
+    blocks from the GDAL block cache. With 'threads' > 1 they are processed 
+    concurrently, each thread taking runs of consecutive crops. Otherwise the 
+    input raster is opened only once.
+    Returns: the list of output files (in the order of 'crops')."""
+    data = gdal.Open(input_raster, gdal.GA_ReadOnly)
+    if data is None:
+        raise Exception ("Error! Unable to open '%s'." % input_raster)
+    if envelopes is None:
+        envelopes = [crop[1] for crop in crops]
+    order = range(0, len(crops))
+    if None not in envelopes:
+        order.sort(key=lambda i: block_footprint(data, envelopes[i]))
+    
+    if threads > 1 and len(crops) > 1:
+        pool = ThreadPool(threads)
+        tasks = [(input_raster, crops[i], img_format, vrt, memory) for i in order]
+        chunksize = max(1, len(tasks) // (threads * 4))
+        results = pool.map(crop_task, tasks, chunksize)
+        pool.close()
+        pool.join()
+    else:
+        results = []
+        for i in order:
+            output_file, limits, cutline, cutline_where = crops[i]
+            results.append(crop_image(data, output_file, img_format, limits, cutline,
+                                      vrt, memory, cutline_where))
+    output_files = [None] * len(crops)
+    for i, output_file in zip(order, results):
+        output_files[i] = output_file
+    return output_files
 
 
 def main():
@@ -82,7 +282,9 @@ def main():
                       help="input polygon shapefile defining crop limits",)
     parser.add_option('--c_limits', 
                       dest="crop_limits", metavar=' ',
-                      help="list of values defining georeferenced crop limits",)
+                      help=("list of values defining georeferenced crop limits (may be "
+                            "repeated to crop several regions of interest)"),
+                      action="append",)
     parser.add_option('-o', 
                       dest="output_raster", metavar=' ',
                       help=("output raster file cropped to the extent of the "
@@ -92,6 +294,28 @@ def main():
                       dest="output_format", metavar=' ',
                       help="GDAL format for output file (default: 'GTiff')",
                       default="GTiff" )    
+    parser.add_option("--vrt", 
+                      dest="vrt", action="store_true", 
+                      help=("create a virtual raster (VRT) referencing the input file when the "
+                            "crop limits are aligned with its grid (output extension set to .vrt)"))
+    parser.add_option('--memory', 
+                      dest="memory", metavar=' ',
+                      help="memory in MB used for warping (default: 256)",
+                      default=256,
+                      type=int )
+    parser.add_option("--batch", 
+                      dest="batch", action="store_true", 
+                      help=("crop one output file for each polygon of the shapefile "
+                            "(named <FID>_<OutputRaster>)"))
+    parser.add_option('--threads', 
+                      dest="threads", metavar=' ',
+                      help="number of regions of interest cropped concurrently (default: 1)",
+                      default=1,
+                      type=int )
+    parser.add_option('--cache', 
+                      dest="cache", metavar=' ',
+                      help="size in MB of the GDAL block cache shared by the crops (default: GDAL default)",
+                      type=int )
 
     #==============================#
     #   Check mandatory options    #
@@ -115,29 +339,31 @@ def main():
     #        Check crop limits       #
     #================================#
     if opts.crop_limits:
-        
+        list_crop_limits = []
         try:
-            crop_limits = [float(i) for i in opts.crop_limits.split(' ')]
-            LonMin, LatMin, LonMax, LatMax = crop_limits
-            
-            if LonMin > 180 or LonMin < -180: 
-                print("LonMin value out of range [-180, 180]!")
-                raise Exception
-            if LonMax > 180 or LonMax < -180:
-                print("LonMax value out of range [-180, 180]!")
-                raise Exception
-            if LatMin > 90 or LatMin < -90:
-                print("LatMin value out of range [-90, 90]!")
-                raise Exception
-            if LatMax > 90 or LatMax < -90:
-                print("LatMax value out of range [-90, 90]!")
-                raise Exception
-            if LatMax < LatMin: 
-                print("LatMax is higher than LatMin!")
-                raise Exception
-            if LonMax < LonMin:
-                print("LonMax is higher than LonMin!")    
-                raise Exception      
+            for limits in opts.crop_limits:
+                crop_limits = [float(i) for i in limits.split(' ')]
+                LonMin, LatMin, LonMax, LatMax = crop_limits
+                
+                if LonMin > 180 or LonMin < -180: 
+                    print("LonMin value out of range [-180, 180]!")
+                    raise Exception
+                if LonMax > 180 or LonMax < -180:
+                    print("LonMax value out of range [-180, 180]!")
+                    raise Exception
+                if LatMin > 90 or LatMin < -90:
+                    print("LatMin value out of range [-90, 90]!")
+                    raise Exception
+                if LatMax > 90 or LatMax < -90:
+                    print("LatMax value out of range [-90, 90]!")
+                    raise Exception
+                if LatMax < LatMin: 
+                    print("LatMax is higher than LatMin!")
+                    raise Exception
+                if LonMax < LonMin:
+                    print("LonMax is higher than LonMin!")    
+                    raise Exception      
+                list_crop_limits.append(crop_limits)
         except:
             print("Incorrect crop limits!")
             print('Example: --c_limits="-100 -60 100 60"')
@@ -145,49 +371,31 @@ def main():
             return
     
     #================================#
-    # Building gdalwarp command line #
+    #       Crop the input raster    #
     #================================#
-    gdal_exe    = 'gdalwarp '
-    
-    raster_opts = ''
-    if opts.crop_shape:
-        raster_opts = '-cutline %s -cl %s -crop_to_cutline ' % (opts.crop_shape, 
-                                                                opts.crop_shape.split('.')[0])
-    else:
-        raster_opts = '-te %s' % opts.crop_limits
-    
-    output_opts = '%s %s -of %s ' % (opts.input_raster,
-                                     opts.output_raster,
-                                     opts.output_format) 
-    
-    gdalwarp_command = gdal_exe + raster_opts + output_opts
-    
-    #===========================#
-    # Run gdalwarp command line #
-    #===========================#
-    #print ('\n' + gdalwarp_command)
-    #print("\nRunning using Python version %s.%s.%s..." % sys.version_info[:3])
     try:
+        if opts.cache:
+            gdal.SetCacheMax(opts.cache * 1024 * 1024)
+        envelopes = None
+        if opts.crop_shape and opts.batch:
+            crops, envelopes = feature_crops(opts.input_raster, opts.crop_shape,
+                                             opts.output_raster)
+        elif opts.crop_shape:
+            crops = [(opts.output_raster, None, opts.crop_shape, None)]
+        elif len(list_crop_limits) == 1:
+            crops = [(opts.output_raster, list_crop_limits[0], None, None)]
+        else:
+            crops = [(numbered_file(opts.output_raster, i + 1), list_crop_limits[i], None, None)
+                     for i in range(0, len(list_crop_limits))]
         
-        process = subprocess.Popen( gdalwarp_command,
-                                    shell  = True,
-                                    stdin  = subprocess.PIPE,
-                                    stdout = subprocess.PIPE,
-                                    stderr = subprocess.PIPE, )
-        # Reads the output and waits for the process to exit before returning
-        stdout, stderr = process.communicate()   
-        print (stdout) 
-        print('I am runnin')
-        print(stderr)
-        
-        
-        if stderr:      raise Exception (stderr)  # or  if process.returncode:
+        if len(crops) > 1:
+            print ("Cropping %d regions of interest..." % len(crops))
+        crop_images(opts.input_raster, crops, opts.output_format, opts.vrt, opts.memory,
+                    opts.threads, envelopes)
     except Exception, message:
-        
         print( str(message) )
-        
-        sys.exit(process.returncode)
+        sys.exit(1)
     
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -19,8 +19,9 @@
 @summary: 
 This module runs the following Co-ReSyF tool:
  - IMAGE MASK
-It uses the GDAL raster utility program "gdal_calc.py" to calculate the final 
-masked image.
+It reads the raster and the mask block by block with GDAL and calculates the
+final masked image with NumPy, the same way as the GDAL raster utility program
+"gdal_calc.py" with the expression A*B.
 It can take any raster file and use it as a mask to extract values from a 
 geospatial image. The mask is a raster in which each pixel contains no-data or 
 a single valid value. The no-data pixels on the mask are assigned as no-data 
@@ -60,9 +61,14 @@ Example 3 - Create a mask on the fly (with elevations above 1000)
 @change:
 1.0
 - First release of the tool. 
+1.1
+- The masked image is calculated in-process, block by block, instead of 
+  running "gdal_calc.py" for each band (and "gdal_merge.py" to join them). The 
+  mask range is evaluated as NumPy comparisons and all bands are written 
+  directly into the output file.
 '''
 
-VERSION = '1.0'
+VERSION = '1.1'
 USAGE   = ( "\n"
             "coresyf_image_mask.py [-r <InputRaster>] [--r_band=<Value>]\n"
             "                      [-m <InputMask>] [--m_band=<Value>] [--m_range=<min1:max1,min2:max2...>]\n"
@@ -77,9 +83,77 @@ DefaultTypesLookup = ['Byte','UInt16','Int16','UInt32','Int32','Float32','Float6
 ''' SYSTEM MODULES '''
 from optparse import OptionParser
 import sys
-from osgeo import gdal
-import subprocess
-import os
+from osgeo import gdal, gdal_array
+import numpy as np
+from raster_blocks import block_windows
+
+#==============================================================================
+#                            MASKING ENGINE
+#==============================================================================
+# Default output nodata values (the same used by gdal_calc.py)
+DefaultNDVLookup = {'Byte': 255, 'UInt16': 65535, 'Int16': -32767,
+                    'UInt32': 4294967293, 'Int32': -2147483647,
+                    'Float32': 3.402823466E+38, 'Float64': 1.7976931348623158E+308}
+
+
+def parse_ranges(mask_range):
+    """Convert a 'min1:max1,min2:max2...' range option into a list of
+    (min, max) tuples (None for a missing bound)."""
+    ranges = []
+    for part in mask_range.split(','):
+        minV, maxV = part.split(':')
+        minV = int(minV) if minV else None
+        maxV = int(maxV) if maxV else None
+        ranges.append((minV, maxV))
+    return ranges
+
+
+def range_mask(values, ranges):
+    """Return the boolean array of the 'values' within any of the 'ranges'
+    (bounds excluded), i.e. ((B>min1) & (B<max1)) | ((B>min2) & (B<max2))..."""
+    selected = np.zeros(values.shape, dtype=bool)
+    for minV, maxV in ranges:
+        part = np.ones(values.shape, dtype=bool)
+        if minV is not None:
+            part &= values > minV
+        if maxV is not None:
+            part &= values < maxV
+        selected |= part
+    return selected
+
+
+def largest_data_type(bands):
+    """Return the largest GDAL data type code of the 'bands' (the default
+    output type of gdal_calc.py, e.g. Float32 for Int32 and Float32 bands,
+    Int16 for UInt16 and Int16 bands, whatever the order of the bands)."""
+    return max(band.DataType for band in bands)
+
+
+def mask_bands(r_bands, m_bands, ranges, target, no_data_value):
+    """Write into each band of the 'target' dataset the masked values of the 
+    corresponding raster band: A*B, or A*(B in 'ranges') if a list of ranges 
+    is given. Pixels with the nodata value in the raster or in the mask are 
+    set to 'no_data_value'. The input files are read block by block, so that 
+    all the bands are masked in a single pass without temporary files."""
+    out_type = gdal_array.GDALTypeCodeToNumericTypeCode(target.GetRasterBand(1).DataType)
+    for xoff, yoff, xsize, ysize in block_windows(r_bands[0]):
+        for i in range(0, len(r_bands)):
+            A = r_bands[i].ReadAsArray(xoff, yoff, xsize, ysize)
+            B = m_bands[i].ReadAsArray(xoff, yoff, xsize, ysize)
+            if ranges:
+                values = A * range_mask(B, ranges)
+            else:
+                values = A * B
+            nodata = np.zeros(A.shape, dtype=bool)
+            for band, array in ((r_bands[i], A), (m_bands[i], B)):
+                if band.GetNoDataValue() is not None:
+                    nodata |= array == band.GetNoDataValue()
+            values = values.astype(out_type)
+            values[nodata] = no_data_value
+            target.GetRasterBand(i + 1).WriteArray(values, xoff, yoff)
+    for i in range(0, len(r_bands)):
+        target.GetRasterBand(i + 1).SetNoDataValue(no_data_value)
+        target.GetRasterBand(i + 1).FlushCache()
 
 
 def main():
@@ -158,25 +232,10 @@ def main():
     #================================#
     # Check and convert range option #
     #================================#
-    ranges_exp = ''
+    ranges = []
     if opts.mask_range:
         try:
-            for part in opts.mask_range.split(','):
-                part_exp = ''
-                minV, maxV = part.split(':')
-                if minV:
-                    minV = int(minV)
-                    part_exp += '(B>%d)' % minV
-                if maxV:
-                    maxV = int(maxV)
-                    if part_exp:  part_exp += ' & '
-                    part_exp += '(B<%d)' % maxV
-                
-                part_exp = '(' + part_exp + ')'    # ((B>0) & (B<10))
-                if ranges_exp: ranges_exp += ' | '
-                ranges_exp += part_exp   # ((B>0) & (B<10)) | ((B>15) & (B<16))
-            
-            ranges_exp = '(' + ranges_exp + ')'      
+            ranges = parse_ranges(opts.mask_range)
         except:
             print("Incorrect range! Use a valid range format!")
             print("Example: --m_range=0:100,150:160,200:")
@@ -186,98 +245,63 @@ def main():
     #================================#
     #     Check all_bands option     #
     #================================#   
+    try:
+        raster = gdal.Open(opts.input_raster, gdal.GA_ReadOnly)
+        mask = gdal.Open(opts.input_mask, gdal.GA_ReadOnly)
+        r_bands = raster.RasterCount
+        m_bands = mask.RasterCount
+    except:
+        print ("Unable to determine the number of bands of the input files (raster or mask)!")
+        sys.exit(1)
     r_bandsIDs = [opts.raster_band]
     m_bandsIDs = [opts.mask_band]
-    output_files = [opts.output_raster]
     if opts.all_bands:
-        try:
-            r_bands = gdal.Open(opts.input_raster, gdal.GA_ReadOnly).RasterCount
-            m_bands = gdal.Open(opts.input_mask, gdal.GA_ReadOnly).RasterCount
-            
-            if r_bands <= 1: # Single-band raster with single-band mask
-                pass
-            else:            # Multi-band raster...
-                r_bandsIDs = [i for i in range(1, r_bands+1)]
-                output_files = [str(i) + '_' + opts.output_raster for i in range(1, r_bands+1)]
-                if r_bands == m_bands:  # ...with multi-band mask
-                    m_bandsIDs = r_bandsIDs
-                else:                   # ...with single-band mask
-                    m_bandsIDs = [opts.mask_band]*r_bands
-        except:
-            print ("Unable to determine the number of bands of the input files (raster or mask)!")
-            sys.exit(1)
+        if r_bands <= 1: # Single-band raster with single-band mask
+            pass
+        else:            # Multi-band raster...
+            r_bandsIDs = [i for i in range(1, r_bands+1)]
+            if r_bands == m_bands:  # ...with multi-band mask
+                m_bandsIDs = r_bandsIDs
+            else:                   # ...with single-band mask
+                m_bandsIDs = [opts.mask_band]*r_bands
 
     #====================================#
-    #    LOOP THROUGH ALL RASTER BANDS   #
+    #    MASK ALL RASTER BANDS AT ONCE   #
     #====================================#
-    for i in range(0, len(r_bandsIDs)):
-        print ("Applying mask band #%d to raster band #%d..." %(m_bandsIDs[i],
-                                                                r_bandsIDs[i]) )
-        #------------------------------------#
-        # Building gdal_calc.py command line #
-        #------------------------------------#
-        gdal_exe    = 'gdal_calc.py '
-        raster_opts = '-A %s --A_band=%d ' % (opts.input_raster, r_bandsIDs[i])
-        mask_opts   = '-B %s --B_band=%d ' % (opts.input_mask, m_bandsIDs[i])
+    try:
+        if (raster.RasterXSize != mask.RasterXSize or 
+            raster.RasterYSize != mask.RasterYSize):
+            raise Exception ("Error! Raster and mask must have the same dimensions.")
         
-        expression = ''
-        if opts.mask_range:
-            expression = '--calc="A*' + ranges_exp + '" '
-        else:
-            expression = '--calc="A*B" '
-        
-        output_opts = '--outfile=%s --format=%s ' % (output_files[i], opts.output_format) 
+        r_bands = [raster.GetRasterBand(i) for i in r_bandsIDs]
+        m_bands = [mask.GetRasterBand(i) for i in m_bandsIDs]
         if opts.data_type:
-            output_opts += '--type=%s ' % (opts.data_type)
-        if opts.no_data_value != None:
-            output_opts += '--NoDataValue=%d ' % (opts.no_data_value)
-        
-        gdal_calc_command = gdal_exe + raster_opts + mask_opts + expression + output_opts
+            data_type = gdal.GetDataTypeByName(opts.data_type)
+        else:
+            data_type = largest_data_type(r_bands + m_bands)
+        no_data_value = opts.no_data_value
+        if no_data_value is None:
+            no_data_value = DefaultNDVLookup[gdal.GetDataTypeName(data_type)]
         
-        #------------------------------------#
-        #    Run gdal_calc.py command line   #
-        #------------------------------------#
-        #print ('\n' + gdal_calc_command)
-        #print("\nRunning using Python version %s.%s.%s..." % sys.version_info[:3])
-        try:
-            process = subprocess.Popen( gdal_calc_command,
-                                        shell  = True,
-                                        stdin  = subprocess.PIPE,
-                                        stdout = subprocess.PIPE,
-                                        stderr = subprocess.PIPE, )
-            # Reads the output and waits for the process to exit before returning
-            stdout, stderr = process.communicate()   
-            print (stdout)
-            if stderr:            raise Exception (stderr)  # or  if process.returncode:
-            if 'Error' in stdout: raise Exception() # Dummy! gdal_calc.py returncode is always 0!
-        except Exception, message:
-            print( str(message) )
-            sys.exit(1)  # or sys.exit(process.returncode)
-    
-    #===============================#
-    # Merge single-band output files#
-    #===============================#
-    if len(output_files) > 1:
-        gdal_merge_command = ('gdal_merge.py -separate -o ' + opts.output_raster
-                              + ' ' + ' '.join(output_files) )
-        print ("Merging all bands into one output file...")
-        #print ('\n' + gdal_merge_command)
-        try:
-            process = subprocess.Popen( gdal_merge_command,
-                                        shell  = True,
-                                        stdin  = subprocess.PIPE,
-                                        stdout = subprocess.PIPE,
-                                        stderr = subprocess.PIPE, )
-            # Reads the output and waits for the process to exit before returning
-            stdout, stderr = process.communicate()   
-            print (stdout) 
-            if stderr:      raise Exception (stderr)  # or  if process.returncode:
-        except Exception, message:
-            print( str(message) )
-            sys.exit(process.returncode)
+        driver = gdal.GetDriverByName(opts.output_format)
+        if driver is None:
+            raise Exception ("Error! Unknown output format '%s'." % opts.output_format)
+        target = driver.Create(opts.output_raster, raster.RasterXSize, raster.RasterYSize,
+                               len(r_bands), data_type)
+        if target is None:
+            raise Exception ("Error! Unable to create '%s'." % opts.output_raster)
+        target.SetGeoTransform(raster.GetGeoTransform())
+        target.SetProjection(raster.GetProjection())
         
-        for outfile in output_files:
-            os.remove(outfile)
+        for i in range(0, len(r_bandsIDs)):
+            print ("Applying mask band #%d to raster band #%d..." %(m_bandsIDs[i],
+                                                                    r_bandsIDs[i]) )
+        mask_bands(r_bands, m_bands, ranges, target, no_data_value)
+        target = None
+    except Exception, message:
+        print( str(message) )
+        sys.exit(1)
+
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
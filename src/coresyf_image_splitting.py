@@ -19,8 +19,9 @@
 @summary: 
 This module runs the following Co-ReSyF tool:
  - IMAGE SPLITTING
-It uses the GDAL raster utility program "gdal_translate.py" to split the bands 
-of an input raster into different output raster files.  
+It splits the bands of an input raster into different output raster files, 
+reading the input raster only once (block by block) with GDAL. Alternatively, 
+it creates virtual rasters (VRT) referencing each band of the input raster.  
 
 @example:
 Example 1.1 - Generate different raster images for all bands of the input raster
@@ -33,6 +34,13 @@ Example 1.2 - Generate different raster images for all bands of the input raster
 
 Example 2 - Generate raster image only for 2nd band of the input raster file:
 ./coresyf_image_splitting.py -r image_2bands.tif --r_band=2 -o band_2.tif
+
+Example 3 - Write the output files of all bands concurrently (4 threads):
+./coresyf_image_splitting.py -r image_8bands.tif -o band.tif --all_bands --threads=4
+
+Example 4 - Generate virtual rasters (band_1.vrt, band_2.vrt) for all bands 
+            (no data copying, to be used by other GDAL tools):
+./coresyf_image_splitting.py -r image_2bands.tif -o band_1.vrt band_2.vrt --all_bands --vrt
  
 @attention: 
  
@@ -43,14 +51,19 @@ Example 2 - Generate raster image only for 2nd band of the input raster file:
 @change:
 1.0
 - First release of the tool. 
+1.1
+- The bands are extracted in a single pass over the input raster instead of 
+  running "gdal_translate" once per band (optionally writing the output files 
+  concurrently, --threads). 
+- Added --vrt option to create virtual rasters of the bands.
 '''
 
-VERSION = '1.0'
+VERSION = '1.1'
 USAGE   = ( "\n"
             "coresyf_image_splitting.py [-r <InputMultiBandRaster>] [--r_band=<Value>]\n"
             "                           [-o <Outputbasename> OR <Output1> <Output2> ...] [--o_format=<OutputFileFormat>]\n"
             "                           [--o_type=<DataType>] [--no_data_value=<Value>]\n"
-            "                           [--all_bands]"
+            "                           [--all_bands] [--threads=<Value>] [--vrt]"
             "\n")
 
 DefaultTypesLookup = ['Byte','UInt16','Int16','UInt32','Int32','Float32','Float64']
@@ -60,7 +73,94 @@ DefaultTypesLookup = ['Byte','UInt16','Int16','UInt32','Int32','Float32','Float6
 from optparse import OptionParser
 import sys
 from osgeo import gdal
-import subprocess
+from multiprocessing.pool import ThreadPool
+import os
+from raster_blocks import block_windows
+
+#==============================================================================
+#                            SPLITTING ENGINE
+#==============================================================================
+def create_band_file(data, band, output_file, img_format, data_type, no_data_value):
+    """Create the single-band 'output_file' for the input 'band' of 'data', with
+    the georeferencing, metadata and nodata value copied as gdal_translate does.
+    Drivers without Create() support (e.g. PNG) get an in-memory dataset that 
+    is copied to 'output_file' at the end (see close_band_file)."""
+    driver = gdal.GetDriverByName(img_format)
+    if driver is None:
+        raise Exception ("Error! Unknown output format '%s'." % img_format)
+    if driver.GetMetadataItem(gdal.DCAP_CREATE) != 'YES':
+        driver = gdal.GetDriverByName('MEM')
+    target = driver.Create(output_file, data.RasterXSize, data.RasterYSize, 1,
+                           data_type or band.DataType)
+    if target is None:
+        raise Exception ("Error! Unable to create '%s'." % output_file)
+    target.SetGeoTransform(data.GetGeoTransform())
+    target.SetProjection(data.GetProjection())
+    target.SetMetadata(data.GetMetadata())
+    target_band = target.GetRasterBand(1)
+    target_band.SetDescription(band.GetDescription())
+    if band.GetColorTable() is not None:
+        target_band.SetColorTable(band.GetColorTable())
+    if no_data_value is None:
+        no_data_value = band.GetNoDataValue()
+    if no_data_value is not None:
+        target_band.SetNoDataValue(no_data_value)
+    return target
+
+
+def close_band_file(target, output_file, img_format):
+    """Flush 'target' to disk, copying it to 'output_file' if it was created in
+    memory (see create_band_file)."""
+    target.FlushCache()
+    if target.GetDriver().ShortName == 'MEM' and img_format != 'MEM':
+        gdal.GetDriverByName(img_format).CreateCopy(output_file, target)
+
+
+def write_block(args):
+    """Write the 'values' of a block into the band of a 'target' dataset."""
+    target, values, xoff, yoff = args
+    target.GetRasterBand(1).WriteArray(values, xoff, yoff)
+
+
+def split_bands(data, r_bandsIDs, output_files, img_format, data_type=None, 
+                no_data_value=None, threads=1):
+    """Extract the 'r_bandsIDs' bands of 'data' into the 'output_files' in a 
+    single pass: each block of the input raster is read once (with all its 
+    bands, which is the cheapest access for pixel interleaved files) and its 
+    bands are fanned out to the output files. With 'threads' > 1 the output 
+    files are written concurrently. Values are converted to 'data_type' (the 
+    input band type by default) by GDAL, as gdal_translate -ot does."""
+    bands = [data.GetRasterBand(i) for i in r_bandsIDs]
+    targets = [create_band_file(data, bands[i], output_files[i], img_format, 
+                                data_type, no_data_value) 
+               for i in range(0, len(bands))]
+    pool = ThreadPool(threads) if threads > 1 else None
+    all_bands = len(bands) > 1 and len(bands) == data.RasterCount
+    for xoff, yoff, xsize, ysize in block_windows(bands[0]):
+        if all_bands:
+            values = data.ReadAsArray(xoff, yoff, xsize, ysize)
+        else:
+            values = [band.ReadAsArray(xoff, yoff, xsize, ysize) for band in bands]
+        tasks = [(targets[i], values[i], xoff, yoff) for i in range(0, len(bands))]
+        if pool is None:
+            map(write_block, tasks)
+        else:
+            pool.map(write_block, tasks)
+    if pool is not None:
+        pool.close()
+        pool.join()
+    for i in range(0, len(targets)):
+        close_band_file(targets[i], output_files[i], img_format)
+
+
+def band_vrt(data, band_id, output_file, data_type=None, no_data_value=None):
+    """Create a VRT 'output_file' referencing the 'band_id' band of 'data', 
+    without copying any pixel."""
+    options = gdal.TranslateOptions(format='VRT', bandList=[band_id],
+                                    outputType=data_type or gdal.GDT_Unknown,
+                                    noData=no_data_value)
+    if gdal.Translate(output_file, data, options=options) is None:
+        raise Exception ("Error! Unable to create '%s'." % output_file)
 
 
 def main():
@@ -99,6 +199,15 @@ def main():
     parser.add_option("--all_bands", 
                       dest="all_bands", action="store_true", 
                       help="generate different raster images for all bands of the input raster file")
+    parser.add_option('--threads', 
+                      dest="threads", metavar=' ',
+                      help="number of threads writing the output files concurrently (default: 1)",
+                      default=1,
+                      type=int )
+    parser.add_option("--vrt", 
+                      dest="vrt", action="store_true", 
+                      help=("create virtual rasters (VRT) referencing the bands of the input "
+                            "raster file instead of copying them (output extension set to .vrt)"))
     
     #==============================#
     #   Check mandatory options    #
@@ -145,44 +254,30 @@ def main():
             sys.exit(1)    
     
     #====================================#
-    #    LOOP THROUGH ALL RASTER BANDS   #
+    #     SPLIT ALL BANDS IN ONE PASS    #
     #====================================#
-    for i in range(0, len(r_bandsIDs)):
-        print ("Creating output file for band #%d..." % r_bandsIDs[i])
-        
-        #--------------------------------------#
-        # Building gdal_translate command line #
-        #--------------------------------------#
-        gdal_exe    = 'gdal_translate '
-        raster_opts = '-b %d %s ' % (r_bandsIDs[i], opts.input_raster)
-        
-        output_opts = '%s -of %s ' % (output_files[i], opts.output_format) 
+    try:
+        data = gdal.Open(opts.input_raster, gdal.GA_ReadOnly)
+        if data is None:
+            raise Exception ("Error! Unable to open '%s'." % opts.input_raster)
+        data_type = None
         if opts.data_type:
-            output_opts += '-ot %s ' % (opts.data_type)
-        if opts.no_data_value != None:
-            output_opts += '-a_nodata %d ' % (opts.no_data_value)
-
-        gdal_translate_command = gdal_exe + raster_opts + output_opts
+            data_type = gdal.GetDataTypeByName(opts.data_type)
         
-        #------------------------------------#
-        #  Run gdal_translate command line   #
-        #------------------------------------#
-        print ('\n' + gdal_translate_command)
-        print("\nRunning using Python version %s.%s.%s..." % sys.version_info[:3])
-        try:
-            process = subprocess.Popen( gdal_translate_command,
-                                        shell  = True,
-                                        stdin  = subprocess.PIPE,
-                                        stdout = subprocess.PIPE,
-                                        stderr = subprocess.PIPE, )
-            # Reads the output and waits for the process to exit before returning
-            stdout, stderr = process.communicate()   
-            print (stdout)
-            if stderr:            raise Exception (stderr)  # or  if process.returncode:
-        except Exception, message:
-            print( str(message) )
-            sys.exit(process.returncode)
+        if opts.vrt:
+            for i in range(0, len(r_bandsIDs)):
+                output_file = os.path.splitext(output_files[i])[0] + '.vrt'
+                print ("Creating virtual file for band #%d..." % r_bandsIDs[i])
+                band_vrt(data, r_bandsIDs[i], output_file, data_type, opts.no_data_value)
+        else:
+            for i in range(0, len(r_bandsIDs)):
+                print ("Creating output file for band #%d..." % r_bandsIDs[i])
+            split_bands(data, r_bandsIDs, output_files, opts.output_format,
+                        data_type, opts.no_data_value, opts.threads)
+    except Exception, message:
+        print( str(message) )
+        sys.exit(1)
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
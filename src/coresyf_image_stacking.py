@@ -19,20 +19,30 @@
 @summary: 
 This module runs the following Co-ReSyF tool:
  - IMAGE STACKING
-It uses the GDAL raster utility program "gdal_merge.py" to generate the final 
-raster image, where each band corresponds to a separate input raster file.
+It generates the final raster image, where each band corresponds to a separate
+input raster file. When all the input rasters are on the same grid, their 
+blocks are copied in-process (or referenced by a virtual raster); otherwise the
+GDAL raster utility program "gdal_merge.py" is used to resample them.
 
 @example: 
 Example 1 - Generate a raster image with different bands from independent raster
             files:
 ./coresyf_image_stacking.py -r image_band1.tif image_band2.tif 
                             -o output_stack.tiff 
+
+Example 2 - Stack 12 monthly scenes with 4 reading threads within 512 MB:
+./coresyf_image_stacking.py -r month_*.tif -o year_stack.tif --threads=4 --memory=512
+
+Example 3 - Build a virtual stack (year_stack.vrt) without copying any data:
+./coresyf_image_stacking.py -r month_*.tif -o year_stack.vrt --vrt
  
 
 @attention: 
 - All the images must be in the same coordinate system but they may be at
 different resolutions.
 - Input rasters with more than 1 band are allowed. 
+- The --threads, --memory and --vrt options only apply when all the input 
+rasters are on the same grid (same size, geotransform and projection).
  
 
 @version: v.1.0
@@ -41,13 +51,19 @@ different resolutions.
 @change:
 1.0
 - First release of the tool. 
+1.1
+- Input rasters on the same grid are stacked in-process, block by block, with
+  a pool of reading threads and a bounded memory (--threads, --memory) instead
+  of loading them completely with "gdal_merge.py".
+- Added --vrt option to create a virtual stack.
 '''
 
-VERSION = '1.0'
+VERSION = '1.1'
 USAGE   = ( "\n"
             "coresyf_image_stacking.py [-r <InputRaster1> <InputRaster2> ...]\n"
             "                          [-o <OutputRaster>] [--o_format=<OutputFileFormat>]\n"
-            "                          [--o_type=<DataType>] [--no_data_value=<Value>]"
+            "                          [--o_type=<DataType>] [--no_data_value=<Value>]\n"
+            "                          [--threads=<Value>] [--memory=<MB>] [--vrt]"
             "\n")
 
 DefaultTypesLookup = ['Byte','UInt16','Int16','UInt32','Int32','Float32','Float64']
@@ -57,6 +73,107 @@ DefaultTypesLookup = ['Byte','UInt16','Int16','UInt32','Int32','Float32','Float6
 from optparse import OptionParser
 import sys
 import subprocess
+import os
+from multiprocessing.pool import ThreadPool
+from osgeo import gdal
+
+#==============================================================================
+#                             STACKING ENGINE
+#==============================================================================
+def same_grid(inputs):
+    """Check, from their metadata only, that all the 'inputs' datasets have the
+    same size, geotransform and projection (i.e. no resampling is needed)."""
+    first = inputs[0]
+    for data in inputs[1:]:
+        if (data.RasterXSize != first.RasterXSize or 
+            data.RasterYSize != first.RasterYSize or
+            data.GetGeoTransform() != first.GetGeoTransform() or
+            data.GetProjection() != first.GetProjection()):
+            return False
+    return True
+
+
+def read_window(args):
+    """Read a window of all the bands of an input dataset."""
+    data, yoff, ysize = args
+    return [data.GetRasterBand(i).ReadAsArray(0, yoff, data.RasterXSize, ysize)
+            for i in range(1, data.RasterCount + 1)]
+
+
+def stack_rasters(inputs, output_raster, img_format, data_type=None, no_data_value=None,
+                  threads=1, memory=256):
+    """Copy all the bands of the 'inputs' datasets (on the same grid) into the 
+    bands of 'output_raster', in windows of full rows. The windows of the next 
+    rows are read from the inputs by a pool of 'threads' while the current ones
+    are written, and their height is chosen so that both fit in 'memory' MB. 
+    As gdal_merge.py, the output type is the type of the first input band by
+    default and the colour table of the first input is kept."""
+    first = inputs[0].GetRasterBand(1)
+    data_type = data_type or first.DataType
+    nbands = sum(data.RasterCount for data in inputs)
+    width, height = inputs[0].RasterXSize, inputs[0].RasterYSize
+    
+    driver = gdal.GetDriverByName(img_format)
+    if driver is None:
+        raise Exception ("Error! Unknown output format '%s'." % img_format)
+    target = driver.Create(output_raster, width, height, nbands, data_type)
+    if target is None:
+        raise Exception ("Error! Unable to create '%s'." % output_raster)
+    target.SetGeoTransform(inputs[0].GetGeoTransform())
+    target.SetProjection(inputs[0].GetProjection())
+    if first.GetColorTable() is not None:
+        target.GetRasterBand(1).SetColorTable(first.GetColorTable())
+    if no_data_value is not None:
+        for i in range(1, nbands + 1):
+            target.GetRasterBand(i).SetNoDataValue(no_data_value)
+    
+    # Window height: two windows of all the bands (read + write) within memory,
+    # aligned with the output blocks
+    pixel_size = max([gdal.GetDataTypeSize(data.GetRasterBand(i).DataType) / 8
+                      for data in inputs for i in range(1, data.RasterCount + 1)] +
+                     [gdal.GetDataTypeSize(data_type) / 8])
+    block_ysize = target.GetRasterBand(1).GetBlockSize()[1]
+    rows = memory * 1024 * 1024 / (2 * width * nbands * pixel_size)
+    rows = max(block_ysize, rows - rows % block_ysize)
+    windows = [(yoff, min(rows, height - yoff)) for yoff in range(0, height, rows)]
+    
+    pool = ThreadPool(max(1, threads))
+    read = lambda (yoff, ysize): pool.map_async(read_window, 
+                                    [(data, yoff, ysize) for data in inputs])
+    pending = read(windows[0])
+    for w in range(0, len(windows)):
+        values = pending.get()
+        if w + 1 < len(windows):
+            pending = read(windows[w + 1])
+        band = 1
+        for data_values in values:
+            for array in data_values:
+                target.GetRasterBand(band).WriteArray(array, 0, windows[w][0])
+                band += 1
+    pool.close()
+    pool.join()
+    target.FlushCache()
+
+
+def stack_vrt(inputs, input_names, output_raster, data_type=None, no_data_value=None):
+    """Create a VRT 'output_raster' stacking all the bands of the 'inputs' 
+    datasets (on the same grid), without copying any pixel."""
+    vrt = gdal.GetDriverByName('VRT').Create(output_raster, inputs[0].RasterXSize, 
+                                              inputs[0].RasterYSize, 0)
+    vrt.SetGeoTransform(inputs[0].GetGeoTransform())
+    vrt.SetProjection(inputs[0].GetProjection())
+    data_type = data_type or inputs[0].GetRasterBand(1).DataType
+    band = 1
+    for data, name in zip(inputs, input_names):
+        for i in range(1, data.RasterCount + 1):
+            vrt.AddBand(data_type)
+            source = ('<SimpleSource><SourceFilename relativeToVRT="0">%s</SourceFilename>'
+                      '<SourceBand>%d</SourceBand></SimpleSource>' % (os.path.abspath(name), i))
+            vrt.GetRasterBand(band).SetMetadataItem('source_0', source, 'new_vrt_sources')
+            if no_data_value is not None:
+                vrt.GetRasterBand(band).SetNoDataValue(no_data_value)
+            band += 1
+    vrt.FlushCache()
 
 
 def main():
@@ -87,6 +204,20 @@ def main():
                       dest="no_data_value", metavar=' ',
                       help="output nodata value (default datatype specific value)",
                       type=int )
+    parser.add_option('--threads', 
+                      dest="threads", metavar=' ',
+                      help="number of threads reading the input files concurrently (default: 1)",
+                      default=1,
+                      type=int )
+    parser.add_option('--memory', 
+                      dest="memory", metavar=' ',
+                      help="memory budget in MB for the data being stacked (default: 256)",
+                      default=256,
+                      type=int )
+    parser.add_option("--vrt", 
+                      dest="vrt", action="store_true", 
+                      help=("create a virtual raster (VRT) stacking the input files instead of "
+                            "copying them (output extension set to .vrt)"))
     
     #==============================#
     #   Check mandatory options    #
@@ -117,9 +248,40 @@ def main():
         print(USAGE)
         return
     
+    #==================================#
+    #  Stack the input rasters in one  #
+    #  pass (when the grids match)     #
+    #==================================#
+    try:
+        inputs = [gdal.Open(name, gdal.GA_ReadOnly) for name in list_input_rasters]
+        for i in range(0, len(inputs)):
+            if inputs[i] is None:
+                raise Exception ("Error! Unable to open '%s'." % list_input_rasters[i])
+        data_type = None
+        if opts.data_type:
+            data_type = gdal.GetDataTypeByName(opts.data_type)
+        
+        if same_grid(inputs):
+            if opts.vrt:
+                output_raster = os.path.splitext(opts.output_raster)[0] + '.vrt'
+                print ("Creating virtual stack '%s'..." % output_raster)
+                stack_vrt(inputs, list_input_rasters, output_raster, data_type, 
+                          opts.no_data_value)
+            else:
+                print ("Stacking %d input rasters..." % len(inputs))
+                stack_rasters(inputs, opts.output_raster, opts.output_format, data_type,
+                              opts.no_data_value, opts.threads, opts.memory)
+            return
+        inputs = None
+    except Exception, message:
+        print( str(message) )
+        sys.exit(1)
+    
     #==================================#
     # Building gdal_merge command line #
+    # (input grids must be resampled)  #
     #==================================#
+    print ("Input rasters are not on the same grid, using gdal_merge.py...")
     gdal_exe = 'gdal_merge.py ' 
     
     output_opts = '-separate -o %s -of %s '%(opts.output_raster, opts.output_format) 
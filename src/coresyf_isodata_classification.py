@@ -27,6 +27,16 @@ into a defined number of classes.
 Example 1 - Classify a GTiff image "example" and store the output in another GTiff:
 python coresyf_isodata_classification.py -r ../examples/ISOdata_classification/example.TIF -o classified_example.tif
 
+Example 2 - Classify a mosaic larger than the available memory, block by block,
+            estimating the clusters from a random sample of 1 million pixels:
+python coresyf_isodata_classification.py -r mosaic.tif -o classified_mosaic.tif --streaming --sample_size=1000000
+
+Example 3 - Classify all the bands of a multispectral image (one feature vector
+            per pixel):
+python coresyf_isodata_classification.py -r multispectral.tif -o classified_multispectral.tif --all_bands
+
+Example 4 - Classify a scene with 32 worker processes:
+python coresyf_isodata_classification.py -r scene.tif -o classified_scene.tif --workers=32
 
 @attention: 
     @todo
@@ -40,15 +50,30 @@ python coresyf_isodata_classification.py -r ../examples/ISOdata_classification/e
 @change:
 1.0
 - First release of the tool. 
+1.1
+- Added streaming mode (--streaming): clusters statistics are reduced over the
+  raster blocks (or over a random pixel sample) and the classified image is
+  written block by block into a tiled and compressed output.
+1.2
+- Added multi-band classification (--all_bands): each pixel is classified as a
+  feature vector of all the input bands, clusters centers are vectors and the
+  distances to them are computed as matrix products. Clusters are split along
+  the band with the largest standard deviation.
+1.3
+- Added parallel mode (--workers): the raster is split into row stripes, the
+  workers compute the partial clusters statistics of their stripes, which are
+  reduced before updating the centers, and classify the stripes in parallel.
 '''
 
-VERSION = '1.0'
+VERSION = '1.3'
 USAGE   = ( '\n'
             'coresyf_isodata_classification.py [-r <InputRaster>]' 
             '[-c_threshold <ConvergenceThreshold>]'
             "[-i <IterationNumber>] [-k <InitialClusters>] [-s <StdThreshold>]"
             "[-p <PairClusters>] [-m <MinPixels>] [-c <MergeDist>]"
             "[-o <OutputRaster>] [--o_format=<OutputFileFormat>]"
+            "[--streaming] [--sample_size=<SampleSize>] [--all_bands]"
+            "[--workers=<Workers>]"
             "\n")
 
 
@@ -63,17 +88,22 @@ from scipy.cluster.vq import vq
 #from pyradar.core.sar import create_dataset_from_path
 #from scipy import misc
 import os
+import multiprocessing
 #import Image
 import numpy as np
 from osgeo import gdal
-def gdal_create_image(target_file, width, height, bands, img_format, values, geotrans, proj):
+from raster_blocks import block_windows, row_stripes, tiled_options
+def gdal_create_image(target_file, width, height, bands, img_format, values, geotrans, proj,
+                      data_type=gdal.GDT_Float32, options=None):
     """create an gdal compatible image from a 3D matrix, where 1th dimension represents the
-    bands, 2th the rows, and the 3th the lines of the image"""
+    bands, 2th the rows, and the 3th the lines of the image. If 'values' is None the
+    image is only created, to be filled afterwards (e.g. block by block)"""
     driver = gdal.GetDriverByName(img_format)
     if not driver:
         raise Exception('No gdal driver was found for %s.' % img_format)
-    dataset = driver.Create(target_file, width, height, bands, gdal.GDT_Float32)
-    dataset.GetRasterBand(1).WriteArray(values)
+    dataset = driver.Create(target_file, width, height, bands, data_type, options or [])
+    if values is not None:
+        dataset.GetRasterBand(1).WriteArray(values)
     dataset.SetGeoTransform(geotrans)
     dataset.SetProjection(proj)
     dataset.FlushCache()
@@ -449,6 +479,287 @@ def isodata_classification(img, parameters):
     img_class_flat = np.asarray(minus)
     return img_class_flat.reshape(N, M)
 
+###############################################################################
+#                          STREAMING (BLOCK BY BLOCK) MODE
+###############################################################################
+def read_features(bands, xoff, yoff, xsize, ysize, no_data_value):
+    """
+    Read a window of each of the 'bands' and stack the pixels as feature
+    vectors (one column per band).
+    Returns: - a (valid pixels, bands) array with the features of the pixels
+               without the no data value in any band.
+             - the (ysize, xsize) boolean mask of these valid pixels.
+    """
+    stack = np.array([band.ReadAsArray(xoff, yoff, xsize, ysize) for band in bands],
+                     dtype=np.float64)
+    valid = np.all(stack != no_data_value, axis=0)
+    return stack[:, valid].T, valid
+
+def valid_range(bands, no_data_value, rows=None):
+    """
+    Compute the minimum and maximum of the valid pixels of each of the 'bands',
+    reading the raster (or the 'rows' stripe) block by block.
+    """
+    minimum = np.zeros(len(bands)) + np.inf
+    maximum = np.zeros(len(bands)) - np.inf
+    for window in block_windows(bands[0], rows=rows):
+        features, _ = read_features(bands, *window, no_data_value=no_data_value)
+        if features.size:
+            minimum = np.minimum(minimum, features.min(axis=0))
+            maximum = np.maximum(maximum, features.max(axis=0))
+    return minimum, maximum
+
+def sample_pixels(bands, sample_size, no_data_value, rows=None):
+    """
+    Draw a random sample of about 'sample_size' valid pixels of the 'bands',
+    reading the raster block by block (each pixel is kept with the same
+    probability). If 'rows' is given only the pixels of that stripe are drawn,
+    with the probability computed for the whole raster.
+    """
+    ratio = min(1.0, float(sample_size) / (bands[0].XSize * bands[0].YSize))
+    sample = []
+    for window in block_windows(bands[0], rows=rows):
+        features, _ = read_features(bands, *window, no_data_value=no_data_value)
+        sample.append(features[np.random.random_sample(features.shape[0]) < ratio])
+    return np.concatenate(sample)
+
+def assign_clusters(features, centers):
+    """
+    Assign each feature vector to the closest cluster center. The squared
+    distances are expanded as |x|^2 - 2 x.c + |c|^2 so that the bulk of the
+    work is a single matrix product.
+    Returns: the index of the closest center and the distance to it.
+    """
+    dists = np.dot(features, -2 * centers.T)
+    dists += (centers ** 2).sum(axis=1)
+    labels = dists.argmin(axis=1)
+    dists = dists[np.arange(labels.size), labels] + (features ** 2).sum(axis=1)
+    return labels, np.sqrt(np.maximum(dists, 0))
+
+def cluster_statistics(features, centers):
+    """
+    Assign each of the 'features' to the closest cluster center and reduce them
+    to per cluster statistics in a single pass.
+    Returns: a tuple with the count (k), the sum (k, bands), the sum of squares
+             (k, bands) and the sum of the distances to the center (k) of the
+             features of each cluster.
+    """
+    k, dims = centers.shape
+    labels, dists = assign_clusters(features, centers)
+    count = np.bincount(labels, minlength=k).astype(np.float64)
+    total = np.zeros((k, dims))
+    sumsq = np.zeros((k, dims))
+    for dim in xrange(0, dims):
+        total[:, dim] = np.bincount(labels, weights=features[:, dim], minlength=k)
+        sumsq[:, dim] = np.bincount(labels, weights=features[:, dim] ** 2, minlength=k)
+    dist = np.bincount(labels, weights=dists, minlength=k)
+    return count, total, sumsq, dist
+
+def add_statistics(stats, other):
+    """Reduce two sets of clusters statistics (see cluster_statistics)."""
+    return tuple(a + b for a, b in zip(stats, other))
+
+def block_statistics(bands, centers, no_data_value, rows=None):
+    """
+    Reduce the clusters statistics (see cluster_statistics) over all the
+    blocks of the 'bands' (or of the 'rows' stripe), without loading the whole
+    raster in memory.
+    """
+    k, dims = centers.shape
+    stats = (np.zeros(k), np.zeros((k, dims)), np.zeros((k, dims)), np.zeros(k))
+    for window in block_windows(bands[0], rows=rows):
+        features, _ = read_features(bands, *window, no_data_value=no_data_value)
+        if features.size:
+            stats = add_statistics(stats, cluster_statistics(features, centers))
+    return stats
+
+def pairwise_distances(centers):
+    """
+    Compute the matrix of the distances between every two clusters centers.
+    """
+    sqnorm = (centers ** 2).sum(axis=1)
+    dists = sqnorm[:, np.newaxis] + sqnorm[np.newaxis, :] - 2 * np.dot(centers, centers.T)
+    return np.sqrt(np.maximum(dists, 0))
+
+def sort_centers(centers):
+    """Sort the clusters centers (lexicographic order of their coordinates)."""
+    return centers[np.lexsort(centers.T[::-1])]
+
+def statistics_step(stats, centers, parameters):
+    """
+    One Isodata iteration (discard, update, split or merge clusters) computed
+    from the clusters statistics instead of the classified image.
+    """
+    count, total, sumsq, dist = stats
+
+    # discard clusters with fewer than THETA_M pixels
+    keep = count > parameters["THETA_M"]
+    if not keep.any():
+        return centers
+    count, total, sumsq, dist = count[keep], total[keep], sumsq[keep], dist[keep]
+
+    # update clusters
+    centers = total / count[:, np.newaxis]
+    stddev = np.sqrt(np.maximum(sumsq / count[:, np.newaxis] - centers ** 2, 0))
+    avg_dists_to_clusters = dist / count
+    k = centers.shape[0]
+
+    if k <= (parameters["K"] / 2.0):  # too few clusters => split clusters
+        # split along the dimension with the largest standard deviation
+        d = (count * avg_dists_to_clusters).sum() / count.sum()
+        cluster, dim = np.unravel_index(stddev.argmax(), stddev.shape)
+        if (stddev[cluster, dim] > parameters["THETA_S"] and
+                avg_dists_to_clusters[cluster] >= d and
+                count[cluster] > (2.0 * parameters["THETA_M"])):
+            delta = np.zeros(centers.shape[1])
+            delta[dim] = stddev[cluster, dim]
+            old_cluster = centers[cluster]
+            centers = np.delete(centers, cluster, axis=0)
+            centers = np.vstack([centers, old_cluster + delta, old_cluster - delta])
+
+    elif k > (parameters["K"] * 2.0):  # too many clusters => merge clusters
+        pair_dists = pairwise_distances(centers)
+        c1, c2 = np.triu_indices(k, 1)
+        order = np.argsort(pair_dists[c1, c2])
+        merged = np.zeros(k, dtype=bool)
+        to_add = []
+        for c1, c2 in zip(c1[order], c2[order])[:parameters["P"]]:
+            if pair_dists[c1, c2] >= parameters["THETA_C"] or merged[c1] or merged[c2]:
+                continue
+            value = (count[c1] * centers[c1] + count[c2] * centers[c2]) / (count[c1] + count[c2])
+            to_add.append(value)
+            merged[c1] = merged[c2] = True
+        if to_add:
+            centers = np.vstack([centers[~merged]] + to_add)
+
+    return sort_centers(centers)
+
+def isodata_streaming(bands, parameters, sample_size=0, pool=None, stripes=None):
+    """
+    Estimate the Isodata clusters centers (one row per cluster, one column per
+    band) of the 'bands' without loading them in memory. At each iteration the
+    clusters statistics are either reduced over all the raster blocks
+    (sample_size=0) or computed over a random sample of 'sample_size' pixels
+    drawn once before the first iteration.
+    If a 'pool' of workers (see open_pool) is given, the raster is read by the
+    workers, one row stripe of 'stripes' at a time, and the partial statistics
+    of the stripes are reduced here before computing the new centers.
+    """
+    no_data_value = parameters["no_data_value"]
+    if pool is None:
+        if sample_size:
+            sample = sample_pixels(bands, sample_size, no_data_value)
+        else:
+            minimum, maximum = valid_range(bands, no_data_value)
+        statistics = lambda centers: block_statistics(bands, centers, no_data_value)
+    else:
+        if sample_size:
+            sample = np.concatenate(pool.map(stripe_sample,
+                        [(rows, sample_size, no_data_value) for rows in stripes]))
+        else:
+            ranges = pool.map(stripe_range, [(rows, no_data_value) for rows in stripes])
+            minimum = np.min([stripe[0] for stripe in ranges], axis=0)
+            maximum = np.max([stripe[1] for stripe in ranges], axis=0)
+        statistics = lambda centers: reduce(add_statistics, pool.map(stripe_statistics,
+                        [(rows, centers, no_data_value) for rows in stripes]))
+    if sample_size:
+        statistics = lambda centers: cluster_statistics(sample, centers)
+        minimum, maximum = sample.min(axis=0), sample.max(axis=0)
+
+    k = parameters["K"]
+    print "Isodata(info): Starting algorithm with %s classes" % k
+    # initial centers evenly spread along the diagonal of the features range
+    steps = np.linspace(0, 1, k)[:, np.newaxis]
+    centers = minimum + steps * (maximum - minimum)
+
+    for iter in xrange(0, parameters["I"]):
+        last_centers = centers.copy()
+        centers = statistics_step(statistics(centers), centers, parameters)
+        if quit_low_change_in_clusters(centers, last_centers, iter, parameters["THETA_O"]):
+            break
+
+    print "Isodata(info): Finished with %s classes" % centers.shape[0]
+    print "Isodata(info): Number of Iterations: %s" % (iter + 1)
+    return centers
+
+def classify_stripe(bands, centers, no_data_value, rows=None):
+    """
+    Return the index of the closest cluster center of each pixel of the 'bands'
+    (-1 for no data pixels) for the 'rows' stripe (whole raster by default),
+    computed block by block.
+    """
+    yoff, ysize = rows or (0, bands[0].YSize)
+    img_class = np.zeros((ysize, bands[0].XSize), dtype=np.int16) - 1
+    for window in block_windows(bands[0], rows=rows):
+        xoff, y, xsize, ysize = window
+        features, valid = read_features(bands, *window, no_data_value=no_data_value)
+        if features.size:
+            block = img_class[y - yoff:y - yoff + ysize, xoff:xoff + xsize]
+            block[valid], _ = assign_clusters(features, centers)
+    return img_class
+
+def classify_blocks(bands, target_band, centers, no_data_value, pool=None, stripes=None):
+    """
+    Write into 'target_band' the index of the closest cluster center of each
+    pixel of the 'bands' (-1 for no data pixels), block by block. If a 'pool'
+    of workers is given, the row 'stripes' are classified in parallel by the
+    workers and written here as they are completed.
+    """
+    if pool is None:
+        for window in block_windows(bands[0]):
+            features, valid = read_features(bands, *window, no_data_value=no_data_value)
+            img_class = np.zeros(valid.shape, dtype=np.int16) - 1
+            if features.size:
+                img_class[valid], _ = assign_clusters(features, centers)
+            target_band.WriteArray(img_class, window[0], window[1])
+    else:
+        tasks = [(rows, centers, no_data_value) for rows in stripes]
+        for rows, img_class in pool.imap_unordered(stripe_classes, tasks):
+            target_band.WriteArray(img_class, 0, rows[0])
+    target_band.FlushCache()
+
+#==============================================================================
+#                         PARALLEL (ROW STRIPES) MODE
+#==============================================================================
+# Number of row stripes per worker, so that the workers are kept busy when the
+# stripes do not take the same time to process (e.g. no data areas).
+STRIPES_PER_WORKER = 4
+
+# Input bands opened by each worker process (see init_worker).
+worker_bands = None
+
+def init_worker(input_raster, nbands):
+    """
+    Open the input raster in a worker process. GDAL datasets cannot be shared
+    between processes, so each worker reads the raster with its own handle.
+    """
+    global worker_dataset, worker_bands
+    np.random.seed()  # the forked workers would draw the same samples otherwise
+    worker_dataset = gdal.Open(input_raster)
+    worker_bands = [worker_dataset.GetRasterBand(i) for i in xrange(1, nbands + 1)]
+
+def stripe_range((rows, no_data_value)):
+    return valid_range(worker_bands, no_data_value, rows)
+
+def stripe_sample((rows, sample_size, no_data_value)):
+    return sample_pixels(worker_bands, sample_size, no_data_value, rows)
+
+def stripe_statistics((rows, centers, no_data_value)):
+    return block_statistics(worker_bands, centers, no_data_value, rows)
+
+def stripe_classes((rows, centers, no_data_value)):
+    return rows, classify_stripe(worker_bands, centers, no_data_value, rows)
+
+def open_pool(input_raster, bands, workers):
+    """
+    Start a pool of 'workers' processes reading the 'bands' of 'input_raster'
+    and split the raster into the row stripes distributed among them.
+    Returns: the pool and the list of (yoff, ysize) stripes.
+    """
+    pool = multiprocessing.Pool(workers, init_worker, (input_raster, len(bands)))
+    stripes = row_stripes(bands[0], workers * STRIPES_PER_WORKER)
+    return pool, stripes
+
 def main():
     parser = OptionParser(usage   = USAGE, 
                           version = VERSION)
@@ -471,36 +782,63 @@ def main():
     parser.add_option('--c_threshold', 
                       dest="convergence_threshold", metavar=' ',
                       help="Threshold of the change allowed in the clusters between each iteration (default: 0.01)",
+                      type=float,
                       default=0.01 )
     parser.add_option('-i', 
                       dest="iteration_number", metavar=' ',
                       help="Maximum number of iterations (default: 100)",
+                      type=int,
                       default=100 )
     parser.add_option('-k', 
                       dest="initial_clusters", metavar=' ',
                       help="Number of initial clusters (default: 15)",
+                      type=int,
                       default=15 )
     parser.add_option('-s', 
                       dest="std_threshold", metavar=' ',
                       help="Threshold value for standard deviation, to split the clusters (default: 0.1)",
+                      type=float,
                       default=0.1 )
     parser.add_option('-p', 
                       dest="pair_clusters", metavar=' ',
                       help="Maximum number of pairs of clusters which can be merged (default: 2)",
+                      type=int,
                       default=2 )
     parser.add_option('-m', 
                       dest="min_pixels", metavar=' ',
                       help="Minimum number of pixels in each cluster (default: 10)",
+                      type=int,
                       default=10 )
     parser.add_option('-c', 
                       dest="merge_dist", metavar=' ',
                       help="Maximum distance between clusters before merging (default: 2)",
+                      type=float,
                       default=2 )
     parser.add_option('--no_data_value', 
                       dest="no_data_value", metavar=' ',
                       help="Pixel value excluded from the classification (default: 0)",
                       type=int,
                       default=0 )
+    parser.add_option("--streaming", 
+                      dest="streaming", action="store_true", 
+                      help=("process the raster block by block, for images larger "
+                            "than the available memory (tiled and compressed output)"))
+    parser.add_option('--sample_size', 
+                      dest="sample_size", metavar=' ',
+                      help=("Number of random pixels used to estimate the clusters in "
+                            "streaming mode (default: 0, all the pixels are used)"),
+                      type=int,
+                      default=0 )
+    parser.add_option("--all_bands", 
+                      dest="all_bands", action="store_true", 
+                      help=("classify the pixels as feature vectors of all the input "
+                            "bands (default: only the first band is classified)"))
+    parser.add_option('--workers', 
+                      dest="workers", metavar=' ',
+                      help=("Number of worker processes classifying row stripes of the "
+                            "raster in parallel (default: 1)"),
+                      type=int,
+                      default=1 )
 
     #==============================#
     #   Check mandatory options    #
@@ -524,9 +862,28 @@ def main():
     height=data.RasterYSize
     geotrans=data.GetGeoTransform()  
     proj=data.GetProjection() 
-    dataset = np.array(data.GetRasterBand(1).ReadAsArray())
     target_file=opts.output_raster_classified
     img_format=opts.output_format
+
+    if opts.streaming or opts.all_bands or opts.workers > 1:
+        nbands = data.RasterCount if opts.all_bands else 1
+        bands = [data.GetRasterBand(i) for i in xrange(1, nbands + 1)]
+        options = tiled_options(img_format)
+        pool, stripes = None, None
+        if opts.workers > 1:
+            pool, stripes = open_pool(opts.input_raster, bands, opts.workers)
+            if img_format == 'GTiff':
+                options.append('NUM_THREADS=%d' % opts.workers)  # parallel compression
+        centers = isodata_streaming(bands, params, opts.sample_size, pool, stripes)
+        target = gdal_create_image(target_file, width, height, 1, img_format, None, geotrans, proj,
+                                   gdal.GDT_Int16, options)
+        classify_blocks(bands, target.GetRasterBand(1), centers, opts.no_data_value, pool, stripes)
+        if pool is not None:
+            pool.close()
+            pool.join()
+        return
+
+    dataset = np.array(data.GetRasterBand(1).ReadAsArray())
     class_image = isodata_classification(dataset, parameters=params)
     #print(np.unique(class_image))
     gdal_create_image(target_file, width, height, 1, img_format, class_image, geotrans, proj)
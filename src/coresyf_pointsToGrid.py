@@ -19,11 +19,14 @@
 @summary: 
 This module runs the following Co-ReSyF tool:
  - POINT MEASUREMENTS TO GRIDDED MAPS
-It uses the GDAL raster utility program "gdal_grid.py" to create a regular grid
-(raster image) from scattered data (Point measurements) read from OGR 
-datasource (http://www.gdal.org/ogr_formats.html). Input data will be 
-interpolated to fill grid nodes with values. The user can choose from various
-interpolation algorithms.
+It creates a regular grid (raster image) from scattered data (Point 
+measurements) read from OGR datasource (http://www.gdal.org/ogr_formats.html),
+with the same algorithms and defaults of the GDAL raster utility program 
+"gdal_grid". Input data will be interpolated to fill grid nodes with values. 
+The user can choose from various interpolation algorithms. The points are 
+indexed with a KD-tree (the linear interpolation uses a Delaunay triangulation
+built once) and the grid is interpolated by blocks of rows, optionally in 
+parallel processes.
 
 @example:
 Example 1 - Create a raster TIFF from a shapefile with point measurements. The 
@@ -38,13 +41,21 @@ Example 2 - Create a raster TIFF from a text file with a list of comma separated
 ./coresyf_pointsToGrid.py -s points.vrt -a nearest
                           -o elev_raster_nearest_pts.tif --o_xsize=500 --o_ysize=500
 
+Example 3 - Grid a bathymetric survey with the inverse distance of the 12 
+            nearest soundings within 50 m, using 8 processes:
+./coresyf_pointsToGrid.py -s soundings.shp --s_field="depth" -a invdist 
+                          --radius=50 --max_points=12 --workers=8
+                          -o bathymetry.tif --o_xsize=4000 --o_ysize=3000
+
 @attention: 
   - The interpolation algorithm "nearest" seems to yield good results. Explore
     others... 
   - Besides the interpolation functionality "gdal_grid" can be used to compute 
     some data metrics using the specified window and output grid geometry.
-  @todo: 
-  - Add options for configuring the parameters of each interpolation algorithm.
+  - The search area of the neighbours is a circle (--radius), not an ellipse
+    as in "gdal_grid". Without --radius and --max_points the "invdist" 
+    algorithm uses all the points for each grid node (as "gdal_grid"), which
+    is slow for large datasets.
 
 
 @version: v.1.0
@@ -53,15 +64,24 @@ Example 2 - Create a raster TIFF from a text file with a list of comma separated
 @change:
 1.0
 - First release of the tool. 
+1.1
+- The grid is interpolated in-process instead of running "gdal_grid": points
+  are indexed with a KD-tree, grid nodes are processed by blocks of rows in 
+  parallel processes (--workers) and the linear interpolation uses a cached 
+  Delaunay triangulation.
+- Added options for the parameters of the interpolation algorithms (--power,
+  --smoothing, --radius, --max_points, --min_points).
 '''
 
-VERSION = '1.0'
+VERSION = '1.1'
 USAGE   = ( '\n'
             'coresyf_pointsToGrid.py [-s <InputOGRdatasource>] [--s_field=<AttributeFieldName>]\n'
             '                        [-a <InterpolationAlgorithmName>]\n'
             "                        [-o <OutputRaster>] [--o_format=<OutputFileFormat>]\n"
             "                        [--o_xsize=<OutputSizeX>] [--o_ysize=<OutputSizeY>]\n"
-            "                        [--o_type=<DataType>] [--no_data_value=<Value>]" 
+            "                        [--o_type=<DataType>] [--no_data_value=<Value>]\n"
+            "                        [--power=<Value>] [--smoothing=<Value>] [--radius=<Value>]\n"
+            "                        [--max_points=<Value>] [--min_points=<Value>] [--workers=<Value>]" 
             "\n")
 
 DefaultTypesLookup = ['Byte','UInt16','Int16','UInt32','Int32','Float32','Float64']
@@ -71,7 +91,293 @@ InterpolationAlgo  = [ "invdist", "invdistnn", "average", "nearest", "linear"]
 ''' SYSTEM MODULES '''
 from optparse import OptionParser
 import sys
-import subprocess
+import os
+import multiprocessing
+import numpy as np
+from scipy.spatial import cKDTree, Delaunay
+from osgeo import gdal, ogr
+
+
+#==============================================================================
+#                           INTERPOLATION ENGINE
+#==============================================================================
+# Default parameters of each algorithm (the same used by gdal_grid). A radius
+# of 0 means no distance limit, except for "average" (only the points at the
+# grid node) and "linear" (no nearest point search outside the triangulation,
+# where -1 means no distance limit).
+DefaultAlgoParams = {
+    'invdist':   {'power': 2.0, 'smoothing': 0.0, 'radius': 0.0, 'max_points': 0,  'min_points': 0},
+    'invdistnn': {'power': 2.0, 'smoothing': 0.0, 'radius': 1.0, 'max_points': 12, 'min_points': 0},
+    'average':   {'radius': 0.0, 'max_points': 0, 'min_points': 0},
+    'nearest':   {'radius': 0.0},
+    'linear':    {'radius': -1.0}, }
+
+# Number of grid nodes interpolated at once (the rows of a block)
+BLOCK_NODES = 65536
+
+# Maximum number of (node, point) distances computed at once when all the points
+# are used for each grid node (the memory used does not depend on the grid size
+# nor on the number of points)
+MAX_PAIRS = 1000000
+
+# Points, KD-tree (and triangulation) and grid geometry shared with the worker
+# processes (see setup_grid)
+grid = {}
+
+
+def read_points(input_source, source_field=None):
+    """Read the X, Y and Z values of the point features of the layer of
+    'input_source' with the same name (or of its first layer). The Z values
+    are read from the 'source_field' attribute or from the geometry.
+    Returns: the X, Y and Z arrays and the spatial reference of the layer."""
+    source = ogr.Open(input_source)
+    if source is None:
+        raise Exception ("Error! Unable to open '%s'." % input_source)
+    layer = source.GetLayerByName(os.path.splitext(os.path.basename(input_source))[0])
+    if layer is None:
+        layer = source.GetLayer(0)
+    values = []
+    for feature in layer:
+        geometry = feature.GetGeometryRef()
+        if geometry is None:
+            continue
+        if source_field:
+            z = feature.GetFieldAsDouble(source_field)
+        else:
+            z = geometry.GetZ()
+        values.append((geometry.GetX(), geometry.GetY(), z))
+    if not values:
+        raise Exception ("Error! No points found in '%s'." % input_source)
+    values = np.array(values, dtype=np.float64)
+    return values[:, 0], values[:, 1], values[:, 2], layer.GetSpatialRef()
+
+
+def setup_grid(x, y, z, algorithm, params, x_size, y_size, no_data_value):
+    """Index the points and define the output grid (covering the extent of the
+    points, as gdal_grid). The KD-tree and the triangulation are built only
+    once and inherited by the worker processes.
+    Returns: the geotransform of the grid."""
+    grid.clear()
+    grid.update(params)
+    dx = (x.max() - x.min()) / x_size
+    dy = (y.max() - y.min()) / y_size
+    grid['algorithm'] = algorithm
+    grid['no_data_value'] = no_data_value
+    grid['z'] = z
+    grid['points'] = np.column_stack((x, y))
+    grid['tree'] = cKDTree(grid['points'])
+    if algorithm == 'linear':
+        grid['triangulation'] = Delaunay(grid['points'])
+    grid['geotransform'] = (x.min(), dx, 0.0, y.min(), 0.0, dy)
+    grid['size'] = (x_size, y_size)
+    return grid['geotransform']
+
+
+def grid_nodes(yoff, ysize):
+    """Return the (x, y) coordinates of the grid nodes (pixel centers) of the
+    'ysize' rows starting at 'yoff'."""
+    x0, dx, _, y0, _, dy = grid['geotransform']
+    cols = x0 + (np.arange(grid['size'][0]) + 0.5) * dx
+    rows = y0 + (np.arange(yoff, yoff + ysize) + 0.5) * dy
+    xx, yy = np.meshgrid(cols, rows)
+    return np.column_stack((xx.ravel(), yy.ravel()))
+
+
+def neighbour_pairs(nodes):
+    """Find the points used for each grid node, according to the 'radius' and
+    'max_points' parameters (at least one of them limits the neighbours, see
+    accumulate_all_points otherwise).
+    Returns: the flat arrays of the (node index, point index, distance) pairs."""
+    tree = grid['tree']
+    radius = grid['radius']
+    if grid['max_points'] > 0:
+        # nearest max_points points (within the radius)
+        dists, points = tree.query(nodes, k=grid['max_points'],
+                                   distance_upper_bound=radius if radius > 0 else np.inf)
+        dists = dists.reshape(len(nodes), -1)
+        points = points.reshape(len(nodes), -1)
+        node = np.repeat(np.arange(len(nodes)), dists.shape[1])
+        dists, points = dists.ravel(), points.ravel()
+        found = np.isfinite(dists)
+        return node[found], points[found], dists[found]
+
+    # all the points within the radius
+    pairs = cKDTree(nodes).sparse_distance_matrix(tree, radius, output_type='ndarray')
+    return pairs['i'], pairs['j'], pairs['v']
+
+
+def pair_sums(nnodes):
+    """Accumulators of the interpolation of 'nnodes' grid nodes: sums of the
+    weighted values (values for "average") and of the weights, number of 
+    points and value of the point at the grid node (nan if none)."""
+    return {'wz': np.zeros(nnodes), 'w': np.zeros(nnodes),
+            'count': np.zeros(nnodes, dtype=np.int64),
+            'exact': np.full(nnodes, np.nan)}
+
+
+def power_weights(dist2):
+    """Inverse distance to a power weights of the squared distances 'dist2'
+    (0 for the points at the grid node, flagged in the returned mask)."""
+    dist2 = dist2 + grid['smoothing'] ** 2
+    exact = dist2 == 0
+    weights = 1.0 / np.where(exact, 1.0, dist2) ** (grid['power'] / 2.0)
+    weights[exact] = 0
+    return weights, exact
+
+
+def accumulate_pairs(sums, node, points, dists):
+    """Add the (node, point, distance) pairs to the accumulators 'sums' of the
+    "invdist"/"invdistnn" (inverse distance to a power) or the "average" 
+    (moving average) algorithm."""
+    nnodes = len(sums['count'])
+    z = grid['z'][points]
+    sums['count'] += np.bincount(node, minlength=nnodes)
+    if grid['algorithm'] == 'average':
+        sums['wz'] += np.bincount(node, weights=z, minlength=nnodes)
+        return
+    weights, exact = power_weights(dists ** 2)
+    sums['wz'] += np.bincount(node, weights=weights * z, minlength=nnodes)
+    sums['w'] += np.bincount(node, weights=weights, minlength=nnodes)
+    if exact.any():
+        # first point (lowest index) at each grid node, as gdal_grid
+        node, points = node[exact], points[exact]
+        order = np.lexsort((points, node))
+        node, points = node[order], points[order]
+        first = np.concatenate(([True], node[1:] != node[:-1]))
+        sums['exact'][node[first]] = grid['z'][points[first]]
+
+
+def accumulate_all_points(sums, nodes):
+    """Add all the points to the accumulators 'sums' of the "invdist" 
+    algorithm, by chunks of grid nodes (at most MAX_PAIRS distances at once,
+    each chunk reduced before computing the next one)."""
+    x, y = grid['points'][:, 0], grid['points'][:, 1]
+    z = grid['z']
+    chunk = max(1, MAX_PAIRS // len(z))
+    for start in xrange(0, len(nodes), chunk):
+        part = slice(start, start + chunk)
+        dist2 = ((nodes[part, 0, np.newaxis] - x) ** 2 +
+                 (nodes[part, 1, np.newaxis] - y) ** 2)
+        weights, exact = power_weights(dist2)
+        sums['count'][part] += len(z)
+        sums['wz'][part] += weights.dot(z)
+        sums['w'][part] += weights.sum(axis=1)
+        hit = np.flatnonzero(exact.any(axis=1))
+        if len(hit):
+            # first point (lowest index) at each grid node, as gdal_grid
+            sums['exact'][start + hit] = z[exact[hit].argmax(axis=1)]
+
+
+def pair_values(sums):
+    """Interpolated values of the grid nodes from their accumulators 'sums'
+    (no data value with less than 'min_points' points)."""
+    with np.errstate(invalid='ignore', divide='ignore'):
+        if grid['algorithm'] == 'average':
+            values = sums['wz'] / sums['count']
+        else:
+            values = sums['wz'] / sums['w']
+    # grid nodes matching a point get its value
+    exact = ~np.isnan(sums['exact'])
+    values[exact] = sums['exact'][exact]
+    values[sums['count'] < max(1, grid['min_points'])] = grid['no_data_value']
+    return values
+
+
+def interpolate_nearest(nodes, radius):
+    """Value of the nearest point of each grid node (no data beyond 'radius')."""
+    dists, points = grid['tree'].query(nodes, distance_upper_bound=radius)
+    values = np.zeros(len(nodes)) + grid['no_data_value']
+    found = np.isfinite(dists)
+    values[found] = grid['z'][points[found]]
+    return values
+
+
+def interpolate_linear(nodes):
+    """Linear interpolation in the triangles of the Delaunay triangulation of
+    the points. Outside the triangulation, the value of the nearest point
+    within 'radius' (-1: no limit, 0: always no data)."""
+    triangulation = grid['triangulation']
+    simplex = triangulation.find_simplex(nodes)
+    inside = simplex >= 0
+    values = np.zeros(len(nodes)) + grid['no_data_value']
+
+    transform = triangulation.transform[simplex[inside]]
+    delta = nodes[inside] - transform[:, 2]
+    bary = np.einsum('ijk,ik->ij', transform[:, :2], delta)
+    weights = np.column_stack((bary, 1 - bary.sum(axis=1)))
+    vertices = triangulation.simplices[simplex[inside]]
+    values[inside] = (grid['z'][vertices] * weights).sum(axis=1)
+
+    radius = grid['radius']
+    if radius != 0 and not inside.all():
+        outside = ~inside
+        values[outside] = interpolate_nearest(nodes[outside],
+                                              np.inf if radius < 0 else radius)
+    return values
+
+
+def interpolate_rows(rows):
+    """Interpolate the grid nodes of the (yoff, ysize) 'rows'.
+    Returns: the 'rows' and the (ysize, x size) array of interpolated values."""
+    yoff, ysize = rows
+    nodes = grid_nodes(yoff, ysize)
+    algorithm = grid['algorithm']
+    if algorithm == 'nearest':
+        radius = grid['radius']
+        values = interpolate_nearest(nodes, radius if radius > 0 else np.inf)
+    elif algorithm == 'linear':
+        values = interpolate_linear(nodes)
+    else:
+        sums = pair_sums(len(nodes))
+        if grid['max_points'] > 0 or grid['radius'] > 0 or algorithm == 'average':
+            accumulate_pairs(sums, *neighbour_pairs(nodes))
+        else:
+            accumulate_all_points(sums, nodes)
+        values = pair_values(sums)
+    return rows, values.reshape(ysize, grid['size'][0])
+
+
+def grid_points(input_source, source_field, algorithm, params, output_raster,
+                img_format, x_size, y_size, data_type=None, no_data_value=None,
+                workers=1):
+    """Interpolate the points of 'input_source' into a 'x_size' by 'y_size'
+    grid written to 'output_raster', by blocks of rows (computed by 'workers'
+    processes)."""
+    x, y, z, srs = read_points(input_source, source_field)
+    print ("Interpolating %d points with '%s' algorithm..." % (len(z), algorithm))
+    if no_data_value is None:
+        no_data_value = 0
+    geotransform = setup_grid(x, y, z, algorithm, params, x_size, y_size, no_data_value)
+
+    driver = gdal.GetDriverByName(img_format)
+    if driver is None:
+        raise Exception ("Error! Unknown output format '%s'." % img_format)
+    if data_type:
+        data_type = gdal.GetDataTypeByName(data_type)
+    target = driver.Create(output_raster, x_size, y_size, 1, data_type or gdal.GDT_Float64)
+    if target is None:
+        raise Exception ("Error! Unable to create '%s'." % output_raster)
+    target.SetGeoTransform(geotransform)
+    if srs is not None:
+        target.SetProjection(srs.ExportToWkt())
+    band = target.GetRasterBand(1)
+    band.SetNoDataValue(no_data_value)
+
+    block_rows = max(1, BLOCK_NODES // x_size)
+    blocks = [(yoff, min(block_rows, y_size - yoff)) for yoff in xrange(0, y_size, block_rows)]
+    if workers > 1:
+        # the worker processes inherit the points index (see setup_grid)
+        pool = multiprocessing.Pool(workers)
+        results = pool.imap_unordered(interpolate_rows, blocks)
+    else:
+        pool = None
+        results = (interpolate_rows(rows) for rows in blocks)
+    for (yoff, ysize), values in results:
+        band.WriteArray(values, 0, yoff)
+    if pool is not None:
+        pool.close()
+        pool.join()
+    band.FlushCache()
 
 
 def main():
@@ -128,6 +434,33 @@ def main():
                       help="Set the Y dimension size of the output file in pixels (default: 250)",
                       default="250",
                       type=int )
+    parser.add_option('--power',
+                      dest="power", metavar=' ',
+                      help="Weighting power of 'invdist' and 'invdistnn' algorithms (default: 2)",
+                      type=float )
+    parser.add_option('--smoothing',
+                      dest="smoothing", metavar=' ',
+                      help="Smoothing parameter of 'invdist' and 'invdistnn' algorithms (default: 0)",
+                      type=float )
+    parser.add_option('--radius',
+                      dest="radius", metavar=' ',
+                      help=("Radius of the search circle of the points used for each grid node "
+                            "(default: 1 for 'invdistnn', -1 for 'linear', 0 otherwise)"),
+                      type=float )
+    parser.add_option('--max_points',
+                      dest="max_points", metavar=' ',
+                      help=("Maximum number of points used for each grid node (default: 12 for "
+                            "'invdistnn', 0 for no limit otherwise)"),
+                      type=int )
+    parser.add_option('--min_points',
+                      dest="min_points", metavar=' ',
+                      help="Minimum number of points used for each grid node (default: 0)",
+                      type=int )
+    parser.add_option('--workers',
+                      dest="workers", metavar=' ',
+                      help="Number of processes interpolating blocks of rows in parallel (default: 1)",
+                      default=1,
+                      type=int )
  
 
     #==============================#
@@ -150,51 +483,24 @@ def main():
         print("WARNING: No attribute field provided. Z value will be read from feature geometry!")  
     
     #=================================#
-    # Building gdal_grid command line #
+    #   Algorithm parameters options  #
     #=================================#
-    gdal_exe    = 'gdal_grid '
-
-    algo_opts = '-a %s' % opts.interpolation_algorithm
-    if opts.no_data_value != None:
-        algo_opts += ':nodata=%d ' % opts.no_data_value
-    else:
-        algo_opts += ' '
-    
-    if opts.source_field:
-        algo_opts += '-zfield "%s" ' % opts.source_field 
-
-    output_opts = '-outsize %d %d -of %s ' % (opts.x_size,
-                                              opts.y_size,
-                                              opts.output_format)
-    if opts.data_type:
-        output_opts += '-ot %s ' % opts.data_type 
+    params = dict(DefaultAlgoParams[opts.interpolation_algorithm])
+    for name in ('power', 'smoothing', 'radius', 'max_points', 'min_points'):
+        if getattr(opts, name) is not None:
+            params[name] = getattr(opts, name)
 
-    input_opts = '-l %s %s ' % (opts.input_source.split('.')[0],
-                                opts.input_source)
-    
-    
-    gdalgrid_command = gdal_exe + algo_opts + output_opts + input_opts + opts.output_raster
-    
-    #============================#
-    # Run gdal_grid command line #
-    #============================#
-    print('\n' + gdalgrid_command)
-    print("\nRunning using Python version %s.%s.%s..." % sys.version_info[:3])
-    
+    #=================================#
+    #     Interpolate the points      #
+    #=================================#
     try:
-        process = subprocess.Popen( gdalgrid_command,
-                                    shell  = True,
-                                    stdin  = subprocess.PIPE,
-                                    stdout = subprocess.PIPE,
-                                    stderr = subprocess.PIPE, )
-        # Reads the output and waits for the process to exit before returning
-        stdout, stderr = process.communicate()   
-        print (stdout) 
-        if stderr:      raise Exception (stderr)  # or  if process.returncode:
+        grid_points(opts.input_source, opts.source_field, opts.interpolation_algorithm,
+                    params, opts.output_raster, opts.output_format, opts.x_size,
+                    opts.y_size, opts.data_type, opts.no_data_value, opts.workers)
     except Exception, message:
         print( str(message) )
-        sys.exit(process.returncode)
+        sys.exit(1)
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -26,12 +26,23 @@ Therefore, any value within the interval is equally likely to appear within the
 raster image.
 It uses the "numpy", "GDAL", and "h5py" Python modules to generate raster images in
 different formats: GeoTIFF, IMG (Erdas file type) or netCDF and HDF.
+The image is generated and written block by block (tiled and compressed GeoTIFF,
+chunked HDF5), with a seeded random generator, so that very large images can be
+created. It can also generate swell like sinusoidal fields.
 
 
 @example:
 Example 1 - Create a random raster image and save the output into GeoTIFF format:
 ./coresyf_randRasterGen.py --min=0 --max=1 -o myrandomraster.tif
 
+Example 2 - Create a reproducible 50000x50000 Byte raster (tiled and compressed):
+./coresyf_randRasterGen.py --width=50000 --height=50000 --o_type=Byte --seed=42 -o big.tif
+
+Example 3 - Create a swell like field with a 120 pixels wavelength propagating
+            towards 30 degrees (clockwise from the top of the image):
+./coresyf_randRasterGen.py --width=2000 --height=2000 --pattern=swell --wavelength=120
+                           --direction=30 -o swell.tif
+
 
 @attention:
   @todo:
@@ -44,19 +55,32 @@ Example 1 - Create a random raster image and save the output into GeoTIFF format
 @change:
 1.0
 - First release of the tool.
+1.1
+- The image is generated and written by blocks (tiled and compressed output),
+  with a seeded generator (--seed) and the chosen data type (--o_type).
+- Added swell like sinusoidal pattern (--pattern, --wavelength, --direction,
+  --noise).
 '''
 
 from os.path import basename, splitext
 from argparse import ArgumentParser
-from numpy.random import uniform
-from osgeo import gdal
+import numpy as np
+from osgeo import gdal, gdal_array
 import h5py
+from raster_blocks import tiled_options
 
 
 
-VERSION = '1.0'
+VERSION = '1.1'
 
 OUTPUT_FORMATS = ['GTiff', 'HFA', 'netCDF', 'HDF5']
+OUTPUT_TYPES = ['Byte', 'UInt16', 'Int16', 'UInt32', 'Int32', 'Float32', 'Float64']
+PATTERNS = ['uniform', 'swell']
+
+# Height (in rows) of the tiles/chunks of the output files and maximum number of
+# pixels generated at once (the image is generated by stripes of whole tiles)
+BLOCK_ROWS = 256
+CHUNK_PIXELS = 2 ** 24
 
 
 def main():
@@ -101,6 +125,37 @@ def main():
                         help=("The max value."),
                         default="255",
                         type=int)
+    parser.add_argument('--o_type',
+                        dest="data_type",
+                        help="The output data type.",
+                        default='Float32',
+                        choices=OUTPUT_TYPES)
+    parser.add_argument('--seed',
+                        dest="seed",
+                        help=("The seed of the random generator (default: random)."),
+                        type=int)
+    parser.add_argument('--pattern',
+                        dest="pattern",
+                        help=("The pattern of the pixel values: uniform random values or a "
+                              "swell like sinusoidal field."),
+                        default='uniform',
+                        choices=PATTERNS)
+    parser.add_argument('--wavelength',
+                        dest="wavelength",
+                        help=("The wavelength of the swell pattern (in pixels)."),
+                        default=100.0,
+                        type=float)
+    parser.add_argument('--direction',
+                        dest="direction",
+                        help=("The direction of propagation of the swell pattern (degrees "
+                              "clockwise from the top of the image)."),
+                        default=0.0,
+                        type=float)
+    parser.add_argument('--noise',
+                        dest="noise",
+                        help=("The fraction of uniform noise added to the swell pattern."),
+                        default=0.1,
+                        type=float)
 
     opts = parser.parse_args()
     #==============================#
@@ -112,36 +167,94 @@ def main():
 
     print 'generating image...'
     generate_image(opts.target_file, opts.bands, opts.width, opts.height, opts.min, opts.max,
-                   opts.format)
+                   opts.format, opts.data_type, opts.seed, opts.pattern, opts.wavelength,
+                   opts.direction, opts.noise)
     print 'finished'
 
-def generate_image(target_file, bands, width, height, minimum, maximum, img_format):
-    """generate an synthetic raster image band
-    with each pixel value drawn from a uniform distribution."""
-    values = uniform(minimum, maximum, [bands, height, width])
+def generate_image(target_file, bands, width, height, minimum, maximum, img_format,
+                   data_type='Float32', seed=None, pattern='uniform', wavelength=100.0,
+                   direction=0.0, noise=0.1):
+    """generate an synthetic raster image, block by block (stripes of rows), so
+    that the image size is not limited by the available memory. The pixel values
+    are drawn from a uniform distribution ('uniform' pattern) or follow a swell
+    like sinusoidal field ('swell' pattern, see swell_block)."""
+    if seed is None:
+        seed = np.random.randint(2 ** 31)
+    if pattern == 'swell':
+        block_function = lambda rng, yoff, rows: swell_block(
+            rng, yoff, rows, width, minimum, maximum, wavelength, direction, noise)
+    else:
+        block_function = lambda rng, yoff, rows: rng.uniform(minimum, maximum, [rows, width])
+    dtype = gdal_array.GDALTypeCodeToNumericTypeCode(gdal.GetDataTypeByName(data_type))
+    block_rows = max(BLOCK_ROWS, CHUNK_PIXELS // width // BLOCK_ROWS * BLOCK_ROWS)
+    blocks = generate_blocks(bands, height, block_rows, block_function, seed, dtype)
     if img_format == 'HDF5':
-        h5py_create_image(target_file, values)
+        h5py_create_image(target_file, blocks, (bands, height, width), dtype)
     else:
-        gdal_create_image(target_file, width, height, bands, img_format, values)
+        gdal_create_image(target_file, width, height, bands, img_format, blocks,
+                          gdal.GetDataTypeByName(data_type), tiled_options(img_format))
 
-def h5py_create_image(target_file, values):
+def generate_blocks(bands, height, block_rows, block_function, seed, dtype):
+    """yield the (band, yoff, values) stripes of 'block_rows' rows of an image,
+    generated by block_function(rng, yoff, rows). Each stripe has its own
+    random generator seeded from ('seed', band, yoff), so that any stripe can
+    be generated again (or in another order) from the seed."""
+    for band in range(0, bands):
+        for yoff in range(0, height, block_rows):
+            rows = min(block_rows, height - yoff)
+            rng = np.random.RandomState([seed, band, yoff])
+            values = block_function(rng, yoff, rows)
+            if np.issubdtype(dtype, np.integer):
+                values = np.floor(values)
+            yield band, yoff, values.astype(dtype)
+
+def swell_block(rng, yoff, rows, width, minimum, maximum, wavelength, direction, noise):
+    """generate the 'rows' rows starting at 'yoff' of a swell like field: a
+    sinusoid of the given 'wavelength' (in pixels) propagating towards
+    'direction' (degrees clockwise from the top of the image), scaled to
+    [minimum, maximum] and mixed with a fraction 'noise' of uniform noise."""
+    wavenumber = 2 * np.pi / wavelength
+    kx = wavenumber * np.sin(np.radians(direction))
+    ky = -wavenumber * np.cos(np.radians(direction))
+    cols = np.arange(width, dtype=np.float32)
+    lines = np.arange(yoff, yoff + rows, dtype=np.float32)[:, np.newaxis]
+    swell = 0.5 + 0.5 * np.cos(kx * cols + ky * lines)
+    values = (1 - noise) * swell + noise * rng.uniform(0, 1, [rows, width])
+    return minimum + (maximum - minimum) * values
+
+def h5py_create_image(target_file, values, shape=None, dtype=None):
     """create an HDF5 image from a 3D matrix, where the 1th dimension represents the bands,
-    2th the rows, and the 3th the lines of the image"""
+    2th the rows, and the 3th the lines of the image. 'values' can also be an iterable of
+    (band, yoff, rows) blocks (e.g. see generate_blocks), written into a chunked and
+    compressed dataset of the given 'shape' and 'dtype'."""
     hdf_file = h5py.File(target_file, 'w')
     dataset_name = basename(splitext(target_file)[0])
-    hdf_file.create_dataset(dataset_name, data=values)
+    if isinstance(values, np.ndarray):
+        hdf_file.create_dataset(dataset_name, data=values)
+    else:
+        chunks = (1, min(BLOCK_ROWS, shape[1]), min(BLOCK_ROWS, shape[2]))
+        dataset = hdf_file.create_dataset(dataset_name, shape, dtype=dtype, chunks=chunks,
+                                          compression='gzip')
+        for band, yoff, rows in values:
+            dataset[band, yoff:yoff + rows.shape[0], :] = rows
     hdf_file.close()
     return hdf_file
 
-def gdal_create_image(target_file, width, height, bands, img_format, values):
+def gdal_create_image(target_file, width, height, bands, img_format, values,
+                      data_type=gdal.GDT_Float32, options=None):
     """create an gdal compatible image from a 3D matrix, where 1th dimension represents the
-    bands, 2th the rows, and the 3th the lines of the image"""
+    bands, 2th the rows, and the 3th the lines of the image. 'values' can also be an iterable
+    of (band, yoff, rows) blocks (e.g. see generate_blocks), written one at a time."""
     driver = gdal.GetDriverByName(img_format)
     if not driver:
         raise Exception('No gdal driver was found for %s.' % img_format)
-    dataset = driver.Create(target_file, width, height, bands, gdal.GDT_Float32)
-    for i in range(0, bands):
-        dataset.GetRasterBand(i+1).WriteArray(values[i])
+    dataset = driver.Create(target_file, width, height, bands, data_type, options or [])
+    if isinstance(values, np.ndarray):
+        for i in range(0, bands):
+            dataset.GetRasterBand(i+1).WriteArray(values[i])
+    else:
+        for band, yoff, rows in values:
+            dataset.GetRasterBand(band+1).WriteArray(rows, 0, yoff)
     dataset.FlushCache()
     return dataset
 
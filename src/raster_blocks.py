@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+#==============================================================================
+#                         <raster_blocks.py>
+#==============================================================================
+# Project   : Co-ReSyF
+# Company   : Deimos Engenharia
+# Component : Co-ReSyF Tools (block-wise raster access)
+# Language  : Python (v.2.7)
+#------------------------------------------------------------------------------
+# Scope : (see the following docstring)
+# Usage : ---
+#==============================================================================
+# $LastChangedRevision:  $:
+# $LastChangedBy:  $:
+# $LastChangedDate:  $:
+#==============================================================================
+
+'''
+This module gathers the helpers used by the tools to walk a GDAL raster block
+by block, so that images larger than the available memory can be processed
+with a bounded memory footprint.
+
+'''
+
+''' SYSTEM MODULES '''
+
+
+# Minimum number of rows read at once when the native blocks are scanlines
+# (striped GeoTIFF files have 1 row high blocks).
+MIN_BLOCK_ROWS = 256
+
+
+def block_windows(band, min_rows=MIN_BLOCK_ROWS, rows=None):
+    """Yield the (xoff, yoff, xsize, ysize) windows covering 'band', aligned
+    with its native block size. Blocks lower than 'min_rows' are grouped
+    vertically so that scanline organised files are not read row by row.
+    'rows' optionally restricts the windows to a (yoff, ysize) stripe."""
+    block_xsize, block_ysize = band.GetBlockSize()
+    if block_ysize < min_rows:
+        block_ysize *= max(1, min_rows // block_ysize)
+    width = band.XSize
+    first, height = rows or (0, band.YSize)
+    for yoff in xrange(first, first + height, block_ysize):
+        ysize = min(block_ysize, first + height - yoff)
+        for xoff in xrange(0, width, block_xsize):
+            xsize = min(block_xsize, width - xoff)
+            yield xoff, yoff, xsize, ysize
+
+
+def row_stripes(band, count, min_rows=MIN_BLOCK_ROWS):
+    """Split 'band' into at most 'count' (yoff, ysize) stripes of whole rows,
+    with boundaries aligned with the native block rows so that no block is
+    read by two stripes."""
+    block_ysize = band.GetBlockSize()[1]
+    if block_ysize < min_rows:
+        block_ysize *= max(1, min_rows // block_ysize)
+    nblocks = -(-band.YSize // block_ysize)
+    step = -(-nblocks // max(1, count)) * block_ysize
+    return [(yoff, min(step, band.YSize - yoff))
+            for yoff in xrange(0, band.YSize, step)]
+
+
+def tiled_options(img_format):
+    """Return the GDAL creation options producing a tiled and compressed
+    output for 'img_format' (empty list for drivers without such options)."""
+    if img_format == 'GTiff':
+        return ['TILED=YES', 'COMPRESS=DEFLATE', 'BIGTIFF=IF_SAFER']
+    if img_format == 'HFA':
+        return ['COMPRESSED=YES']
+    if img_format == 'netCDF':
+        return ['COMPRESS=DEFLATE']
+    return []
@@ -0,0 +1,54 @@
+#/bin/bash 
+
+source ./helpers.sh
+
+cd ..
+
+#gets the test file: 3000 random points (X, Y, Z) and their virtual dataset header
+python -c "
+import numpy as np
+rng = np.random.RandomState(0)
+np.savetxt('points_test.csv', np.column_stack((rng.uniform(0, 5000, 3000), rng.uniform(0, 4000, 3000), rng.uniform(-50, 0, 3000))),
+	fmt='%.3f', delimiter=',', header='x,y,z', comments='')
+"
+cat > points_test.vrt <<VRT
+<OGRVRTDataSource>
+    <OGRVRTLayer name="points_test">
+        <SrcDataSource>points_test.csv</SrcDataSource>
+        <GeometryType>wkbPoint</GeometryType>
+        <GeometryField encoding="PointFromColumns" x="x" y="y" z="z"/>
+    </OGRVRTLayer>
+</OGRVRTDataSource>
+VRT
+
+#Nominal cases:
+
+#default algorithm (invdist with all the points) on the default grid, within 1 GB
+(ulimit -v 1048576; src/coresyf_pointsToGrid.py -s points_test.vrt -o grid_test.tif)
+test -f grid_test.tif
+check "invdist, all the points, 3000 points on the default grid"
+
+python -c "
+from osgeo import gdal
+values = gdal.Open('grid_test.tif').ReadAsArray()
+assert values.shape == (250, 250) and values.min() >= -50 and values.max() <= 0
+"
+check "invdist values within the range of the points"
+rm -f grid_test.tif
+
+src/coresyf_pointsToGrid.py -s points_test.vrt -a invdistnn -o grid_test.tif --radius=200 --workers=2
+test -f grid_test.tif
+check "invdistnn, 2 workers"
+rm -f grid_test.tif
+
+src/coresyf_pointsToGrid.py -s points_test.vrt -a linear -o grid_test.tif
+test -f grid_test.tif
+check "linear"
+rm -f grid_test.tif
+
+#Error cases:
+src/coresyf_pointsToGrid.py -s missing_points.vrt -o grid_test.tif
+test $? -ne 0
+check "source missing"
+
+rm -f points_test.csv points_test.vrt grid_test.tif
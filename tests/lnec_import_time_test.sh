@@ -0,0 +1,28 @@
+#/bin/bash 
+
+source ./helpers.sh
+
+cd ../src/LNEC
+
+#Nominal cases:
+
+python SAR_ImportTime.py -o importtime.json
+check "no optional dependency imported at startup or by a Radial grid point"
+
+#module counts of the committed baseline (a missing baseline is an error)
+python SAR_ImportTime.py -b importtime_baseline.json
+check "modules loaded at startup within the baseline"
+rm -f importtime.json
+
+#Error cases:
+python SAR_ImportTime.py -f numpy
+test $? -ne 0
+check "forbidden module imported"
+
+python SAR_ImportTime.py -s SAR_Spectrum -m Waves -r 1
+test $? -ne 0
+check "skimage imported by a Waves grid point"
+
+python SAR_ImportTime.py -b missing_baseline.json
+test $? -ne 0
+check "baseline missing"